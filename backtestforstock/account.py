@@ -1,3 +1,4 @@
+import numpy as np
 import pandas as pd
 from datetime import datetime as dt
 from .position import PositionManager, Position
@@ -10,12 +11,57 @@ class Account:
 
     def __init__(self,
                  initial_cash: int,
-                 logger: Logger
+                 logger: Logger,
+                 position_manager=None,
+                 history_manager: HistoryManager = None,
+                 order_book=None
                  ):
+        """
+        :param initial_cash:
+        :param logger:
+        :param position_manager: PositionManager or ArrayPositionManager. defaultは PositionManager
+            大量のポジションを持つ場合は ArrayPositionManager(logger=logger) を渡すとメモリが少なくなる
+        :param history_manager: defaultは HistoryManager(logger=logger)
+            取引履歴が多い場合は HistoryManager(logger=logger, spill_path=...) を渡すとファイルに書き出す
+        :param order_book: OrderBook. 渡すと uses_order_book=True のコールバック(OrderCallback)は trade では呼ばず、
+            BackTester が毎ステップ全銘柄について OrderBook で判定する。defaultは無し(trade した銘柄だけ判定する)
+        """
         self.cash = initial_cash
-        self.position_manager = PositionManager(logger=logger)
-        self.history_manager = HistoryManager(logger=logger)
+        if position_manager is None:
+            position_manager = PositionManager(logger=logger)
+        self.position_manager = position_manager
+        if history_manager is None:
+            history_manager = HistoryManager(logger=logger)
+        self.history_manager = history_manager
+        self.order_book = order_book
         self.logger = logger
+        self.amounts = None
+        self._amount_codes = None
+
+    def track_amounts(self,
+                      codes: pd.Index):
+        """
+        code毎のポジション量の合計を、codes の順の配列(amounts)で持つ
+        以降は open_position / close_position の度に更新するので、position_manager を毎回集計しなくてよい
+        codes に無いcodeのポジションは含めない
+        :param codes:
+        :return:
+        """
+        self._amount_codes = {code: i for i, code in enumerate(codes)}
+        self.amounts = np.zeros(len(codes))
+        for code, amount in self.position_manager.amount_by_code().items():
+            i = self._amount_codes.get(code)
+            if i is not None:
+                self.amounts[i] = amount
+
+    def _add_amount(self,
+                    code: str,
+                    amount: float):
+        if self.amounts is None:
+            return
+        i = self._amount_codes.get(code)
+        if i is not None:
+            self.amounts[i] += amount
 
     def _validate_order(self,
                         record: pd.Series,
@@ -44,9 +90,14 @@ class Account:
                        amount: float,
                        price: float,
                        date: dt):
+        # float32 の価格(型付きで読み込んだデータ)で cash が float32 にならないようにする
+        price = float(price)
         self.position_manager.close_position(position=position,
                                              amount=amount)
-        self.cash += amount * price
+        self._add_amount(code=position.code, amount=-amount)
+        self.cash += float(amount) * price
+        if self.order_book is not None and position.amount == 0:
+            self.order_book.discard(position)
         if position.category == "short":
             category = "long"
         else:
@@ -66,18 +117,24 @@ class Account:
                       price: float,
                       category: str,
                       callbacks: List[PositionCallback]):
+        price = float(price)
         self.position_manager.open_position(code=code,
                                             date=date,
                                             amount=amount,
                                             price=price,
                                             category=category,
                                             callbacks=callbacks)
+        self._add_amount(code=code, amount=amount)
+        if self.order_book is not None:
+            for callback in callbacks:
+                if callback.uses_order_book:
+                    self.order_book.add(callback)
         self.history_manager.add(code=code,
                                  date=date,
                                  amount=amount,
                                  price=price,
                                  category=category)
-        self.cash -= amount * price
+        self.cash -= float(amount) * price
 
     def trade(self,
               data: pd.Series,
@@ -97,11 +154,14 @@ class Account:
         self.logger.info(f"\n")
         self.logger.info(f"trade start! code: {data.code} amount: {amount}, price: {price}, category: {category}, cash: {self.cash}")
         category = category.lower()
+        price = float(price)
 
         # callbacks(on_step_begin)
         positions = self.position_manager.get_positions(code=data["code"])
         for position in positions:
             for callback in position.callbacks:
+                if self.order_book is not None and callback.uses_order_book:
+                    continue
                 callback.on_step_begin(account=self,
                                        data=data)
 
@@ -152,6 +212,8 @@ class Account:
         positions = self.position_manager.get_positions(code=data["code"])
         for position in positions:
             for callback in position.callbacks:
+                if self.order_book is not None and callback.uses_order_book:
+                    continue
                 callback.on_step_end(account=self,
                                      data=data)
 
@@ -160,8 +222,122 @@ class Account:
 
         return
 
-    def report(self):
-        pass
+    def _run_callbacks(self,
+                       code: str,
+                       data: pd.Series,
+                       phase: str):
+        """
+        code の全ポジションのコールバックを呼ぶ(order_book で判定するものは除く)
+        :param code:
+        :param data:
+        :param phase: "begin" or "end"
+        :return:
+        """
+        for position in self.position_manager.get_positions(code=code):
+            for callback in position.callbacks:
+                if self.order_book is not None and callback.uses_order_book:
+                    continue
+                if phase == "begin":
+                    callback.on_step_begin(account=self,
+                                           data=data)
+                else:
+                    callback.on_step_end(account=self,
+                                         data=data)
+
+    def trade_many(self,
+                   data: pd.DataFrame,
+                   amount,
+                   price,
+                   category,
+                   callbacks: list = None):
+        """
+        data の行の順に trade(data=data.iloc[i], amount=amount[i], price=price[i], category=category[i],
+        callbacks=callbacks[i]) したのと同じ結果(現金、ポジション、取引履歴とその順序)になるように、まとめて取引する
+        1注文ごとのログ出力を省き、コールバックを持つポジションが無い銘柄はコールバックの確認を省く
+        :param data: 1行が1注文。columns: code, date (+ コールバックが参照するカラム(open, high, low 等))
+        :param amount: 注文ごとの取引量(配列) or 全注文共通の値
+        :param price: 注文ごとの取引価格(配列) or 全注文共通の値
+        :param category: 注文ごとの "long" or "short"(配列) or 全注文共通の値
+        :param callbacks: 注文ごとのコールバックのリスト(新規ポジションに付ける)のリスト。defaultは無し
+        :return:
+        """
+        n = len(data)
+        codes = data["code"].tolist()
+        dates = data["date"].tolist()
+        amounts = np.broadcast_to(np.asarray(amount), (n,)).tolist()
+        prices = np.broadcast_to(np.asarray(price), (n,)).tolist()
+        if isinstance(category, str):
+            categories = [category.lower()] * n
+        else:
+            categories = [x.lower() for x in category]
+        if callbacks is None:
+            callbacks = [[]] * n
+        if len(categories) != n or len(callbacks) != n:
+            raise ValueError(f"注文の数が合いません。 data: {n}, category: {len(categories)}, callbacks: {len(callbacks)}")
+        self.logger.debug(f"trade_many start! orders: {n}, cash: {self.cash}")
+
+        position_manager = self.position_manager
+        for i in range(n):
+            code = codes[i]
+            amount = amounts[i]
+            price = prices[i]
+            category = categories[i]
+            positions = position_manager.get_positions(code=code)
+            has_callbacks = any(len(position.callbacks) > 0 for position in positions)
+
+            # callbacks(on_step_begin)
+            row = None
+            if has_callbacks:
+                row = data.iloc[i]
+                self._run_callbacks(code=code, data=row, phase="begin")
+                positions = position_manager.get_positions(code=code)
+
+            # close position (long は相殺しない。short は建てた順に相殺する)
+            if category == "short":
+                for position in positions:
+                    if amount - position.amount >= 0:
+                        trade_amount = position.amount
+                    else:
+                        trade_amount = amount
+                    self.close_position(position=position,
+                                        amount=trade_amount,
+                                        price=price,
+                                        date=dates[i])
+                    amount -= trade_amount
+                    if amount == 0:
+                        break
+
+            # open position
+            if self.cash < amount * price:
+                continue
+            if amount < 0:
+                raise ValueError("amountが負の値になってます。ライブラリのバグです。。 amount: {}".format(amount))
+            if amount > 0:
+                self.open_position(code=code,
+                                   date=dates[i],
+                                   amount=amount,
+                                   price=price,
+                                   category=category,
+                                   callbacks=callbacks[i])
+
+            # callbacks(on_step_end)
+            if has_callbacks or (amount > 0 and len(callbacks[i]) > 0):
+                self._run_callbacks(code=code, data=data.iloc[i] if row is None else row, phase="end")
+
+        self.logger.debug(f"trade_many end. cash: {self.cash}")
+
+    def report(self,
+               reporter=None):
+        """
+        取引履歴の損益を集計する
+        :param reporter: defaultは SummaryReporter
+        :return: reporter.output_report の結果(SummaryReporterは Summary)
+        """
+        if reporter is None:
+            # reporter.core は Account を import しているので、ここで import する
+            from backtestforstock.reporter.core import SummaryReporter
+            reporter = SummaryReporter()
+        return reporter.output_report(account=self)
 
     def __del__(self):
         for handler in self.logger.handlers:
@@ -1,4 +1,5 @@
-
+import numpy as np
+import pandas as pd
 from backtestforstock.datafetchers.core import DataFetcher
 from backtestforstock.features.core import FeatureProcessor
 from backtestforstock.features.empty import NothingProcessor
@@ -28,14 +29,37 @@ class BackTester:
                  account: Account,
                  date_step_interval: str,
                  feature_processor: FeatureProcessor=None,
+                 max_lookback=None,
+                 precompute_features: bool = False,
+                 verify_samples: int = 5,
+                 early_stop=None,
+                 record_equity: bool = False,
                  ):
         """
 
         :param data_fetcher:
-        :param feature_processor:
+        :param feature_processor: _update_core を実装していて、data_fetcherがcursor modeなら
+            毎ステップ新しく追加された行だけを update に渡す(それ以外は毎ステップ transform)
+            その場合は開始前に reset するので、同じインスタンスを複数のBackTesterで使い回してもよい
         :param strategy:
         :param account_info:
         :param date_step_interval: "m", "h", "d" can use example: "10m", "1h", "2d"
+        :param max_lookback: int, timedelta or str. 毎ステップ渡す過去データの範囲
+            int: code毎の本数, timedelta or str: 期間 (strはdate_step_intervalと同じ書式)
+            defaultはdata_fetcherの設定のまま
+        :param precompute_features: Trueなら、開始前に全データに一度だけ feature_processor.precompute をかけ、
+            毎ステップはその結果を切り出す(data_fetcherがcursor modeの場合のみ)。
+            max_lookbackを指定しても、特徴量は全履歴から計算したものになる
+        :param verify_samples: precompute_features=Trueの場合に、先読みしていないか確認する時点の数(0なら確認しない)
+        :param early_stop: callable(account) -> bool. 毎ステップの後に呼び、Trueならそこで終了する
+            例: HistoryManager(statistics=OnlineStatistics()) を持つ account で、
+            lambda account: account.history_manager.statistics.max_drawdown > 100_000
+        :param record_equity: Trueなら、毎ステップの後に資産(現金 + 保有ポジションのその時点の最新の終値での評価額)を記録し、
+            equity_curve で取得できる(data_fetcherがcursor modeの場合のみ)。
+            評価額は summarize_account と同じく、ポジションの category に関わらず amount * 終値
+
+        account が order_book を持つ場合は、毎ステップ、戦略の取引前後に新しく範囲に入った足(code毎の最後の行)で
+        order_book.on_step_begin / on_step_end を呼ぶ(data_fetcherがcursor modeの場合のみ)
         """
         self.data_fetcher = data_fetcher
         self.strategy = strategy
@@ -45,13 +69,189 @@ class BackTester:
             self.feature_processor = NothingProcessor()
         else:
             self.feature_processor = feature_processor
+        if isinstance(max_lookback, str):
+            max_lookback = convert_date_step_interval(max_lookback)
+        if max_lookback is not None:
+            self.data_fetcher.max_lookback = max_lookback
         self.data_fetcher.datetime -= self.date_step_interval
+        self.early_stop = early_stop
+        self.stopped_early = False
+        self.record_equity = record_equity
+        if record_equity:
+            if self.data_fetcher.fetch_mode != "cursor":
+                raise ValueError(f"record_equity は fetch_mode=cursor でのみ使用可能です。 fetch_mode: {self.data_fetcher.fetch_mode}")
+            self._init_equity()
+        if self.account.order_book is not None and self.data_fetcher.fetch_mode != "cursor":
+            raise ValueError(f"order_book は fetch_mode=cursor でのみ使用可能です。 fetch_mode: {self.data_fetcher.fetch_mode}")
+
+        self._features = {}
+        if precompute_features:
+            if self.data_fetcher.fetch_mode != "cursor":
+                raise ValueError(f"precompute_features は fetch_mode=cursor でのみ使用可能です。 fetch_mode: {self.data_fetcher.fetch_mode}")
+            self.feature_mode = "precompute"
+            self._precompute_features(verify_samples=verify_samples)
+        elif self.feature_processor.supports_incremental and self.data_fetcher.fetch_mode == "cursor":
+            self.feature_mode = "incremental"
+            # 前の実行(ParameterSweep, WalkForward 等で使い回した場合)の状態を持ち越さない
+            self.feature_processor.reset()
+        else:
+            self.feature_mode = "transform"
 
     def run(self):
         while not self.data_fetcher.end_of_data:
             self.step()
+            if self.early_stop is not None and self.early_stop(self.account):
+                self.stopped_early = True
+                break
+
+    def _init_equity(self):
+        """
+        資産の記録用の配列を用意する
+        最新の終値はcode毎の配列で持ち、毎ステップ新しく範囲に入った行の終値で上書きする
+        ポジション量も同じ順のcode毎の配列を Account に持たせる(Account.track_amounts)
+        :return:
+        """
+        df_data = self.data_fetcher.df_data
+        code_indices, codes = pd.factorize(df_data["code"])
+        self._equity_codes = pd.Index(codes)
+        self._equity_code_indices = code_indices
+        self._equity_close = df_data["close"].to_numpy(dtype=np.float64)
+        self._last_close = np.full(len(codes), np.nan)
+        self.account.track_amounts(self._equity_codes)
+
+        # ステップ数で確保する(足りなければ倍に伸ばす)
+        n_steps = int((self.data_fetcher.max_date - self.data_fetcher.datetime) / self.date_step_interval) + 1
+        self._n_equity = 0
+        self._equity = {name: np.empty(max(n_steps, 1), dtype=dtype)
+                        for name, dtype in [("date", "datetime64[ns]"), ("cash", np.float64), ("position_value", np.float64)]}
+
+    def _record_equity(self):
+        lo, hi = self.data_fetcher.prev_cursor, self.data_fetcher.cursor
+        # 同じcodeが複数行ある場合は、後(dateが新しい)の行の値になる
+        self._last_close[self._equity_code_indices[lo:hi]] = self._equity_close[lo:hi]
+
+        amounts = self.account.amounts
+        held = amounts != 0
+        position_value = float(amounts[held] @ self._last_close[held])
+
+        if self._n_equity == len(self._equity["date"]):
+            self._equity = {name: np.concatenate([values, np.empty_like(values)]) for name, values in self._equity.items()}
+        i = self._n_equity
+        self._equity["date"][i] = np.datetime64(pd.Timestamp(self.data_fetcher.datetime).value, "ns")
+        self._equity["cash"][i] = self.account.cash
+        self._equity["position_value"][i] = position_value
+        self._n_equity += 1
+
+    @property
+    def equity_curve(self) -> pd.DataFrame:
+        """
+        毎ステップの資産(record_equity=True の場合のみ)
+        :return: index: date(ステップの時刻), columns: cash, position_value, equity, drawdown(それまでの最大のequityからの下落幅)
+        """
+        if not self.record_equity:
+            raise ValueError("equity_curve は record_equity=True の場合のみ使用可能です")
+        n = self._n_equity
+        cash = self._equity["cash"][:n]
+        position_value = self._equity["position_value"][:n]
+        equity = cash + position_value
+        return pd.DataFrame({"cash": cash,
+                             "position_value": position_value,
+                             "equity": equity,
+                             "drawdown": np.maximum.accumulate(equity) - equity if n > 0 else equity},
+                            index=pd.DatetimeIndex(self._equity["date"][:n], name="date"))
+
+    def _precompute_features(self,
+                             verify_samples: int):
+        """
+        全データの特徴量を計算し、df_dataの行番号の位置に保存する
+        :param verify_samples:
+        :return:
+        """
+        df_data = self.data_fetcher.df_data
+        raw_columns = set(df_data.columns)
+        df_precomputed = self.feature_processor.precompute(df=df_data)
+        if verify_samples > 0:
+            self.feature_processor.verify_precompute(df=df_data,
+                                                     df_precomputed=df_precomputed,
+                                                     n_samples=verify_samples)
+        for col in df_precomputed.columns:
+            if col not in raw_columns:
+                self._features[col] = df_precomputed[col].to_numpy()
+
+    def _update_features(self):
+        """
+        新しく追加された行だけ feature_processor.update にかけ、特徴量をdf_dataの行番号の位置に保存する
+        :return:
+        """
+        df_new = self.data_fetcher.fetch_new()
+        if len(df_new) == 0:
+            return
+        df_new_processed = self.feature_processor.update(df=df_new)
+
+        start = self.data_fetcher.prev_cursor
+        for col in df_new_processed.columns:
+            if col in df_new.columns:
+                continue
+            values = df_new_processed[col].to_numpy()
+            if col not in self._features:
+                self._features[col] = np.empty(len(self.data_fetcher.df_data), dtype=values.dtype)
+            elif not np.can_cast(values.dtype, self._features[col].dtype):
+                self._features[col] = self._features[col].astype(np.result_type(self._features[col], values))
+            self._features[col][start:start + len(values)] = values
+
+    def _attach_features(self,
+                         df,
+                         positions):
+        """
+        保存した特徴量を付ける
+        :param df: data_fetcherから取得したデータ
+        :param positions: dfのdf_data上の行番号
+        :return: 特徴量を付けたデータ
+        """
+        return df.assign(**{col: values[positions] for col, values in self._features.items()})
+
+    def _new_bars(self) -> pd.DataFrame:
+        """
+        新しく範囲に入った行を、code毎に1本の足にまとめたもの
+        1ステップに複数の足が入る場合は 始値: 最初の足, 高値: 最大, 安値: 最小, date: 最後の足
+        :return:
+        """
+        df_new = self.data_fetcher.fetch_new()
+        if not df_new["code"].duplicated().any():
+            return df_new
+        return df_new.groupby("code", sort=False, observed=True).agg(
+            date=("date", "last"),
+            open=("open", "first"),
+            high=("high", "max"),
+            low=("low", "min")
+        ).reset_index()
 
     def step(self):
-        df_data = self.data_fetcher.fetch(step=self.date_step_interval)
-        df_processed = self.feature_processor.transform(df=df_data)
-        self.strategy.trade(df_processed, self.account)
+        if self.strategy.use_partitioned_data:
+            data = self.data_fetcher.fetch_partitioned(step=self.date_step_interval)
+            if self.feature_mode == "incremental":
+                self._update_features()
+            if self.feature_mode in ["incremental", "precompute"]:
+                data_processed = {code: self._attach_features(df=df, positions=self.data_fetcher.last_positions[code])
+                                  for code, df in data.items()}
+            else:
+                data_processed = {code: self.feature_processor.transform(df=df) for code, df in data.items()}
+        else:
+            df_data = self.data_fetcher.fetch(step=self.date_step_interval)
+            if self.feature_mode == "incremental":
+                self._update_features()
+            if self.feature_mode in ["incremental", "precompute"]:
+                data_processed = self._attach_features(df=df_data, positions=self.data_fetcher.last_positions)
+            else:
+                data_processed = self.feature_processor.transform(df=df_data)
+
+        order_book = self.account.order_book
+        if order_book is not None:
+            df_bars = self._new_bars()
+            order_book.on_step_begin(account=self.account, df_bars=df_bars)
+        self.strategy.trade(data_processed, self.account)
+        if order_book is not None:
+            order_book.on_step_end(account=self.account, df_bars=df_bars)
+
+        if self.record_equity:
+            self._record_equity()
@@ -6,6 +6,9 @@ from logging import Logger
 
 class PositionCallback:
     """
+    uses_order_book: Trueなら、Account が OrderBook を持つ場合は on_step_begin / on_step_end を呼ばず、
+        OrderBook が limit_price / stop_price で判定して close(account, date, limit_price, stop_price) を呼ぶ
+
     def on_step_begin(self,
                       account: Account,
                       df: pd.DataFrame):
@@ -16,6 +19,8 @@ class PositionCallback:
                     df: pd.DataFrame):
         raise NotImplementedError
     """
+    uses_order_book = False
+
     def set_position(self,
                      position):
         self.position = position
@@ -17,7 +17,10 @@ class OrderCallback(PositionCallback):
 
     stop_price: float, default: None
         逆指値金額。dafaultは指定無し。
+
+    Account が OrderBook を持つ場合は、OrderBook が毎ステップ全銘柄について判定する(uses_order_book)
     """
+    uses_order_book = True
 
     def __init__(self,
                  logger: Logger = None,
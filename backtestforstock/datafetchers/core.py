@@ -1,7 +1,9 @@
+import numpy as np
 import pandas as pd
 from glob import glob
 from datetime import timedelta
 from datetime import datetime as dt
+from .loaders import load_data_files, filter_frame
 
 class DataFetcher:
     """
@@ -11,22 +13,85 @@ class DataFetcher:
     def __init__(self,
                  data_files: list = None,
                  df: pd.DataFrame = None,
-                 start_datetime: dt = None):
+                 start_datetime: dt = None,
+                 fetch_mode: str = "cursor",
+                 max_lookback=None,
+                 typed: bool = False,
+                 cache_dir: str = None,
+                 n_jobs: int = 1,
+                 parallel_backend: str = "thread",
+                 date_range: tuple = None,
+                 codes: list = None):
         """
         DataFetcherにDataFrameをセットする
+        cursor modeでは、fetch後に last_positions(返した行のdf_data上の行番号)と
+        prev_cursor/cursor(新しく範囲に入った行の範囲)を参照できる
         セットの方法は2通り。data_filesにファイルをセットするか、dfに直接DataFrameをセットする
-        :param data_dir:
+        :param data_files: 読み込むファイルのリスト
+            .csv, .parquet, .feather/.arrow/.arrows/.ipc, .npy(構造化配列), カラム毎の.npyを置いたディレクトリ
+            .csv以外はメモリマップで開く(dateでソート済みならコピーしない)
         :param df:
+        :param fetch_mode: "cursor" or "mask"
+            "cursor": 初期化時にdateで(安定)ソートし、searchsortedで進めるカーソルまでのスライスを返す
+                dateでソートされていないデータでも、fetchはmaskと同じく元のデータの行順で返す
+                (その場合はソート前のデータも保持し、範囲に入っている行をステップ毎に差分で更新する)
+            "mask": 毎ステップ全行に対して date <= datetime のマスクをかける(従来の挙動)
+        :param max_lookback: int or timedelta, default: None
+            fetchで返す過去データの範囲。defaultは先頭から全て
+            int: code毎に直近max_lookback本
+            timedelta: (datetime - max_lookback, datetime] の範囲
+        :param typed: Trueなら、CSVを型付きで読み込む
+            date: datetime64, code: category, open/close/high/low: float32
+        :param cache_dir: 指定した場合、型付きで読み込んだCSVをこのディレクトリにキャッシュし、
+            次回以降はファイルのパス・サイズ・更新時刻が同じならパースせずにキャッシュを読み込む
+        :param n_jobs: data_filesを読み込む並列数
+        :param parallel_backend: "thread" or "process". n_jobs > 1 の場合に使うプール
+        :param date_range: (開始, 終了)。この範囲のdateの行だけ読み込む(両端を含む、片方はNone可)
+            Parquetは行グループ・パーティション単位で読み飛ばす。
+            max_lookbackの分の過去データが必要なら、開始はstart_datetimeより前にすること
+        :param codes: このリストのcodeの行だけ読み込む
         """
         self.data_files = data_files
 
         if data_files is not None:
-            self.df_data = pd.concat([pd.read_csv(x) for x in self.data_files])
+            self.df_data = load_data_files(self.data_files,
+                                           typed=typed,
+                                           cache_dir=cache_dir,
+                                           n_jobs=n_jobs,
+                                           parallel_backend=parallel_backend,
+                                           date_range=date_range,
+                                           codes=codes)
         elif df is not None:
-            self.df_data = df
+            self.df_data = filter_frame(df, date_range=date_range, codes=codes)
         else:
             raise AttributeError("data_filesとdfが両方Nullです")
         self._validate_data(self.df_data)
+
+        if fetch_mode not in ["cursor", "mask"]:
+            raise ValueError(f"fetch_mode は cursor, mask のみ使用可能です。 入力: {fetch_mode}")
+        self.fetch_mode = fetch_mode
+        self._source_rows = None
+        if self.fetch_mode == "cursor":
+            if not self.df_data["date"].is_monotonic_increasing:
+                # ソート後の各行の、元のデータ上の行番号と、その逆(fetchで元の行順に戻すのに使う)
+                self._source_rows = np.argsort(self.df_data["date"].to_numpy(), kind="stable")
+                self._sorted_rows = np.empty_like(self._source_rows)
+                self._sorted_rows[self._source_rows] = np.arange(len(self._source_rows))
+                # 元のデータの行順で、範囲に入っている行(ステップ毎に増減した行だけ更新する)
+                self._active = np.zeros(len(self._source_rows), dtype=bool)
+                self._active_lo = 0
+                self._active_hi = 0
+                # fetchは元のデータから行を取り出す(ソート後のデータから元の行順に取り出すより速い)
+                self._df_source = self.df_data
+                self.df_data = self.df_data.iloc[self._source_rows]
+            self._dates = pd.Index(self.df_data["date"])
+        self.cursor = 0
+        self.prev_cursor = 0
+        self.last_positions = None
+        self._code_positions = None
+        self._partitions = None
+        self.max_lookback = max_lookback
+
         self.datetime = start_datetime
         self.end_of_data = False
         self.max_date = self.df_data["date"].max()
@@ -43,10 +108,149 @@ class DataFetcher:
                     """
                 )
 
-    def fetch(self,
-              step: timedelta):
+    @property
+    def max_lookback(self):
+        return self._max_lookback
+
+    @max_lookback.setter
+    def max_lookback(self, max_lookback):
+        if max_lookback is not None and not isinstance(max_lookback, (int, timedelta)):
+            raise ValueError(f"max_lookback は int か timedelta のみ使用可能です。 入力: {max_lookback}")
+        if isinstance(max_lookback, int) and max_lookback <= 0:
+            raise ValueError(f"max_lookback は1以上を指定してください。 入力: {max_lookback}")
+        self._max_lookback = max_lookback
+
+    def _get_code_positions(self) -> dict:
+        """
+        code毎の行番号(昇順)を返す。初回呼び出し時に一度だけ作る
+        :return: dict code -> np.ndarray
+        """
+        if self._code_positions is None:
+            self._code_positions = self.df_data.groupby("code", sort=False, observed=True).indices
+        return self._code_positions
+
+    def _get_partitions(self) -> dict:
+        """
+        code毎に分割したデータ(date昇順)と、そのdateのIndex、df_data上の行番号を返す。初回呼び出し時に一度だけ作る
+        順序は groupby("code") と同じくcodeの昇順
+        :return: dict code -> (pd.DataFrame, pd.Index, np.ndarray)
+        """
+        if self._partitions is None:
+            self._partitions = {}
+            for code, positions in sorted(self._get_code_positions().items()):
+                df_partition = self.df_data.iloc[positions]
+                self._partitions[code] = (df_partition, pd.Index(df_partition["date"]), positions)
+        return self._partitions
+
+    def _window_positions(self):
+        """
+        cursor modeで、現在のcursorまでのうちmax_lookbackに収まる行番号を返す
+        :return: slice or np.ndarray
+        """
+        if self.max_lookback is None:
+            return slice(0, self.cursor)
+
+        if isinstance(self.max_lookback, timedelta):
+            lo = self._dates.searchsorted(self.datetime - self.max_lookback, side="right")
+            return slice(lo, self.cursor)
+
+        positions = []
+        for code_positions in self._get_code_positions().values():
+            n = code_positions.searchsorted(self.cursor)
+            positions.append(code_positions[max(n - self.max_lookback, 0):n])
+        return np.sort(np.concatenate(positions))
+
+    def _source_order(self, positions):
+        """
+        ソート後の行番号の範囲を、元のデータ上の行番号(昇順)にする(dateでソートされていないデータのcursor mode)
+        スライスの場合は、前回から範囲に入った/外れた行だけ _active を更新し、毎ステップのソートを避ける
+        :param positions: slice or np.ndarray
+        :return: np.ndarray
+        """
+        if not isinstance(positions, slice):
+            return np.sort(self._source_rows[positions])
+
+        lo, hi = positions.start, positions.stop
+        # 範囲は前にしか進まない
+        self._active[self._source_rows[self._active_lo:min(lo, self._active_hi)]] = False
+        self._active[self._source_rows[max(lo, self._active_hi):hi]] = True
+        self._active_lo, self._active_hi = lo, hi
+        return np.flatnonzero(self._active)
+
+    def _sort_by_date(self, df):
+        """
+        dateで安定ソートする。同じdateの行は元の順序を保つ
+        ソート済みのデータはコピーせずそのまま返す
+        :param df:
+        :return:
+        """
+        if df["date"].is_monotonic_increasing:
+            return df
+        return df.sort_values("date", kind="mergesort")
+
+    def _advance(self,
+                 step: timedelta):
         self.datetime += step
-        df_fetch = self.df_data[self.df_data["date"] <= self.datetime]
+        if self.fetch_mode == "cursor":
+            self.prev_cursor = self.cursor
+            self.cursor = self._dates.searchsorted(self.datetime, side="right")
         if self.max_date <= self.datetime:
             self.end_of_data = True
+
+    def fetch(self,
+              step: timedelta):
+        self._advance(step=step)
+        if self.fetch_mode == "cursor":
+            positions = self._window_positions()
+            if self._source_rows is None:
+                self.last_positions = positions
+                df_fetch = self.df_data.iloc[positions]
+            else:
+                source_positions = self._source_order(positions)
+                self.last_positions = self._sorted_rows[source_positions]
+                df_fetch = self._df_source.iloc[source_positions]
+        else:
+            df_fetch = self.df_data[self.df_data["date"] <= self.datetime]
+            if isinstance(self.max_lookback, timedelta):
+                df_fetch = df_fetch[df_fetch["date"] > self.datetime - self.max_lookback]
+            elif self.max_lookback is not None:
+                df_fetch = df_fetch.groupby("code", sort=False, observed=True).tail(self.max_lookback)
         return df_fetch
+
+    def fetch_partitioned(self,
+                          step: timedelta) -> dict:
+        """
+        fetchと同じ範囲のデータを、code毎に分割して返す
+        cursor modeでは初回にcode毎に分割したデータのスライスを返すので、毎ステップのgroupbyが不要
+        データが無いcodeは含まない
+        :param step:
+        :return: dict code -> pd.DataFrame
+        """
+        if self.fetch_mode == "mask":
+            return {code: df for code, df in self.fetch(step=step).groupby("code", observed=True)}
+
+        self._advance(step=step)
+        ret = {}
+        self.last_positions = {}
+        for code, (df_partition, dates, positions) in self._get_partitions().items():
+            n = dates.searchsorted(self.datetime, side="right")
+            if self.max_lookback is None:
+                lo = 0
+            elif isinstance(self.max_lookback, timedelta):
+                lo = dates.searchsorted(self.datetime - self.max_lookback, side="right")
+            else:
+                lo = max(n - self.max_lookback, 0)
+            if n > lo:
+                ret[code] = df_partition.iloc[lo:n]
+                self.last_positions[code] = positions[lo:n]
+        return ret
+
+    def fetch_new(self) -> pd.DataFrame:
+        """
+        直前のfetch(fetch_partitioned)で新しく範囲に入った行を返す(cursor modeのみ)
+        max_lookbackに関わらず、前回のcursorから今回のcursorまでの全行
+        :return:
+        """
+        if self.fetch_mode != "cursor":
+            raise ValueError(f"fetch_new は fetch_mode=cursor でのみ使用可能です。 fetch_mode: {self.fetch_mode}")
+        return self.df_data.iloc[self.prev_cursor:self.cursor]
@@ -0,0 +1,558 @@
+import os
+import hashlib
+import collections
+import functools
+import itertools
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from glob import glob
+
+PRICE_COLUMNS = ["open", "close", "high", "low"]
+# apply_schema の内容を変えたら上げる(古いキャッシュを使わないようにするため)
+SCHEMA_VERSION = 1
+
+
+def _import_pyarrow():
+    try:
+        import pyarrow
+    except ImportError:
+        raise ImportError("Parquet/Feather/Arrow IPCの読み込みには pyarrow が必要です。 pip install pyarrow")
+    return pyarrow
+
+
+def apply_schema(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    型を揃える
+    date: datetime64, code: category, open/close/high/low: float32, volume: 整数ならできるだけ小さい整数型
+    :param df:
+    :return:
+    """
+    columns = {}
+    if not pd.api.types.is_datetime64_any_dtype(df["date"]):
+        columns["date"] = pd.to_datetime(df["date"])
+    if not isinstance(df["code"].dtype, pd.CategoricalDtype):
+        columns["code"] = df["code"].astype(str).astype("category")
+    for col in PRICE_COLUMNS:
+        columns[col] = pd.to_numeric(df[col], downcast="float")
+    if "volume" in df:
+        if pd.api.types.is_integer_dtype(df["volume"]):
+            columns["volume"] = pd.to_numeric(df["volume"], downcast="integer")
+        else:
+            columns["volume"] = pd.to_numeric(df["volume"], downcast="float")
+    return df.assign(**columns)
+
+
+def read_csv_typed(path: str) -> pd.DataFrame:
+    """
+    CSVを型付きで読み込む(codeは先頭の0が消えないよう文字列として読む)
+    :param path:
+    :return:
+    """
+    df = pd.read_csv(path, dtype={"code": str}, parse_dates=["date"])
+    return apply_schema(df)
+
+
+def _cache_path(path: str,
+                cache_dir: str) -> str:
+    """
+    ファイルのパス、サイズ、更新時刻をキーにしたキャッシュファイルのパス
+    :param path:
+    :param cache_dir:
+    :return:
+    """
+    stat = os.stat(path)
+    key = f"{os.path.abspath(path)}|{stat.st_size}|{stat.st_mtime_ns}|{SCHEMA_VERSION}"
+    return os.path.join(cache_dir, hashlib.sha1(key.encode()).hexdigest() + ".pkl")
+
+
+def read_csv_cached(path: str,
+                    cache_dir: str) -> pd.DataFrame:
+    """
+    read_csv_typed の結果をキャッシュする。ファイルが更新されていなければキャッシュから読み込む
+    :param path:
+    :param cache_dir:
+    :return:
+    """
+    cache_path = _cache_path(path=path, cache_dir=cache_dir)
+    if os.path.exists(cache_path):
+        return pd.read_pickle(cache_path)
+
+    df = read_csv_typed(path)
+    os.makedirs(cache_dir, exist_ok=True)
+    # 同時に実行している他のプロセスが書きかけのキャッシュを読まないよう、一時ファイルに書いてからrenameする
+    tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+    df.to_pickle(tmp_path)
+    os.replace(tmp_path, cache_path)
+    return df
+
+
+def filter_frame(df: pd.DataFrame,
+                 date_range: tuple = None,
+                 codes: list = None) -> pd.DataFrame:
+    """
+    date_range, codes で行を絞り込む
+    :param df:
+    :param date_range: (開始, 終了)。両端を含む。片方はNoneでもよい
+    :param codes: 読み込むcodeのリスト。codeは文字列として比較する
+    :return:
+    """
+    if date_range is None and codes is None:
+        return df
+
+    mask = np.ones(len(df), dtype=bool)
+    if date_range is not None:
+        dates = df["date"]
+        if not pd.api.types.is_datetime64_any_dtype(dates):
+            dates = pd.to_datetime(dates)
+        start, end = date_range
+        if start is not None:
+            mask &= (dates >= start).to_numpy()
+        if end is not None:
+            mask &= (dates <= end).to_numpy()
+    if codes is not None:
+        mask &= df["code"].astype(str).isin([str(x) for x in codes]).to_numpy()
+
+    if mask.all():
+        return df
+    return df[mask]
+
+
+def arrow_filter(schema,
+                 date_range: tuple = None,
+                 codes: list = None):
+    """
+    filter_frame と同じ条件の pyarrow.dataset の Expression を作る
+    Parquetの行グループの統計情報や、hiveパーティションのディレクトリで読み飛ばすのに使う
+    :param schema: pyarrow.Schema
+    :param date_range:
+    :param codes:
+    :return: Expression (条件が無ければNone)
+    """
+    pa = _import_pyarrow()
+    import pyarrow.dataset as ds
+
+    expressions = []
+    if date_range is not None:
+        date_field = ds.field("date")
+        if not pa.types.is_timestamp(schema.field("date").type):
+            date_field = date_field.cast(pa.timestamp("ns"))
+        start, end = date_range
+        if start is not None:
+            expressions.append(date_field >= pa.scalar(pd.Timestamp(start), type=pa.timestamp("ns")))
+        if end is not None:
+            expressions.append(date_field <= pa.scalar(pd.Timestamp(end), type=pa.timestamp("ns")))
+    if codes is not None:
+        code_field = ds.field("code")
+        if not pa.types.is_string(schema.field("code").type):
+            code_field = code_field.cast(pa.string())
+        expressions.append(code_field.isin([str(x) for x in codes]))
+
+    if len(expressions) == 0:
+        return None
+    return functools.reduce(lambda a, b: a & b, expressions)
+
+
+def read_csv_filtered(path: str,
+                      typed: bool = False,
+                      date_range: tuple = None,
+                      codes: list = None,
+                      chunksize: int = 1_000_000) -> pd.DataFrame:
+    """
+    CSVをチャンク毎に読み込みながら絞り込む。絞り込み前の全データを保持しない
+    codes を指定した場合は、typed でなくても code を文字列として読む(先頭の0が消えて一致しなくならないように)
+    :param path:
+    :param typed:
+    :param date_range:
+    :param codes:
+    :param chunksize:
+    :return:
+    """
+    kwargs = {"dtype": {"code": str}, "parse_dates": ["date"]} if typed else {}
+    if codes is not None:
+        kwargs["dtype"] = {"code": str}
+    with pd.read_csv(path, chunksize=chunksize, **kwargs) as reader:
+        frames = [filter_frame(df, date_range=date_range, codes=codes) for df in reader]
+    df = pd.concat(frames)
+    if typed:
+        df = apply_schema(df)
+    return df
+
+
+def read_parquet(path: str,
+                 date_range: tuple = None,
+                 codes: list = None) -> pd.DataFrame:
+    """
+    Parquetをメモリマップで読み込む
+    date_range, codes を指定した場合、条件に合わない行グループは読み込まない
+    :param path:
+    :param date_range:
+    :param codes:
+    :return:
+    """
+    _import_pyarrow()
+    import pyarrow.parquet as pq
+
+    filters = arrow_filter(pq.read_schema(path), date_range=date_range, codes=codes)
+    table = pq.read_table(path, memory_map=True, filters=filters)
+    return table.to_pandas(split_blocks=True, self_destruct=True)
+
+
+def read_parquet_dataset(path: str,
+                         date_range: tuple = None,
+                         codes: list = None) -> pd.DataFrame:
+    """
+    hiveパーティション(例: <path>/date=2020-01-01/code=0000/*.parquet)のParquetディレクトリを読み込む
+    date_range, codes を指定した場合、条件に合わないパーティション・行グループは読み込まない
+    パーティションの date, code は文字列として読み込み(codeの先頭の0を消さないため)、date は読み込み後に日時に変換する
+    :param path: ディレクトリ
+    :param date_range:
+    :param codes:
+    :return:
+    """
+    pa = _import_pyarrow()
+    import pyarrow.dataset as ds
+
+    partition_schema = ds.dataset(path, format="parquet", partitioning="hive").partitioning.schema
+    fields = []
+    for field in partition_schema:
+        if field.name in ["date", "code"]:
+            fields.append(pa.field(field.name, pa.string()))
+        else:
+            fields.append(field)
+    dataset = ds.dataset(path,
+                         format="parquet",
+                         partitioning=ds.partitioning(pa.schema(fields), flavor="hive"))
+
+    filters = arrow_filter(dataset.schema, date_range=date_range, codes=codes)
+    table = dataset.to_table(filter=filters)
+    df = table.to_pandas(split_blocks=True, self_destruct=True)
+    if "date" in partition_schema.names:
+        df["date"] = pd.to_datetime(df["date"]).astype("datetime64[ns]")
+    return df
+
+
+def read_arrow_ipc(path: str,
+                   date_range: tuple = None,
+                   codes: list = None) -> pd.DataFrame:
+    """
+    Feather(v2)/Arrow IPC(file, stream形式)をメモリマップで読み込む
+    非圧縮かつnullの無い数値カラムは、コピーせずページキャッシュを直接参照する
+    date_range, codes を指定した場合、pandasに変換する前に絞り込む
+    :param path:
+    :param date_range:
+    :param codes:
+    :return:
+    """
+    pa = _import_pyarrow()
+
+    source = pa.memory_map(path, "r")
+    try:
+        table = pa.ipc.open_file(source).read_all()
+    except pa.ArrowInvalid:
+        source.seek(0)
+        table = pa.ipc.open_stream(source).read_all()
+
+    filters = arrow_filter(table.schema, date_range=date_range, codes=codes)
+    if filters is not None:
+        table = table.filter(filters)
+    return table.to_pandas(split_blocks=True)
+
+
+def read_npy_columns(path: str) -> pd.DataFrame:
+    """
+    カラム毎の .npy ファイル(<path>/<カラム名>.npy)をメモリマップで読み込む
+    :param path: ディレクトリ
+    :return:
+    """
+    files = sorted(glob(os.path.join(path, "*.npy")))
+    if len(files) == 0:
+        raise ValueError(f"ディレクトリに .npy ファイルがありません。 path: {path}")
+
+    columns = {}
+    for file in files:
+        column = os.path.splitext(os.path.basename(file))[0]
+        columns[column] = np.load(file, mmap_mode="r")
+    return pd.DataFrame(columns, copy=False)
+
+
+def read_npy(path: str) -> pd.DataFrame:
+    """
+    構造化配列の .npy ファイルをメモリマップで読み込む
+    :param path:
+    :return:
+    """
+    array = np.load(path, mmap_mode="r")
+    if array.dtype.names is None:
+        raise ValueError(f".npy ファイルは構造化配列である必要があります。 path: {path}")
+    return pd.DataFrame({name: array[name] for name in array.dtype.names}, copy=False)
+
+
+def load_data_file(path: str,
+                   typed: bool = False,
+                   cache_dir: str = None,
+                   date_range: tuple = None,
+                   codes: list = None) -> pd.DataFrame:
+    """
+    拡張子に応じてデータファイルを読み込む
+    .csv, .parquet, .feather/.arrow/.arrows/.ipc, .npy(構造化配列),
+    .npyを含むディレクトリ, hiveパーティションのParquetディレクトリ に対応
+    :param path:
+    :param typed: Trueなら、CSVを apply_schema の型で読み込む
+    :param cache_dir: 指定した場合、型付きで読み込んだCSVをキャッシュする(typed=Trueとみなす)
+    :param date_range: (開始, 終了)。指定した範囲のdateの行だけ読み込む
+    :param codes: 指定したcodeの行だけ読み込む
+    :return:
+    """
+    if os.path.isdir(path):
+        if len(glob(os.path.join(path, "*.npy"))) > 0:
+            return filter_frame(read_npy_columns(path), date_range=date_range, codes=codes)
+        return read_parquet_dataset(path, date_range=date_range, codes=codes)
+
+    ext = os.path.splitext(path)[1].lower()
+    if ext == ".csv":
+        if cache_dir is not None:
+            return filter_frame(read_csv_cached(path, cache_dir=cache_dir), date_range=date_range, codes=codes)
+        if date_range is not None or codes is not None:
+            return read_csv_filtered(path, typed=typed, date_range=date_range, codes=codes)
+        if typed:
+            return read_csv_typed(path)
+        return pd.read_csv(path)
+    if ext == ".parquet":
+        return read_parquet(path, date_range=date_range, codes=codes)
+    if ext in [".feather", ".arrow", ".arrows", ".ipc"]:
+        return read_arrow_ipc(path, date_range=date_range, codes=codes)
+    if ext == ".npy":
+        return filter_frame(read_npy(path), date_range=date_range, codes=codes)
+    raise ValueError(f"対応していないファイル形式です。 path: {path}")
+
+
+def iter_data_file(path: str,
+                   chunksize: int):
+    """
+    データファイルを先頭から chunksize 行程度ずつ読み込むイテレータ
+    (Feather/Arrow IPCはファイル内のレコードバッチ単位)
+    :param path:
+    :param chunksize:
+    :return: pd.DataFrame のイテレータ
+    """
+    if os.path.isdir(path) or os.path.splitext(path)[1].lower() == ".npy":
+        df = load_data_file(path)
+        for i in range(0, len(df), chunksize):
+            yield df.iloc[i:i + chunksize]
+        return
+
+    ext = os.path.splitext(path)[1].lower()
+    if ext == ".csv":
+        with pd.read_csv(path, chunksize=chunksize) as reader:
+            for df in reader:
+                yield df
+        return
+    if ext == ".parquet":
+        _import_pyarrow()
+        import pyarrow.parquet as pq
+
+        parquet_file = pq.ParquetFile(path, memory_map=True)
+        for batch in parquet_file.iter_batches(batch_size=chunksize):
+            yield batch.to_pandas()
+        return
+    if ext in [".feather", ".arrow", ".arrows", ".ipc"]:
+        pa = _import_pyarrow()
+
+        source = pa.memory_map(path, "r")
+        try:
+            reader = pa.ipc.open_file(source)
+            batches = (reader.get_batch(i) for i in range(reader.num_record_batches))
+        except pa.ArrowInvalid:
+            source.seek(0)
+            batches = pa.ipc.open_stream(source)
+        for batch in batches:
+            yield batch.to_pandas(split_blocks=True)
+        return
+    raise ValueError(f"対応していないファイル形式です。 path: {path}")
+
+
+def _is_mergeable_dtype(dtype) -> bool:
+    if isinstance(dtype, pd.CategoricalDtype):
+        return True
+    if isinstance(dtype, pd.StringDtype):
+        return True
+    return isinstance(dtype, np.dtype)
+
+
+class _FrameMerger:
+    """
+    同じカラムを持つDataFrameを1つずつ受け取り、カラム毎の配列の後ろに追記していく
+    配列は足りなくなったら ndarray.resize で伸ばす(大きな配列はreallocで伸びるので、全体のコピーを伴わないことが多い)
+    追記し終わったDataFrameは保持しないので、pd.concat のように全DataFrameと結合結果を同時に保持しなくて済む
+
+    categoryのカラムはcategoryを追加しながら番号で持ち、最後に全DataFrameのcategoryを合わせたもの(昇順)にする
+    カラムが異なる、または対応していない型のDataFrameを受け取った以降は、pd.concat で結合する
+    """
+    MIN_CAPACITY = 1024
+
+    def __init__(self):
+        self.columns = None
+        self.buffers = {}
+        self.categories = {}  # col -> {category: 番号}
+        self.n = 0
+        self.fallback = None
+
+    def _capacity(self) -> int:
+        return len(next(iter(self.buffers.values()))) if len(self.buffers) > 0 else 0
+
+    def _reserve(self, n: int):
+        capacity = self._capacity()
+        if n <= capacity:
+            return
+        capacity = max(n, capacity * 2, self.MIN_CAPACITY)
+        for values in self.buffers.values():
+            values.resize(capacity, refcheck=False)
+
+    def _to_object(self, col: str):
+        """
+        col を object の配列に変える(型が混ざっていた場合)
+        """
+        values = self.buffers[col]
+        if col in self.categories:
+            categories = np.array(list(self.categories.pop(col)) + [np.nan], dtype=object)
+            values = categories[values]
+        self.buffers[col] = values.astype(object)
+
+    def append(self, frame: pd.DataFrame):
+        if self.fallback is not None:
+            self.fallback.append(frame)
+            return
+        if self.columns is None:
+            self.columns = frame.columns.tolist()
+        if frame.columns.tolist() != self.columns or \
+                any(not _is_mergeable_dtype(dtype) for dtype in frame.dtypes):
+            self.fallback = [] if self.n == 0 else [self.finish()]
+            self.fallback.append(frame)
+            return
+
+        lo, hi = self.n, self.n + len(frame)
+        if len(self.buffers) == 0:
+            for col in self.columns:
+                dtype = frame[col].dtype
+                if isinstance(dtype, pd.CategoricalDtype):
+                    self.categories[col] = {}
+                    self.buffers[col] = np.empty(0, dtype=np.int32)
+                elif isinstance(dtype, np.dtype) and dtype != object:
+                    self.buffers[col] = np.empty(0, dtype=dtype)
+                else:
+                    self.buffers[col] = np.empty(0, dtype=object)
+        self._reserve(hi)
+
+        for col in self.columns:
+            series = frame[col]
+            is_category = isinstance(series.dtype, pd.CategoricalDtype)
+            if col in self.categories and not is_category:
+                self._to_object(col)
+            if col in self.categories:
+                mapping = self.categories[col]
+                for category in series.cat.categories:
+                    mapping.setdefault(category, len(mapping))
+                indexer = np.array([mapping[x] for x in series.cat.categories] + [-1], dtype=np.int32)
+                self.buffers[col][lo:hi] = indexer[series.cat.codes.to_numpy()]
+                continue
+            values = series.to_numpy()
+            buffer = self.buffers[col]
+            if buffer.dtype != object and not np.can_cast(values.dtype, buffer.dtype):
+                dtype = object if values.dtype == object else np.result_type(buffer.dtype, values.dtype)
+                buffer = buffer.astype(dtype)
+                self.buffers[col] = buffer
+            buffer[lo:hi] = values
+        self.n = hi
+
+    def finish(self) -> pd.DataFrame:
+        """
+        結合したDataFrame(indexは0からの連番)
+        :return:
+        """
+        if self.fallback is not None:
+            return pd.concat(self.fallback, ignore_index=True)
+        if self.columns is None:
+            raise ValueError("結合するDataFrameがありません")
+        columns = {}
+        for col in self.columns:
+            values = self.buffers[col]
+            values.resize(self.n, refcheck=False)
+            if col in self.categories:
+                categories = pd.Index(list(self.categories[col]))
+                order = np.argsort(categories, kind="stable")
+                indexer = np.empty(len(order) + 1, dtype=np.int32)
+                indexer[order] = np.arange(len(order))
+                indexer[-1] = -1
+                values = pd.Categorical.from_codes(indexer[values], categories=categories[order])
+            columns[col] = values
+        return pd.DataFrame(columns, copy=False)
+
+
+def merge_frames(frames: list) -> pd.DataFrame:
+    """
+    同じカラムを持つDataFrameのリストを縦に結合する
+    framesから1つずつ取り出して _FrameMerger に追記する。
+    追記し終わったDataFrameはframesから外れるので、pd.concatのように
+    全DataFrameと結合結果を同時に保持しなくて済む(framesは空になる)
+    categoryは全DataFrameのcategoryを合わせたものになる。indexは0からの連番
+    :param frames:
+    :return:
+    """
+    merger = _FrameMerger()
+    frames.reverse()
+    while len(frames) > 0:
+        merger.append(frames.pop())
+    return merger.finish()
+
+
+def load_data_files(data_files: list,
+                    typed: bool = False,
+                    cache_dir: str = None,
+                    n_jobs: int = 1,
+                    parallel_backend: str = "thread",
+                    date_range: tuple = None,
+                    codes: list = None) -> pd.DataFrame:
+    """
+    data_filesを読み込んで1つのDataFrameにする(indexは0からの連番)
+    ファイルが1つの場合はconcatしない(メモリマップしたデータをコピーしない。indexはそのファイルのもの)
+    2つ以上の場合は、読み込んだファイルから順に _FrameMerger に追記する
+    :param data_files:
+    :param typed: load_data_file と同じ
+    :param cache_dir: load_data_file と同じ
+    :param n_jobs: 2以上なら、n_jobs並列で読み込む
+    :param parallel_backend: "thread" or "process"
+    :param date_range: load_data_file と同じ
+    :param codes: load_data_file と同じ
+    :return:
+    """
+    if len(data_files) == 0:
+        raise ValueError("data_files が空です")
+    if parallel_backend not in ["thread", "process"]:
+        raise ValueError(f"parallel_backend は thread, process のみ使用可能です。 入力: {parallel_backend}")
+    load = functools.partial(load_data_file,
+                             typed=typed,
+                             cache_dir=cache_dir,
+                             date_range=date_range,
+                             codes=codes)
+    if len(data_files) == 1:
+        return load(data_files[0])
+
+    merger = _FrameMerger()
+    if n_jobs > 1:
+        executor_class = ThreadPoolExecutor if parallel_backend == "thread" else ProcessPoolExecutor
+        with executor_class(max_workers=n_jobs) as executor:
+            # data_filesの順に追記する。読み込み中・追記待ちは n_jobs ファイルまでにし、全ファイル分を同時に保持しない
+            remaining = iter(data_files)
+            futures = collections.deque(executor.submit(load, x) for x in itertools.islice(remaining, n_jobs))
+            while len(futures) > 0:
+                df = futures.popleft().result()
+                path = next(remaining, None)
+                if path is not None:
+                    futures.append(executor.submit(load, path))
+                merger.append(df)
+                del df
+    else:
+        for path in data_files:
+            merger.append(load(path))
+    return merger.finish()
@@ -0,0 +1,125 @@
+import pandas as pd
+from datetime import timedelta
+from datetime import datetime as dt
+from .core import DataFetcher
+from .loaders import iter_data_file, filter_frame
+
+
+class StreamingDataFetcher(DataFetcher):
+    """
+    メモリに乗らないデータを、チャンク毎に読み込みながらフェッチするクラス
+    DataFetcherと同じく fetch / end_of_data で使える
+
+    各ファイルはdateで昇順ソートされている必要がある(ファイル間の順序は問わない)
+    メモリに保持するのは max_lookback の範囲と、各ファイルの読み込み済みで未到達のチャンクのみ
+    保持するデータが増え続けないよう、max_lookback は必須
+    毎ステップ、新しく範囲に入った行だけをdateでソートし、保持している(ソート済みの)データの後ろにつなげる
+    """
+    def __init__(self,
+                 data_files: list,
+                 start_datetime: dt = None,
+                 max_lookback=None,
+                 chunksize: int = 100_000,
+                 date_range: tuple = None,
+                 codes: list = None):
+        """
+        :param data_files: 読み込むファイルのリスト(形式は DataFetcher と同じ)
+        :param start_datetime:
+        :param max_lookback: int or timedelta. DataFetcherと同じ(Noneは不可)
+        :param chunksize: 1回に読み込む行数
+        :param date_range: DataFetcherと同じ。チャンク毎に絞り込む
+        :param codes: DataFetcherと同じ。チャンク毎に絞り込む
+        """
+        self.data_files = data_files
+        self.chunksize = chunksize
+        self.date_range = date_range
+        self.codes = codes
+        self.fetch_mode = "stream"
+        if max_lookback is None:
+            raise ValueError("StreamingDataFetcher では max_lookback を指定してください(全データを保持すると増え続けるため)")
+        self.max_lookback = max_lookback
+
+        self._readers = [iter_data_file(x, chunksize=chunksize) for x in data_files]
+        self._pending = [None] * len(data_files)
+        self._exhausted = [False] * len(data_files)
+        self.df_data = None
+
+        self.datetime = start_datetime
+        self.end_of_data = False
+        self.max_date = None
+
+    def _read_chunk(self, i: int):
+        """
+        i番目のファイルから次のチャンクを読み込んで未到達データに追加する
+        :param i:
+        :return:
+        """
+        try:
+            df_chunk = next(self._readers[i])
+        except StopIteration:
+            self._exhausted[i] = True
+            return
+        self._validate_data(df_chunk)
+        if not pd.api.types.is_datetime64_any_dtype(df_chunk["date"]):
+            df_chunk = df_chunk.assign(date=pd.to_datetime(df_chunk["date"]))
+        df_chunk = filter_frame(df_chunk, date_range=self.date_range, codes=self.codes)
+
+        if self._pending[i] is None or len(self._pending[i]) == 0:
+            self._pending[i] = df_chunk
+        else:
+            self._pending[i] = pd.concat([self._pending[i], df_chunk])
+
+    def _release(self, i: int) -> pd.DataFrame:
+        """
+        i番目のファイルの未到達データのうち、date <= datetime の行を取り出す
+        未到達データの末尾が datetime 以前の間は次のチャンクを読み込む
+        :param i:
+        :return:
+        """
+        while not self._exhausted[i] and \
+                (self._pending[i] is None or len(self._pending[i]) == 0 or
+                 self._pending[i]["date"].iloc[-1] <= self.datetime):
+            self._read_chunk(i)
+
+        if self._pending[i] is None:
+            return None
+        n = self._pending[i]["date"].searchsorted(self.datetime, side="right")
+        df_release = self._pending[i].iloc[:n]
+        self._pending[i] = self._pending[i].iloc[n:]
+        return df_release
+
+    def _trim(self, df: pd.DataFrame) -> pd.DataFrame:
+        """
+        保持しているデータを max_lookback の範囲に切り詰める
+        :param df:
+        :return:
+        """
+        if isinstance(self.max_lookback, timedelta):
+            lo = df["date"].searchsorted(self.datetime - self.max_lookback, side="right")
+            return df.iloc[lo:]
+        return df.groupby("code", sort=False, observed=True).tail(self.max_lookback)
+
+    def fetch(self,
+              step: timedelta):
+        self.datetime += step
+
+        frames = []
+        for i in range(len(self._readers)):
+            df_release = self._release(i)
+            if df_release is not None and (len(df_release) > 0 or (self.df_data is None and len(frames) == 0)):
+                frames.append(df_release)
+        if self.df_data is None and len(frames) == 0:
+            raise ValueError("data_filesにデータがありません")
+        if len(frames) > 0:
+            # 新しく範囲に入った行は全て保持しているデータより後のdateなので、ソートは新しい行だけでよい
+            df_new = self._sort_by_date(pd.concat(frames))
+            self.df_data = df_new if self.df_data is None else pd.concat([self.df_data, df_new])
+        self.df_data = self._trim(self.df_data)
+
+        if all(self._exhausted) and all(x is None or len(x) == 0 for x in self._pending):
+            self.end_of_data = True
+        return self.df_data
+
+    def fetch_partitioned(self,
+                          step: timedelta) -> dict:
+        return {code: df for code, df in self.fetch(step=step).groupby("code", observed=True)}
@@ -1,13 +1,50 @@
+import numpy as np
 import pandas as pd
 import copy
 
 class FeatureProcessor:
     """
     生データから特徴量変換するプログラム
+
+    _update_core を実装すると、BackTesterは毎ステップ全履歴に transform をかける代わりに、
+    前回のステップから新しく追加された行だけを update に渡す(インクリメンタル処理)。
+    移動平均のバッファやEMAの値など、前回までの計算結果はインスタンスに状態として持つ
+
+    特徴量が過去のデータだけから計算される(先読みしない)場合は、precompute で全データに一度だけ
+    transform をかけ、毎ステップはその結果を切り出して使うこともできる。
+    verify_precompute で先読みしていないことを確認できる
+
+    Attributes
+    ----------
+    validation: str, default: "full"
+        transform/update の前後で生データのカラム(EXPECT_SAME_COLS)が変わっていないことの確認方法
+        "full": dfをコピーしてから処理し、全行を pd.testing.assert_frame_equal で比較する
+        "checksum": 入力と出力のカラム毎のハッシュを比較する。
+            dfは浅いコピー(データはコピーしない)を渡す(copy-on-writeなので、入力データは書き換わらない)
+        "sampled": dfをコピーしてから処理し、ランダムに選んだ validation_sample_size 行だけ比較する
+        "off": 確認しない。dfは浅いコピーを渡す
+        "checksum", "off" でも、_transform_core / _update_core が追加したカラムは渡したdfには追加されない
+        確認に失敗した場合は AssertionError
+
+    validation_sample_size: int, default: 100
+        validation="sampled" で比較する行数
     """
+    EXPECT_SAME_COLS = ["date", "code", "open", "close", "high", "low", "volume"]
+    VALIDATION_MODES = ["full", "checksum", "sampled", "off"]
 
-    def __init__(self, **kwargs):
-        pass
+    validation = "full"
+    validation_sample_size = 100
+
+    def __init__(self,
+                 validation: str = None,
+                 validation_sample_size: int = None,
+                 **kwargs):
+        if validation is not None:
+            if validation not in self.VALIDATION_MODES:
+                raise ValueError(f"validation は {self.VALIDATION_MODES} のみ使用可能です。 入力: {validation}")
+            self.validation = validation
+        if validation_sample_size is not None:
+            self.validation_sample_size = validation_sample_size
 
     def _transform_core(self, df):
         """
@@ -17,15 +54,94 @@ class FeatureProcessor:
         """
         raise NotImplementedError
 
+    def _update_core(self, df):
+        """
+        インクリメンタル処理の特有部分
+        前回の呼び出しより後の行(date昇順)だけを受け取り、状態を更新して特徴量を付けて返す
+        :param df: 新しく追加された行
+        :return: df: dfと同じ行に特徴量カラムを追加したもの
+        """
+        raise NotImplementedError
+
+    def reset(self):
+        """
+        インクリメンタル処理の状態を初期化する
+        :return:
+        """
+        pass
+
+    @property
+    def supports_incremental(self) -> bool:
+        """
+        _update_core が実装されていればTrue
+        :return:
+        """
+        return type(self)._update_core is not FeatureProcessor._update_core
+
     def _validate(self,
                   df_original: pd.DataFrame,
                   df_transform: pd.DataFrame):
 
-        expect_same_cols = ["date", "code", "open", "close", "high", "low", "volume"]
+        expect_same_cols = self.EXPECT_SAME_COLS
 
         pd.testing.assert_frame_equal(df_original[expect_same_cols],
                                       df_transform[expect_same_cols])
 
+    def _validate_sampled(self,
+                          df_original: pd.DataFrame,
+                          df_transform: pd.DataFrame):
+        if len(df_original) != len(df_transform):
+            raise AssertionError(f"行数が変わっています。 before: {len(df_original)}, after: {len(df_transform)}")
+        size = min(self.validation_sample_size, len(df_original))
+        positions = np.sort(np.random.default_rng().choice(len(df_original), size=size, replace=False))
+
+        expect_same_cols = self.EXPECT_SAME_COLS
+        pd.testing.assert_frame_equal(df_original[expect_same_cols].iloc[positions],
+                                      df_transform[expect_same_cols].iloc[positions])
+
+    def _checksum(self,
+                  df: pd.DataFrame) -> dict:
+        """
+        カラム毎(とindex)の、行の順序も反映したハッシュ値
+        :param df:
+        :return:
+        """
+        weights = np.arange(1, len(df) + 1, dtype=np.uint64)
+        ret = {"index": int((pd.util.hash_pandas_object(df.index).to_numpy() * weights).sum())}
+        for col in self.EXPECT_SAME_COLS:
+            hashes = pd.util.hash_pandas_object(df[col], index=False).to_numpy()
+            ret[col] = int((hashes * weights).sum())
+        return ret
+
+    def _apply(self,
+               core,
+               df: pd.DataFrame):
+        """
+        validation に従って core(_transform_core or _update_core) を呼び出し、結果を確認する
+        :param core:
+        :param df:
+        :return:
+        """
+        if self.validation == "off":
+            return core(df.copy(deep=False))
+
+        if self.validation == "checksum":
+            # 浅いコピーを渡すので(copy-on-write)、入力データは書き換わらない。出力だけ比較する
+            checksum = self._checksum(df)
+            df_ret = core(df.copy(deep=False))
+            if len(df_ret) != len(df) or self._checksum(df_ret) != checksum:
+                raise AssertionError(f"生データのカラム{self.EXPECT_SAME_COLS}が変わっています")
+            return df_ret
+
+        df_ret = core(copy.copy(df))
+        if self.validation == "sampled":
+            self._validate_sampled(df_original=df,
+                                   df_transform=df_ret)
+        else:
+            self._validate(df_original=df,
+                           df_transform=df_ret)
+        return df_ret
+
     def transform(self,
                   df: pd.DataFrame):
         """
@@ -34,8 +150,54 @@ class FeatureProcessor:
         :return: df: 加工された特徴量データ
         """
 
-        df_ret = self._transform_core(copy.copy(df))
-        self._validate(df_original=df,
-                       df_transform=df_ret)
+        return self._apply(self._transform_core, df)
+
+    def precompute(self,
+                   df: pd.DataFrame):
+        """
+        全データに一度だけ transform をかける
+        :param df: 全期間の生データ(dateでソート済み)
+        :return: df: 加工された特徴量データ
+        """
+        return self.transform(df=df)
+
+    def verify_precompute(self,
+                          df: pd.DataFrame,
+                          df_precomputed: pd.DataFrame,
+                          n_samples: int = 5,
+                          random_state: int = None):
+        """
+        ランダムに選んだ時点tについて、date <= t のデータに transform をかけた結果が
+        precompute の結果の date <= t の行と一致することを確認する。
+        一致しない場合、特徴量が t より後のデータを使っている(先読みしている)ので ValueError
+        :param df: precompute に渡した生データ
+        :param df_precomputed: precompute の結果
+        :param n_samples: 確認する時点の数
+        :param random_state:
+        :return:
+        """
+        dates = df["date"].unique()
+        if len(dates) <= 1:
+            return
+        rng = np.random.default_rng(random_state)
+        # 最後の時点は全データと同じなので確認しない
+        cut_points = rng.choice(np.sort(dates)[:-1], size=min(n_samples, len(dates) - 1), replace=False)
+
+        for cut_point in np.sort(cut_points):
+            mask = (df["date"] <= cut_point).to_numpy()
+            df_expect = self.transform(df=df[mask])
+            try:
+                pd.testing.assert_frame_equal(df_expect, df_precomputed[mask])
+            except AssertionError as e:
+                raise ValueError(f"precomputeした特徴量が、{cut_point}までのデータでtransformした結果と一致しません。"
+                                 f"先読みしている可能性があります。\n{e}")
+
+    def update(self,
+               df: pd.DataFrame):
+        """
+        インクリメンタル処理
+        :param df: 前回のupdateより後に追加された生データ
+        :return: df: 加工された特徴量データ(dfと同じ行)
+        """
 
-        return df_ret
\ No newline at end of file
+        return self._apply(self._update_core, df)
@@ -0,0 +1,459 @@
+import collections
+import numpy as np
+import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
+from .core import FeatureProcessor
+
+
+def _rolling_mean_std(x: np.ndarray,
+                      period: int):
+    """
+    直近period本の平均と標準偏差(ddof=0)。period本に満たない間はNaN
+    :param x:
+    :param period:
+    :return: (mean, std)
+    """
+    mean = np.full(len(x), np.nan)
+    std = np.full(len(x), np.nan)
+    if len(x) >= period:
+        window = sliding_window_view(x, period)
+        mean[period - 1:] = window.mean(axis=1)
+        std[period - 1:] = window.std(axis=1)
+    return mean, std
+
+
+def _ewm(x: np.ndarray,
+         alpha: float) -> np.ndarray:
+    """
+    y[0] = x[0], y[i] = alpha * x[i] + (1 - alpha) * y[i-1]
+    :param x:
+    :param alpha:
+    :return:
+    """
+    if len(x) == 0:
+        return x.astype(float)
+    return pd.Series(x).ewm(alpha=alpha, adjust=False).mean().to_numpy(copy=True)
+
+
+class _RollingWindow:
+    """
+    直近period本の平均・分散を1本あたりO(1)で更新する(Welford法)
+    """
+    __slots__ = ["period", "values", "mean", "m2"]
+
+    def __init__(self, period: int):
+        self.period = period
+        self.values = collections.deque()
+        self.mean = 0.
+        self.m2 = 0.
+
+    def add(self, x: float):
+        if len(self.values) < self.period:
+            self.values.append(x)
+            delta = x - self.mean
+            self.mean += delta / len(self.values)
+            self.m2 += delta * (x - self.mean)
+        else:
+            old = self.values.popleft()
+            self.values.append(x)
+            mean = self.mean + (x - old) / self.period
+            self.m2 += (x - old) * (x - mean + old - self.mean)
+            self.mean = mean
+
+    @property
+    def full(self) -> bool:
+        return len(self.values) == self.period
+
+    @property
+    def std(self) -> float:
+        return np.sqrt(max(self.m2, 0.) / self.period)
+
+
+class IndicatorProcessor(FeatureProcessor):
+    """
+    code毎に計算するテクニカル指標の基底クラス
+
+    transform: code毎にNumPyでまとめて計算する(_compute)
+    update: code毎の状態を持ち、1本あたりO(1)で計算する(_new_state, _update_bar)
+    """
+    input_columns = ["close"]
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.reset()
+
+    @property
+    def output_columns(self) -> list:
+        raise NotImplementedError
+
+    def _compute(self, arrays: dict) -> list:
+        """
+        1つのcodeのデータ(date昇順)から指標を計算する
+        :param arrays: input_columns -> np.ndarray
+        :return: output_columns の順の np.ndarray のリスト
+        """
+        raise NotImplementedError
+
+    def _new_state(self):
+        raise NotImplementedError
+
+    def _update_bar(self, state, *values) -> tuple:
+        """
+        1本分の状態を更新する
+        :param state: _new_state で作った状態
+        :param values: input_columns の順の値
+        :return: output_columns の順の値
+        """
+        raise NotImplementedError
+
+    def reset(self):
+        self._states = {}
+
+    def _transform_core(self, df):
+        arrays = {col: df[col].to_numpy(dtype=float) for col in self.input_columns}
+        outputs = [np.full(len(df), np.nan) for _ in self.output_columns]
+        for code, positions in df.groupby("code", sort=False, observed=True).indices.items():
+            values = self._compute({col: array[positions] for col, array in arrays.items()})
+            for output, value in zip(outputs, values):
+                output[positions] = value
+        for col, output in zip(self.output_columns, outputs):
+            df[col] = output
+        return df
+
+    def _update_core(self, df):
+        arrays = [df[col].to_numpy(dtype=float) for col in self.input_columns]
+        outputs = np.full((len(df), len(self.output_columns)), np.nan)
+        for i, (code, *values) in enumerate(zip(df["code"], *arrays)):
+            state = self._states.get(code)
+            if state is None:
+                state = self._new_state()
+                self._states[code] = state
+            outputs[i] = self._update_bar(state, *values)
+        for j, col in enumerate(self.output_columns):
+            df[col] = outputs[:, j]
+        return df
+
+
+class CompositeProcessor(FeatureProcessor):
+    """
+    複数の FeatureProcessor を順に適用する
+    CompositeProcessor([SMAProcessor(period=5), RSIProcessor(period=14)]) のように使う
+
+    各processorの _transform_core / _update_core を順に呼び出すので、生データの確認(validation)は
+    CompositeProcessor で1回だけ行う
+    インクリメンタル処理は、全てのprocessorが対応している場合のみ使える
+    """
+    def __init__(self,
+                 processors: list,
+                 **kwargs):
+        if len(processors) == 0:
+            raise ValueError("processors が空です")
+        self.processors = list(processors)
+        super().__init__(**kwargs)
+
+    @property
+    def supports_incremental(self) -> bool:
+        return all(processor.supports_incremental for processor in self.processors)
+
+    def reset(self):
+        for processor in self.processors:
+            processor.reset()
+
+    def _transform_core(self, df):
+        for processor in self.processors:
+            df = processor._transform_core(df)
+        return df
+
+    def _update_core(self, df):
+        for processor in self.processors:
+            df = processor._update_core(df)
+        return df
+
+
+class SMAProcessor(IndicatorProcessor):
+    """
+    単純移動平均。period本に満たない間はNaN
+    """
+    def __init__(self,
+                 period: int = 20,
+                 column: str = "close",
+                 name: str = None,
+                 **kwargs):
+        self.period = period
+        self.input_columns = [column]
+        self.name = f"sma_{period}" if name is None else name
+        super().__init__(**kwargs)
+
+    @property
+    def output_columns(self) -> list:
+        return [self.name]
+
+    def _compute(self, arrays):
+        mean, _ = _rolling_mean_std(arrays[self.input_columns[0]], self.period)
+        return [mean]
+
+    def _new_state(self):
+        return _RollingWindow(self.period)
+
+    def _update_bar(self, state, x):
+        state.add(x)
+        return (state.mean if state.full else np.nan,)
+
+
+class EMAProcessor(IndicatorProcessor):
+    """
+    指数移動平均。alpha = 2 / (period + 1)、最初の値から計算する
+    """
+    def __init__(self,
+                 period: int = 20,
+                 column: str = "close",
+                 name: str = None,
+                 **kwargs):
+        self.period = period
+        self.alpha = 2 / (period + 1)
+        self.input_columns = [column]
+        self.name = f"ema_{period}" if name is None else name
+        super().__init__(**kwargs)
+
+    @property
+    def output_columns(self) -> list:
+        return [self.name]
+
+    def _compute(self, arrays):
+        return [_ewm(arrays[self.input_columns[0]], self.alpha)]
+
+    def _new_state(self):
+        return [None]
+
+    def _update_bar(self, state, x):
+        if state[0] is None:
+            state[0] = x
+        else:
+            state[0] = self.alpha * x + (1 - self.alpha) * state[0]
+        return (state[0],)
+
+
+class RSIProcessor(IndicatorProcessor):
+    """
+    RSI(Wilderの平滑化、alpha = 1 / period)。period本分の値動きが揃うまではNaN
+    """
+    def __init__(self,
+                 period: int = 14,
+                 column: str = "close",
+                 name: str = None,
+                 **kwargs):
+        self.period = period
+        self.alpha = 1 / period
+        self.input_columns = [column]
+        self.name = f"rsi_{period}" if name is None else name
+        super().__init__(**kwargs)
+
+    @property
+    def output_columns(self) -> list:
+        return [self.name]
+
+    def _rsi(self, avg_gain, avg_loss):
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return np.where(avg_loss == 0, 100., 100. - 100. / (1. + avg_gain / avg_loss))
+
+    def _compute(self, arrays):
+        x = arrays[self.input_columns[0]]
+        ret = np.full(len(x), np.nan)
+        if len(x) <= self.period:
+            return [ret]
+        delta = np.diff(x)
+        avg_gain = _ewm(np.maximum(delta, 0), self.alpha)
+        avg_loss = _ewm(np.maximum(-delta, 0), self.alpha)
+        ret[self.period:] = self._rsi(avg_gain, avg_loss)[self.period - 1:]
+        return [ret]
+
+    def _new_state(self):
+        # prev, avg_gain, avg_loss, count
+        return [None, 0., 0., 0]
+
+    def _update_bar(self, state, x):
+        prev = state[0]
+        state[0] = x
+        if prev is None:
+            return (np.nan,)
+        gain = max(x - prev, 0.)
+        loss = max(prev - x, 0.)
+        if state[3] == 0:
+            state[1], state[2] = gain, loss
+        else:
+            state[1] = self.alpha * gain + (1 - self.alpha) * state[1]
+            state[2] = self.alpha * loss + (1 - self.alpha) * state[2]
+        state[3] += 1
+        if state[3] < self.period:
+            return (np.nan,)
+        return (float(self._rsi(state[1], state[2])),)
+
+
+class ATRProcessor(IndicatorProcessor):
+    """
+    ATR(Wilderの平滑化、alpha = 1 / period)。最初の本のTrue Rangeは high - low。
+    period本に満たない間はNaN
+    """
+    input_columns = ["high", "low", "close"]
+
+    def __init__(self,
+                 period: int = 14,
+                 name: str = None,
+                 **kwargs):
+        self.period = period
+        self.alpha = 1 / period
+        self.name = f"atr_{period}" if name is None else name
+        super().__init__(**kwargs)
+
+    @property
+    def output_columns(self) -> list:
+        return [self.name]
+
+    def _compute(self, arrays):
+        high, low, close = arrays["high"], arrays["low"], arrays["close"]
+        true_range = high - low
+        if len(close) > 1:
+            prev_close = close[:-1]
+            true_range[1:] = np.maximum.reduce([true_range[1:],
+                                                np.abs(high[1:] - prev_close),
+                                                np.abs(low[1:] - prev_close)])
+        ret = _ewm(true_range, self.alpha)
+        ret[:self.period - 1] = np.nan
+        return [ret]
+
+    def _new_state(self):
+        # prev_close, atr, count
+        return [None, None, 0]
+
+    def _update_bar(self, state, high, low, close):
+        true_range = high - low
+        if state[0] is not None:
+            true_range = max(true_range, abs(high - state[0]), abs(low - state[0]))
+        state[0] = close
+        if state[1] is None:
+            state[1] = true_range
+        else:
+            state[1] = self.alpha * true_range + (1 - self.alpha) * state[1]
+        state[2] += 1
+        return (state[1] if state[2] >= self.period else np.nan,)
+
+
+class BollingerProcessor(IndicatorProcessor):
+    """
+    ボリンジャーバンド。中心は単純移動平均、幅は標準偏差(ddof=0)のk倍。period本に満たない間はNaN
+    """
+    def __init__(self,
+                 period: int = 20,
+                 k: float = 2.,
+                 column: str = "close",
+                 **kwargs):
+        self.period = period
+        self.k = k
+        self.input_columns = [column]
+        super().__init__(**kwargs)
+
+    @property
+    def output_columns(self) -> list:
+        return [f"bb_mid_{self.period}", f"bb_upper_{self.period}", f"bb_lower_{self.period}"]
+
+    def _compute(self, arrays):
+        mean, std = _rolling_mean_std(arrays[self.input_columns[0]], self.period)
+        return [mean, mean + self.k * std, mean - self.k * std]
+
+    def _new_state(self):
+        return _RollingWindow(self.period)
+
+    def _update_bar(self, state, x):
+        state.add(x)
+        if not state.full:
+            return (np.nan, np.nan, np.nan)
+        std = state.std
+        return (state.mean, state.mean + self.k * std, state.mean - self.k * std)
+
+
+class ZScoreProcessor(IndicatorProcessor):
+    """
+    直近period本の平均・標準偏差(ddof=0)による zスコア。period本に満たない間と、標準偏差が0の場合はNaN
+    """
+    def __init__(self,
+                 period: int = 20,
+                 column: str = "close",
+                 name: str = None,
+                 **kwargs):
+        self.period = period
+        self.input_columns = [column]
+        self.name = f"zscore_{period}" if name is None else name
+        super().__init__(**kwargs)
+
+    @property
+    def output_columns(self) -> list:
+        return [self.name]
+
+    def _compute(self, arrays):
+        x = arrays[self.input_columns[0]]
+        mean, std = _rolling_mean_std(x, self.period)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return [np.where(std > 0, (x - mean) / std, np.nan)]
+
+    def _new_state(self):
+        return _RollingWindow(self.period)
+
+    def _update_bar(self, state, x):
+        state.add(x)
+        std = state.std
+        if not state.full or std == 0:
+            return (np.nan,)
+        return ((x - state.mean) / std,)
+
+
+class VWAPProcessor(IndicatorProcessor):
+    """
+    VWAP。価格は (high + low + close) / 3。
+    periodを指定しない場合は最初の本からの累積、指定した場合は直近period本(揃うまではNaN)
+    """
+    input_columns = ["high", "low", "close", "volume"]
+
+    def __init__(self,
+                 period: int = None,
+                 name: str = None,
+                 **kwargs):
+        self.period = period
+        if name is None:
+            name = "vwap" if period is None else f"vwap_{period}"
+        self.name = name
+        super().__init__(**kwargs)
+
+    @property
+    def output_columns(self) -> list:
+        return [self.name]
+
+    def _compute(self, arrays):
+        volume = arrays["volume"]
+        pv = (arrays["high"] + arrays["low"] + arrays["close"]) / 3 * volume
+        if self.period is None:
+            sum_pv, sum_volume = np.cumsum(pv), np.cumsum(volume)
+        else:
+            sum_pv, sum_volume = np.full(len(pv), np.nan), np.full(len(pv), np.nan)
+            if len(pv) >= self.period:
+                sum_pv[self.period - 1:] = sliding_window_view(pv, self.period).sum(axis=1)
+                sum_volume[self.period - 1:] = sliding_window_view(volume, self.period).sum(axis=1)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return [np.where(sum_volume > 0, sum_pv / sum_volume, np.nan)]
+
+    def _new_state(self):
+        # sum_pv, sum_volume, window
+        return [0., 0., collections.deque()]
+
+    def _update_bar(self, state, high, low, close, volume):
+        pv = (high + low + close) / 3 * volume
+        state[0] += pv
+        state[1] += volume
+        if self.period is not None:
+            state[2].append((pv, volume))
+            if len(state[2]) > self.period:
+                old_pv, old_volume = state[2].popleft()
+                state[0] -= old_pv
+                state[1] -= old_volume
+            if len(state[2]) < self.period:
+                return (np.nan,)
+        return (state[0] / state[1] if state[1] > 0 else np.nan,)
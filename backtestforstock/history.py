@@ -6,11 +6,101 @@ from .position import Position
 from logging import Logger
 
 class HistoryManager:
+    """
+    取引履歴を列毎のNumPy配列で持つ
+    配列は足りなくなったら倍に伸ばす(1件あたり償却O(1))。codeは番号に変換して持つ
+
+    histories で従来通り History のリストを取得できる(呼び出し毎に作り直す)
+    集計には to_frame / to_arrow / iter_frames を使う(メモリ上の分は配列をコピーせずに参照する)
+
+    spill_path を指定すると、spill_batch_size 件毎にメモリ上の取引履歴を Arrow IPC stream 形式のファイルに
+    書き出し、メモリ上からは取り除く(メモリ使用量は spill_batch_size 件分で頭打ちになる)。
+    書き出した分は iter_frames で1バッチずつ読み込める
+
+    statistics(OnlineStatistics 等、update を持つもの)を指定すると、決済が追加される度に更新する
+    """
+    MIN_CAPACITY = 1024
+    CATEGORIES = ["long", "short"]
+    COLUMNS = {"date": "datetime64[ns]", "code": np.int32, "category": np.int8, "amount": np.float64,
+               "price_open": np.float64, "price_close": np.float64, "id_close": np.int64}
+
     def __init__(self,
-                 logger: Logger):
-        self.histories = []
+                 logger: Logger,
+                 spill_path: str = None,
+                 spill_batch_size: int = 100_000,
+                 statistics=None):
+        """
+        :param logger:
+        :param spill_path: 取引履歴を書き出すファイル(Arrow IPC stream)。既にある場合は上書きする
+        :param spill_batch_size: 書き出す件数の単位
+        :param statistics: 決済毎に update(code, amount, price_open, price_close) を呼ぶ
+        """
         self.logger = logger
         self.id_max = 0
+        self._columns = self._new_columns(self.MIN_CAPACITY)
+        self._n_buffered = 0  # メモリ上の件数
+        self._codes = []  # codeの番号 -> code
+        self._code_index = {}  # code -> codeの番号
+        self._last_date = None
+        self._last_date_value = None
+
+        self.spill_path = spill_path
+        self.spill_batch_size = spill_batch_size
+        self._n_spilled = 0  # ファイルに書き出した件数
+        self._sink = None
+        self._writer = None
+        self._code_type = None  # 書き出したファイルの code の型(2回目以降も同じ型で書き出す)
+        self._closed = False
+        self.statistics = statistics
+
+    def __len__(self):
+        return self.id_max
+
+    def _new_columns(self,
+                     capacity: int) -> dict:
+        return {name: np.empty(capacity, dtype=dtype) for name, dtype in self.COLUMNS.items()}
+
+    def _intern(self,
+                code: str) -> int:
+        code_index = self._code_index.get(code)
+        if code_index is None:
+            code_index = len(self._codes)
+            self._code_index[code] = code_index
+            self._codes.append(code)
+        return code_index
+
+    def _date_value(self,
+                    date) -> np.datetime64:
+        # 同じdateの取引が続くことが多いので、直前の変換結果を使い回す
+        if date is not self._last_date:
+            self._last_date = date
+            self._last_date_value = np.datetime64(pd.Timestamp(date).value, "ns")
+        return self._last_date_value
+
+    def _category_index(self,
+                        category: str) -> int:
+        if category not in self.CATEGORIES:
+            raise ValueError(f"category は {self.CATEGORIES} のみ使用可能です。 入力: {category}")
+        return self.CATEGORIES.index(category)
+
+    def _reserve(self,
+                 n: int):
+        """
+        n件追加できるようにする。足りなければ配列を倍に伸ばす
+        :param n:
+        :return:
+        """
+        if self._closed:
+            raise ValueError("close済みのHistoryManagerには追加できません")
+        capacity = len(self._columns["date"])
+        if self._n_buffered + n <= capacity:
+            return
+        while capacity < self._n_buffered + n:
+            capacity *= 2
+        columns = self._new_columns(capacity)
+        for name, values in self._columns.items():
+            columns[name][:self._n_buffered] = values[:self._n_buffered]
+        self._columns = columns
 
     def add(self,
             code: str,
@@ -19,27 +109,251 @@ class HistoryManager:
             price: float,
             category: str,
             position=None):
+        self._reserve(1)
+        i = self._n_buffered
+        columns = self._columns
+        columns["date"][i] = self._date_value(date)
+        columns["code"][i] = self._intern(code)
+        columns["category"][i] = self._category_index(category)
+        columns["amount"][i] = amount
         if position == None:
-            history = History(id=self.id_max,
-                              code=code,
-                              date=date,
-                              amount=amount,
-                              category=category,
-                              price_open=price,
-                              price_close=np.nan)
+            columns["price_open"][i] = price
+            columns["price_close"][i] = np.nan
+            columns["id_close"][i] = -1
         else:
-            history = History(id=self.id_max,
-                              code=code,
-                              date=date,
-                              amount=amount,
-                              category=category,
-                              price_open=position.price,
-                              price_close=price,
-                              id_close=position.id)
-        self.histories.append(history)
+            columns["price_open"][i] = position.price
+            columns["price_close"][i] = price
+            columns["id_close"][i] = position.id
+            if self.statistics is not None:
+                self.statistics.update(code=code,
+                                       amount=amount,
+                                       price_open=position.price,
+                                       price_close=price)
+        self._n_buffered += 1
         self.id_max += 1
+        if self.spill_path is not None and self._n_buffered >= self.spill_batch_size:
+            self.flush()
         return
 
+    def extend(self,
+               df: pd.DataFrame,
+               id_close_offset: int = 0):
+        """
+        取引履歴をまとめて追加する。idは追加順に振り直す
+        :param df: to_frame と同じカラム(idは無視する)
+            date, code, category("long" or "short"), amount, price_open, price_close(新規はNaN), id_close(新規はNA)
+        :param id_close_offset: id_close に足す値(別のAccountの履歴をつなげる場合に、ポジションのidをずらす)
+        :return:
+        """
+        n = len(df)
+        if n == 0:
+            return
+        codes, uniques = pd.factorize(df["code"])
+        code_indices = np.array([self._intern(code) for code in uniques], dtype=np.int32)
+        categories, category_uniques = pd.factorize(df["category"])
+        category_indices = np.array([self._category_index(category) for category in category_uniques], dtype=np.int8)
+        id_close = pd.array(df["id_close"], dtype="Int64")
+
+        self._reserve(n)
+        columns = self._columns
+        lo, hi = self._n_buffered, self._n_buffered + n
+        columns["date"][lo:hi] = pd.to_datetime(df["date"]).to_numpy(dtype="datetime64[ns]")
+        columns["code"][lo:hi] = code_indices[codes]
+        columns["category"][lo:hi] = category_indices[categories]
+        columns["amount"][lo:hi] = df["amount"].to_numpy(dtype=np.float64)
+        columns["price_open"][lo:hi] = df["price_open"].to_numpy(dtype=np.float64)
+        columns["price_close"][lo:hi] = df["price_close"].to_numpy(dtype=np.float64)
+        columns["id_close"][lo:hi] = np.where(id_close.isna(), -1, id_close.fillna(0).to_numpy(dtype=np.int64) + id_close_offset)
+        self._n_buffered = hi
+        self.id_max += n
+        if self.statistics is not None:
+            self._update_statistics(lo, hi)
+        if self.spill_path is not None and self._n_buffered >= self.spill_batch_size:
+            self.flush()
+
+    def _update_statistics(self,
+                           lo: int,
+                           hi: int):
+        """
+        メモリ上の lo から hi の行のうち、決済を statistics に追加する
+        :param lo:
+        :param hi:
+        :return:
+        """
+        columns = self._columns
+        for i in range(lo, hi):
+            if columns["id_close"][i] < 0:
+                continue
+            self.statistics.update(code=self._codes[columns["code"][i]],
+                                   amount=float(columns["amount"][i]),
+                                   price_open=float(columns["price_open"][i]),
+                                   price_close=float(columns["price_close"][i]))
+
+    def flush(self):
+        """
+        メモリ上の取引履歴を spill_path に書き出し、メモリ上から取り除く(spill_path が無ければ何もしない)
+        :return:
+        """
+        if self.spill_path is None or self._n_buffered == 0:
+            return
+        from backtestforstock.datafetchers.loaders import _import_pyarrow
+        pa = _import_pyarrow()
+        table = self._buffer_arrow(dictionary_codes=False)
+        if self._writer is None:
+            self._code_type = table.schema.field("code").type
+            self._sink = pa.OSFile(self.spill_path, "wb")
+            self._writer = pa.ipc.new_stream(self._sink, table.schema)
+        self._writer.write_table(table)
+        self._sink.flush()
+
+        self._n_spilled += self._n_buffered
+        self._n_buffered = 0
+        # to_frame 等で返した配列を書き換えないよう、新しい配列にする
+        self._columns = self._new_columns(len(self._columns["date"]))
+
+    def close(self):
+        """
+        残りを書き出してファイルを閉じる。以降は追加できない(読み込みはできる)
+        :return:
+        """
+        self.flush()
+        if self._writer is not None:
+            self._writer.close()
+            self._sink.close()
+            self._writer = None
+            self._sink = None
+        self._closed = True
+
+    def column(self,
+               name: str) -> np.ndarray:
+        """
+        メモリ上の分の列の配列(読み取り専用のビュー)
+        code, category は番号(codes / CATEGORIES の位置)、id_close の新規は -1
+        :param name:
+        :return:
+        """
+        values = self._columns[name][:self._n_buffered]
+        values.flags.writeable = False
+        return values
+
+    @property
+    def codes(self) -> list:
+        """
+        codeの番号 -> code
+        :return:
+        """
+        return list(self._codes)
+
+    def _buffer_frame(self) -> pd.DataFrame:
+        id_close = self.column("id_close")
+        return pd.DataFrame({"id": np.arange(self._n_spilled, self.id_max),
+                             "date": self.column("date"),
+                             "code": pd.Categorical.from_codes(self.column("code"), categories=self._codes),
+                             "category": pd.Categorical.from_codes(self.column("category"), categories=self.CATEGORIES),
+                             "amount": self.column("amount"),
+                             "price_open": self.column("price_open"),
+                             "price_close": self.column("price_close"),
+                             "id_close": pd.arrays.IntegerArray(id_close, id_close < 0)},
+                            copy=False)
+
+    def _buffer_arrow(self,
+                      dictionary_codes: bool = True):
+        from backtestforstock.datafetchers.loaders import _import_pyarrow
+        pa = _import_pyarrow()
+        id_close = self.column("id_close")
+        if dictionary_codes:
+            # codeの型はそのまま(int の code もある)。code が無い場合だけ文字列にする
+            dictionary = pa.array(self._codes) if len(self._codes) > 0 else pa.array([], type=pa.string())
+            code = pa.DictionaryArray.from_arrays(pa.array(self.column("code")), dictionary)
+        else:
+            code = pa.array(np.array(self._codes, dtype=object)[self.column("code")], type=self._code_type)
+        return pa.table({"id": pa.array(np.arange(self._n_spilled, self.id_max)),
+                         "date": pa.array(self.column("date")),
+                         "code": code,
+                         "category": pa.DictionaryArray.from_arrays(pa.array(self.column("category")),
+                                                                    pa.array(self.CATEGORIES, type=pa.string())),
+                         "amount": pa.array(self.column("amount")),
+                         "price_open": pa.array(self.column("price_open")),
+                         "price_close": pa.array(self.column("price_close")),
+                         "id_close": pa.array(id_close, mask=id_close < 0)})
+
+    def _iter_spilled(self):
+        """
+        書き出した取引履歴を1バッチずつ読み込む(メモリマップ)
+        :return: iterator of pyarrow.RecordBatch
+        """
+        if self._n_spilled == 0:
+            return
+        from backtestforstock.datafetchers.loaders import _import_pyarrow
+        pa = _import_pyarrow()
+        with pa.memory_map(self.spill_path) as source:
+            yield from pa.ipc.open_stream(source)
+
+    def iter_frames(self):
+        """
+        取引履歴を、書き出した分は1バッチずつ、最後にメモリ上の分を DataFrame で返す(id順)
+        カラムは to_frame と同じ
+        :return: iterator of pd.DataFrame
+        """
+        for batch in self._iter_spilled():
+            df = batch.to_pandas()
+            id_close = batch.column("id_close")
+            df["code"] = pd.Categorical(df["code"], categories=self._codes)
+            df["category"] = pd.Categorical(df["category"].astype(str), categories=self.CATEGORIES)
+            df["id_close"] = pd.arrays.IntegerArray(id_close.fill_null(-1).to_numpy(),
+                                                    id_close.is_null().to_numpy(zero_copy_only=False))
+            yield df
+        if self._n_buffered > 0:
+            yield self._buffer_frame()
+
+    @property
+    def histories(self) -> list:
+        """
+        History のリスト(呼び出し毎に作る)
+        :return: list of History
+        """
+        ret = []
+        for df in self.iter_frames():
+            dates = pd.DatetimeIndex(df["date"]).tolist()
+            id_close = df["id_close"].to_numpy(dtype=np.int64, na_value=-1).tolist()
+            for id, date, code, category, amount, price_open, price_close, id_close in zip(
+                    df["id"].tolist(), dates, df["code"].astype(object).tolist(), df["category"].astype(object).tolist(),
+                    df["amount"].tolist(), df["price_open"].tolist(), df["price_close"].tolist(), id_close):
+                if id_close < 0:
+                    price_close = np.nan
+                    id_close = None
+                ret.append(History(id=id,
+                                   date=date,
+                                   code=code,
+                                   category=category,
+                                   amount=amount,
+                                   price_open=price_open,
+                                   price_close=price_close,
+                                   id_close=id_close))
+        return ret
+
+    def to_frame(self) -> pd.DataFrame:
+        """
+        取引履歴のDataFrame。書き出した分が無ければ、数値の列は配列をコピーせずに参照する
+        :return: columns: id, date, code(category), category(category), amount, price_open, price_close, id_close(Int64)
+        """
+        if self._n_spilled == 0:
+            return self._buffer_frame()
+        return pd.concat(list(self.iter_frames()), ignore_index=True)
+
+    def to_arrow(self):
+        """
+        取引履歴の pyarrow.Table。書き出した分が無ければ、数値の列は配列をコピーせずに参照する
+        category は辞書型(dictionary)。code は書き出した分が無ければ辞書型、あれば辞書型でない(型は code のまま)
+        :return: pyarrow.Table
+        """
+        if self._n_spilled == 0:
+            return self._buffer_arrow()
+        from backtestforstock.datafetchers.loaders import _import_pyarrow
+        pa = _import_pyarrow()
+        return pa.Table.from_batches(list(self._iter_spilled()) +
+                                     self._buffer_arrow(dictionary_codes=False).to_batches())
+
 @dataclasses.dataclass
 class History:
     id: int
@@ -0,0 +1,394 @@
+import heapq
+import numpy as np
+import pandas as pd
+from logging import Logger
+
+
+class OrderBook:
+    """
+    code毎に、保有ポジションの指値・逆指値を価格順のヒープで持つ
+    Account(order_book=OrderBook(logger)) のように渡すと、uses_order_book=True のコールバック(OrderCallback)は
+    Account.trade の on_step_begin / on_step_end では呼ばれず、BackTester が毎ステップ全銘柄について判定する
+
+    - 指値は最小ヒープ、逆指値は最大ヒープ(符号を反転した最小ヒープ)で持ち、code毎の先頭の値を配列で持つ
+      毎ステップ、その配列と足の 始値/高値/安値 を比較して、引っかかる注文がある銘柄だけヒープを取り出す
+    - クローズしたポジションの注文はヒープから消さず、取り出した時に捨てる(lazy deletion)。
+      捨てる予定の注文が半分を超えたら作り直す
+
+    約定は OrderCallback と同じ
+    - on_step_begin(戦略の取引前): 始値が指値以上/逆指値以下なら始値で約定
+    - on_step_end(戦略の取引後): 高値が指値以上なら指値、安値が逆指値以下なら逆指値で約定
+    - 同じ足で両方引っかかったら、callback.close に両方渡す(OrderCallbackは半分ずつクローズ)
+    同じ銘柄で複数のポジションが約定する場合は、注文を登録した順(ポジションを建てた順)に約定する
+    """
+    MIN_CAPACITY = 64
+    MIN_COMPACT = 1024
+
+    def __init__(self,
+                 logger: Logger = None):
+        self.logger = logger
+        self._code_index = {}  # code -> codeの番号
+        self._codes = pd.Index([])
+        self._limit_heaps = []  # codeの番号 -> [(指値, seq, callback)]
+        self._stop_heaps = []  # codeの番号 -> [(-逆指値, seq, callback)]
+        self._min_limit = np.full(self.MIN_CAPACITY, np.inf)  # codeの番号 -> 最小の指値
+        self._max_stop = np.full(self.MIN_CAPACITY, -np.inf)  # codeの番号 -> 最大の逆指値
+        self._seq = 0
+        self._live = {}  # ポジションのid -> ヒープに残っている注文数
+        self._n_entries = 0
+        self._n_dead = 0
+
+    def __len__(self):
+        """
+        ヒープにある注文数(クローズ済みのポジションの注文を除く)
+        :return:
+        """
+        return self._n_entries - self._n_dead
+
+    def _get_code_index(self,
+                        code: str) -> int:
+        code_index = self._code_index.get(code)
+        if code_index is None:
+            code_index = len(self._code_index)
+            self._code_index[code] = code_index
+            self._codes = pd.Index(list(self._code_index.keys()))
+            self._limit_heaps.append([])
+            self._stop_heaps.append([])
+            if code_index == len(self._min_limit):
+                self._min_limit = np.concatenate([self._min_limit, np.full(code_index, np.inf)])
+                self._max_stop = np.concatenate([self._max_stop, np.full(code_index, -np.inf)])
+        return code_index
+
+    def _update_top(self,
+                    code_index: int):
+        limit_heap = self._limit_heaps[code_index]
+        stop_heap = self._stop_heaps[code_index]
+        self._min_limit[code_index] = limit_heap[0][0] if len(limit_heap) > 0 else np.inf
+        self._max_stop[code_index] = -stop_heap[0][0] if len(stop_heap) > 0 else -np.inf
+
+    def add(self,
+            callback):
+        """
+        callback(set_position済み)の指値・逆指値を登録する
+        :param callback: limit_price, stop_price, position を持つもの(OrderCallback)
+        :return:
+        """
+        position = callback.position
+        code_index = self._get_code_index(position.code)
+        seq = self._seq
+        self._seq += 1
+        n = 0
+        if callback.limit_price is not None:
+            heapq.heappush(self._limit_heaps[code_index], (callback.limit_price, seq, callback))
+            n += 1
+        if callback.stop_price is not None:
+            heapq.heappush(self._stop_heaps[code_index], (-callback.stop_price, seq, callback))
+            n += 1
+        self._live[position.id] = self._live.get(position.id, 0) + n
+        self._n_entries += n
+        self._update_top(code_index)
+
+    def discard(self,
+                position):
+        """
+        クローズしたポジションの注文を無効にする(ヒープからは取り出した時か、作り直す時に消す)
+        :param position:
+        :return:
+        """
+        n = self._live.pop(position.id, None)
+        if n is None:
+            return
+        self._n_dead += n
+        if self._n_dead > self.MIN_COMPACT and self._n_dead * 2 > self._n_entries:
+            self._compact()
+
+    def _compact(self):
+        """
+        クローズ済みのポジションの注文を取り除いてヒープを作り直す
+        :return:
+        """
+        for code_index in range(len(self._limit_heaps)):
+            for heaps in [self._limit_heaps, self._stop_heaps]:
+                heap = [entry for entry in heaps[code_index] if entry[2].position.id in self._live]
+                heapq.heapify(heap)
+                heaps[code_index] = heap
+            self._update_top(code_index)
+        self._n_entries -= self._n_dead
+        self._n_dead = 0
+
+    def _pop_triggered(self,
+                       heap: list,
+                       level: float,
+                       fired: dict,
+                       key: str):
+        """
+        heap の先頭から level 以下の注文を取り出し、有効な注文を fired(seq -> [callback, 指値, 逆指値]) に加える
+        :return:
+        """
+        while len(heap) > 0 and heap[0][0] <= level:
+            _, seq, callback = heapq.heappop(heap)
+            position_id = callback.position.id
+            if position_id not in self._live:
+                self._n_dead -= 1
+                self._n_entries -= 1
+                continue
+            self._live[position_id] -= 1
+            self._n_entries -= 1
+            fired.setdefault(seq, [callback, False, False])[1 if key == "limit" else 2] = True
+
+    def _trigger(self,
+                 account,
+                 df_bars: pd.DataFrame,
+                 phase: str):
+        """
+        df_bars(1銘柄1行)の足で、引っかかった注文を約定する
+        :param account:
+        :param df_bars: columns: code, date, open, high, low
+        :param phase: "begin" or "end"
+        :return:
+        """
+        if self._n_entries == 0 or len(df_bars) == 0:
+            return
+        code_indices = self._codes.get_indexer(df_bars["code"])
+        has_code = code_indices >= 0
+        if phase == "begin":
+            limit_levels = stop_levels = df_bars["open"].to_numpy(dtype=np.float64)
+        else:
+            limit_levels = df_bars["high"].to_numpy(dtype=np.float64)
+            stop_levels = df_bars["low"].to_numpy(dtype=np.float64)
+        safe_indices = np.where(has_code, code_indices, 0)
+        hit = has_code & ((limit_levels >= self._min_limit[safe_indices]) |
+                          (stop_levels <= self._max_stop[safe_indices]))
+
+        dates = df_bars["date"]
+        for row in np.flatnonzero(hit).tolist():
+            code_index = code_indices[row]
+            fired = {}
+            self._pop_triggered(self._limit_heaps[code_index], limit_levels[row], fired, "limit")
+            self._pop_triggered(self._stop_heaps[code_index], -stop_levels[row], fired, "stop")
+            self._update_top(code_index)
+
+            date = dates.iloc[row]
+            for seq in sorted(fired.keys()):
+                callback, is_limit, is_stop = fired[seq]
+                # 同じポジションの別のコールバックで、既にクローズしている場合
+                if callback.position.id not in self._live:
+                    continue
+                if phase == "begin":
+                    limit_price = limit_levels[row] if is_limit else None
+                    stop_price = stop_levels[row] if is_stop else None
+                else:
+                    limit_price = callback.limit_price if is_limit else None
+                    stop_price = callback.stop_price if is_stop else None
+                if self.logger is not None:
+                    self.logger.debug(f"order book hit({phase}): {callback}, limit_price: {limit_price}, stop_price: {stop_price}")
+                callback.close(account=account,
+                               date=date,
+                               limit_price=limit_price,
+                               stop_price=stop_price)
+
+    def on_step_begin(self,
+                      account,
+                      df_bars: pd.DataFrame):
+        """
+        戦略の取引前に、始値で引っかかった注文を始値で約定する
+        :param account:
+        :param df_bars: そのステップの足(1銘柄1行) columns: code, date, open, high, low
+        :return:
+        """
+        self._trigger(account=account, df_bars=df_bars, phase="begin")
+
+    def on_step_end(self,
+                    account,
+                    df_bars: pd.DataFrame):
+        """
+        戦略の取引後に、高値/安値で引っかかった注文を指値/逆指値で約定する
+        :param account:
+        :param df_bars: そのステップの足(1銘柄1行) columns: code, date, open, high, low
+        :return:
+        """
+        self._trigger(account=account, df_bars=df_bars, phase="end")
+
+
+class FirstTouchResolver:
+    """
+    OrderBook と同じインターフェースで、指値・逆指値が最初に引っかかる足をポジションを建てた時に求めておき、
+    その足のステップでクローズする(毎ステップ注文を判定しない)
+    Account(order_book=FirstTouchResolver(df_data=data_fetcher.df_data, logger=logger)) のように使う
+
+    code毎の 始値/高値/安値 の配列を、建てた足から先へ np.argmax で探す(先頭から64本, 128本, ... と広げながら探す)
+    約定の判定・価格・順序は OrderBook と同じ
+    - 建てた足: 高値/安値(on_step_end)のみ
+    - 以降の足: 始値(on_step_begin)、高値/安値(on_step_end)の順
+    ただし、1ステップで1銘柄1行(date_step_interval がデータの間隔と同じ)であることを前提にしている
+    建てた後に指値・逆指値を変えても反映されない
+    """
+    MIN_SEARCH = 64
+
+    def __init__(self,
+                 df_data: pd.DataFrame,
+                 logger: Logger = None):
+        """
+        :param df_data: バックテストに使う全データ(dateでソート済み。DataFetcher.df_data)
+        :param logger:
+        """
+        self.logger = logger
+        self._code_index = {}  # code -> codeの番号
+        self._dates = []  # codeの番号 -> dateの配列(ns)
+        self._open = []
+        self._high = []
+        self._low = []
+        dates = pd.DatetimeIndex(df_data["date"]).as_unit("ns").asi8
+        open_ = df_data["open"].to_numpy(dtype=np.float64)
+        high = df_data["high"].to_numpy(dtype=np.float64)
+        low = df_data["low"].to_numpy(dtype=np.float64)
+        for code, positions in df_data.groupby("code", sort=False, observed=True).indices.items():
+            self._code_index[code] = len(self._code_index)
+            self._dates.append(dates[positions])
+            self._open.append(open_[positions])
+            self._high.append(high[positions])
+            self._low.append(low[positions])
+
+        self._schedule = []  # [(date, phase, codeの番号, seq, callback, 指値, 逆指値)]
+        self._seq = 0
+        self._live = {}  # ポジションのid -> スケジュールにある数
+        self._n_entries = 0
+        self._n_dead = 0
+
+    def __len__(self):
+        """
+        スケジュールにあるクローズ数(クローズ済みのポジションの分を除く)
+        :return:
+        """
+        return self._n_entries - self._n_dead
+
+    def _first_touch(self,
+                     code_index: int,
+                     date_value: int,
+                     limit_price: float,
+                     stop_price: float):
+        """
+        date_value の足から先で、最初に引っかかる足を探す
+        :return: (足の番号, phase(0: begin, 1: end), 指値で約定するか, 逆指値で約定するか)。無ければNone
+        """
+        dates = self._dates[code_index]
+        open_ = self._open[code_index]
+        high = self._high[code_index]
+        low = self._low[code_index]
+        lo = int(dates.searchsorted(date_value, side="left"))
+        n = len(dates)
+        start = lo
+        size = self.MIN_SEARCH
+        while start < n:
+            stop = min(start + size, n)
+            end_limit = high[start:stop] >= limit_price
+            end_stop = low[start:stop] <= stop_price
+            begin_limit = open_[start:stop] >= limit_price
+            begin_stop = open_[start:stop] <= stop_price
+            if start == lo and dates[lo] == date_value:
+                # 建てた足は on_step_begin が済んでいる
+                begin_limit[0] = begin_stop[0] = False
+            begin_hit = begin_limit | begin_stop
+            end_hit = end_limit | end_stop
+            j_begin = int(np.argmax(begin_hit)) if begin_hit.any() else None
+            j_end = int(np.argmax(end_hit)) if end_hit.any() else None
+            if j_begin is not None and (j_end is None or j_begin <= j_end):
+                return start + j_begin, 0, bool(begin_limit[j_begin]), bool(begin_stop[j_begin])
+            if j_end is not None:
+                return start + j_end, 1, bool(end_limit[j_end]), bool(end_stop[j_end])
+            start = stop
+            size *= 2
+        return None
+
+    def add(self,
+            callback):
+        """
+        callback(set_position済み)の指値・逆指値で、最初に引っかかる足を求めてスケジュールする
+        :param callback: limit_price, stop_price, position を持つもの(OrderCallback)
+        :return:
+        """
+        position = callback.position
+        self._live.setdefault(position.id, 0)
+        code_index = self._code_index.get(position.code)
+        if code_index is None or (callback.limit_price is None and callback.stop_price is None):
+            return
+        touch = self._first_touch(code_index=code_index,
+                                  date_value=pd.Timestamp(position.date).value,
+                                  limit_price=np.inf if callback.limit_price is None else callback.limit_price,
+                                  stop_price=-np.inf if callback.stop_price is None else callback.stop_price)
+        if touch is None:
+            return
+        row, phase, is_limit, is_stop = touch
+        if phase == 0:
+            limit_price = self._open[code_index][row] if is_limit else None
+            stop_price = self._open[code_index][row] if is_stop else None
+        else:
+            limit_price = callback.limit_price if is_limit else None
+            stop_price = callback.stop_price if is_stop else None
+        heapq.heappush(self._schedule, (self._dates[code_index][row], phase, code_index, self._seq, callback,
+                                        limit_price, stop_price))
+        self._seq += 1
+        self._live[position.id] += 1
+        self._n_entries += 1
+
+    def discard(self,
+                position):
+        """
+        クローズしたポジションのスケジュールを無効にする(取り出した時か、作り直す時に消す)
+        :param position:
+        :return:
+        """
+        n = self._live.pop(position.id, None)
+        if n is None:
+            return
+        self._n_dead += n
+        if self._n_dead > OrderBook.MIN_COMPACT and self._n_dead * 2 > self._n_entries:
+            self._schedule = [entry for entry in self._schedule if entry[4].position.id in self._live]
+            heapq.heapify(self._schedule)
+            self._n_entries -= self._n_dead
+            self._n_dead = 0
+
+    def _trigger(self,
+                 account,
+                 df_bars: pd.DataFrame,
+                 phase: int):
+        if self._n_entries == 0 or len(df_bars) == 0:
+            return
+        key = (pd.Timestamp(df_bars["date"].max()).value, phase)
+        schedule = self._schedule
+        while len(schedule) > 0 and (schedule[0][0], schedule[0][1]) <= key:
+            date, _, _, _, callback, limit_price, stop_price = heapq.heappop(schedule)
+            self._n_entries -= 1
+            position_id = callback.position.id
+            if position_id not in self._live:
+                self._n_dead -= 1
+                continue
+            self._live[position_id] -= 1
+            if self.logger is not None:
+                self.logger.debug(f"first touch hit: {callback}, limit_price: {limit_price}, stop_price: {stop_price}")
+            callback.close(account=account,
+                           date=pd.Timestamp(date),
+                           limit_price=limit_price,
+                           stop_price=stop_price)
+
+    def on_step_begin(self,
+                      account,
+                      df_bars: pd.DataFrame):
+        """
+        スケジュールのうち、このステップの始値で約定するものをクローズする
+        :param account:
+        :param df_bars: そのステップの足(1銘柄1行) columns: code, date, open, high, low
+        :return:
+        """
+        self._trigger(account=account, df_bars=df_bars, phase=0)
+
+    def on_step_end(self,
+                    account,
+                    df_bars: pd.DataFrame):
+        """
+        スケジュールのうち、このステップの高値/安値で約定するものをクローズする
+        :param account:
+        :param df_bars: そのステップの足(1銘柄1行) columns: code, date, open, high, low
+        :return:
+        """
+        self._trigger(account=account, df_bars=df_bars, phase=1)
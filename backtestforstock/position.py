@@ -1,11 +1,18 @@
 import dataclasses
 from datetime import datetime as dt
 from typing import List
+import numpy as np
 import pandas as pd
 from logging import Logger
 from backtestforstock.callbacks.core import PositionCallback
 
 class PositionManager:
+    """
+    ポジションをidとcodeで引けるように持つ
+    ポジションの追加・削除・取得の計算量は、保有している全ポジションの数によらない
+    (get_positions はそのcodeのポジション数に比例する)
+    順序はどれもポジションを建てた順(id順)
+    """
     def __init__(self,
                  logger: Logger,
                  is_allowed_short_position: bool=True):
@@ -13,10 +20,19 @@ class PositionManager:
         :param is_allowed_short_position: Trueなら空売りを許す
         """
         self.logger = logger
-        self.positions = []
+        self._positions = {}  # id -> Position
+        self._positions_by_code = {}  # code -> {id -> Position}
         self.is_allowed_short_position = is_allowed_short_position
         self.id_max = 0
 
+    @property
+    def positions(self) -> list:
+        """
+        全ポジションのリスト(id順)
+        :return: list
+        """
+        return list(self._positions.values())
+
     def get_positions(self,
                       code: str) -> list:
         """
@@ -24,11 +40,31 @@ class PositionManager:
         :param code:
         :return: list
         """
-        ret = []
-        for position in self.positions:
-            if position.code == code:
-                ret.append(position)
-        return ret
+        positions = self._positions_by_code.get(code)
+        if positions is None:
+            return []
+        return list(positions.values())
+
+    def get_position(self,
+                     id: int) -> "Position":
+        """
+        指定した id のポジションを返す。無ければNone
+        :param id:
+        :return:
+        """
+        return self._positions.get(id)
+
+    def amount_by_code(self,
+                       signed: bool = False) -> pd.Series:
+        """
+        code毎のポジション量の合計
+        :param signed: Trueなら short のポジションを負として合計する
+        :return: pd.Series code -> amount (codeの昇順)
+        """
+        ret = {}
+        for code, positions in self._positions_by_code.items():
+            ret[code] = sum(-x.amount if signed and x.category == "short" else x.amount for x in positions.values())
+        return pd.Series(ret, dtype=float).sort_index()
 
     def open_position(self,
                       code: str,
@@ -49,8 +85,9 @@ class PositionManager:
             callback.set_position(position)
             callback.set_logger(self.logger)
         self.id_max += 1
-        self.positions.append(position)
-        return
+        self._positions[position.id] = position
+        self._positions_by_code.setdefault(code, {})[position.id] = position
+        return position
 
     def close_position(self,
                        position,
@@ -61,11 +98,15 @@ class PositionManager:
         :param amount:
         :return:
         """
-        self.logger.debug(f"close前: {position}")
+        self.logger.debug("close前: %s", position)
         position.amount -= amount
-        self.logger.debug(f"close後: {position}")
+        self.logger.debug("close後: %s", position)
         if position.amount == 0:
-            self.positions.remove(position)
+            del self._positions[position.id]
+            positions = self._positions_by_code[position.code]
+            del positions[position.id]
+            if len(positions) == 0:
+                del self._positions_by_code[position.code]
         return
 
 
@@ -77,4 +118,262 @@ class Position:
     category: str  # long or short
     amount: float  # if buy: plus; if sell: minus.
     price: float
-    callbacks: List[PositionCallback] = dataclasses.field(default_factory=list)
\ No newline at end of file
+    callbacks: List[PositionCallback] = dataclasses.field(default_factory=list)
+
+
+class PositionView:
+    """
+    ArrayPositionManager の1ポジションを Position と同じ属性で参照するビュー
+    値は ArrayPositionManager の配列から読む(amount 等の変更はすぐ反映される)
+    """
+    __slots__ = ["_book", "_row", "_generation", "id"]
+
+    def __init__(self,
+                 book,
+                 id: int,
+                 row: int):
+        self._book = book
+        self.id = id
+        self._row = row
+        self._generation = book._generation
+
+    def _get_row(self) -> int:
+        # 配列を詰め直した(compact)後は行番号を引き直す
+        if self._generation != self._book._generation:
+            if self.id not in self._book._row_of:
+                raise KeyError(f"ポジション(id={self.id})はクローズ済みです")
+            self._row = self._book._row_of[self.id]
+            self._generation = self._book._generation
+        return self._row
+
+    @property
+    def date(self) -> pd.Timestamp:
+        return pd.Timestamp(self._book._date[self._get_row()])
+
+    @property
+    def code(self) -> str:
+        return self._book._codes[self._book._code[self._get_row()]]
+
+    @property
+    def category(self) -> str:
+        return "short" if self._book._short[self._get_row()] else "long"
+
+    @property
+    def amount(self) -> float:
+        return self._book._amount[self._get_row()].item()
+
+    @property
+    def price(self) -> float:
+        return self._book._price[self._get_row()].item()
+
+    @property
+    def callbacks(self) -> List[PositionCallback]:
+        return self._book._callbacks.get(self.id, [])
+
+    def _fields(self) -> tuple:
+        return (self.id, self.date, self.code, self.category, self.amount, self.price, self.callbacks)
+
+    def __eq__(self, other):
+        if not isinstance(other, (Position, PositionView)):
+            return NotImplemented
+        return self._fields() == (other.id, other.date, other.code, other.category, other.amount, other.price, other.callbacks)
+
+    __hash__ = None
+
+    def __repr__(self):
+        return (f"PositionView(id={self.id}, date={self.date}, code={self.code}, category={self.category}, "
+                f"amount={self.amount}, price={self.price}, callbacks={self.callbacks})")
+
+
+class ArrayPositionManager:
+    """
+    PositionManager と同じインターフェースで、ポジションを列毎のNumPy配列(struct of arrays)で持つ
+    (id, codeの番号, amount, price, category, 建てた日時)
+    Position オブジェクトは持たず、positions / get_positions 等で要求された時に PositionView を作る。
+    大量のポジションを持つ場合のメモリが少なく、amount_by_code / to_frame は配列のまま集計する
+
+    クローズしたポジションの行は、その後のopen_positionで空き行が半分を超えたら詰め直す
+    """
+    MIN_CAPACITY = 1024
+
+    def __init__(self,
+                 logger: Logger,
+                 is_allowed_short_position: bool=True):
+        """
+        :param is_allowed_short_position: Trueなら空売りを許す
+        """
+        self.logger = logger
+        self.is_allowed_short_position = is_allowed_short_position
+        self.id_max = 0
+
+        self._n_rows = 0
+        self._id = np.empty(self.MIN_CAPACITY, dtype=np.int64)
+        self._code = np.empty(self.MIN_CAPACITY, dtype=np.int32)
+        self._amount = np.empty(self.MIN_CAPACITY, dtype=np.float64)
+        self._price = np.empty(self.MIN_CAPACITY, dtype=np.float64)
+        self._short = np.empty(self.MIN_CAPACITY, dtype=bool)
+        self._date = np.empty(self.MIN_CAPACITY, dtype="datetime64[ns]")
+        self._alive = np.zeros(self.MIN_CAPACITY, dtype=bool)
+
+        self._codes = []  # codeの番号 -> code
+        self._code_index = {}  # code -> codeの番号
+        self._row_of = {}  # id -> 行番号 (保有中のみ、id順)
+        self._ids_by_code = {}  # codeの番号 -> {id: None} (保有中のみ、id順)
+        self._callbacks = {}  # id -> callbacks (callbacksがあるもののみ)
+        self._generation = 0
+
+    @property
+    def positions(self) -> list:
+        """
+        全ポジションのビューのリスト(id順)
+        :return: list of PositionView
+        """
+        return [PositionView(book=self, id=id, row=row) for id, row in self._row_of.items()]
+
+    def get_positions(self,
+                      code: str) -> list:
+        """
+        指定した code のポジション一覧を返す
+        :param code:
+        :return: list of PositionView
+        """
+        code_index = self._code_index.get(code)
+        if code_index is None or code_index not in self._ids_by_code:
+            return []
+        row_of = self._row_of
+        return [PositionView(book=self, id=id, row=row_of[id]) for id in self._ids_by_code[code_index]]
+
+    def get_position(self,
+                     id: int) -> PositionView:
+        """
+        指定した id のポジションを返す。無ければNone
+        :param id:
+        :return:
+        """
+        row = self._row_of.get(id)
+        if row is None:
+            return None
+        return PositionView(book=self, id=id, row=row)
+
+    def amount_by_code(self,
+                       signed: bool = False) -> pd.Series:
+        """
+        code毎のポジション量の合計
+        :param signed: Trueなら short のポジションを負として合計する
+        :return: pd.Series code -> amount (codeの昇順)
+        """
+        alive = self._alive[:self._n_rows]
+        amount = self._amount[:self._n_rows][alive]
+        if signed:
+            amount = np.where(self._short[:self._n_rows][alive], -amount, amount)
+        codes = self._code[:self._n_rows][alive]
+        sums = np.bincount(codes, weights=amount, minlength=len(self._codes))
+        held = np.bincount(codes, minlength=len(self._codes)) > 0
+        return pd.Series(sums[held], index=np.array(self._codes, dtype=object)[held], dtype=float).sort_index()
+
+    def to_frame(self) -> pd.DataFrame:
+        """
+        保有中のポジションのDataFrame(id順)
+        :return: columns: id, date, code, category, amount, price
+        """
+        alive = self._alive[:self._n_rows]
+        return pd.DataFrame({"id": self._id[:self._n_rows][alive],
+                             "date": self._date[:self._n_rows][alive],
+                             "code": np.array(self._codes, dtype=object)[self._code[:self._n_rows][alive]],
+                             "category": np.where(self._short[:self._n_rows][alive], "short", "long"),
+                             "amount": self._amount[:self._n_rows][alive],
+                             "price": self._price[:self._n_rows][alive]})
+
+    def _reserve(self):
+        """
+        1行追加できるようにする。空き行が半分を超えていたら詰め直し、足りなければ配列を倍にする
+        :return:
+        """
+        if self._n_rows < len(self._id):
+            return
+        if len(self._row_of) * 2 < self._n_rows:
+            self._compact()
+            return
+        capacity = len(self._id) * 2
+        for name in ["_id", "_code", "_amount", "_price", "_short", "_date", "_alive"]:
+            values = getattr(self, name)
+            new_values = np.zeros(capacity, dtype=values.dtype) if name == "_alive" else np.empty(capacity, dtype=values.dtype)
+            new_values[:self._n_rows] = values[:self._n_rows]
+            setattr(self, name, new_values)
+
+    def _compact(self):
+        """
+        クローズ済みの行を取り除いて詰め直す。行番号が変わるので、既存のビューは次の参照時に行番号を引き直す
+        :return:
+        """
+        rows = np.flatnonzero(self._alive[:self._n_rows])
+        n = len(rows)
+        for name in ["_id", "_code", "_amount", "_price", "_short", "_date"]:
+            values = getattr(self, name)
+            values[:n] = values[rows]
+        self._alive[:n] = True
+        self._alive[n:] = False
+        self._n_rows = n
+        self._row_of = dict(zip(self._id[:n].tolist(), range(n)))
+        self._generation += 1
+
+    def open_position(self,
+                      code: str,
+                      date: dt,
+                      amount: float,
+                      price: float,
+                      category: str,
+                      callbacks: List[PositionCallback]):
+        self._reserve()
+        code_index = self._code_index.get(code)
+        if code_index is None:
+            code_index = len(self._codes)
+            self._code_index[code] = code_index
+            self._codes.append(code)
+
+        id = self.id_max
+        row = self._n_rows
+        self._id[row] = id
+        self._code[row] = code_index
+        self._amount[row] = amount
+        self._price[row] = price
+        self._short[row] = category == "short"
+        self._date[row] = np.datetime64(pd.Timestamp(date), "ns")
+        self._alive[row] = True
+        self._n_rows += 1
+        self.id_max += 1
+
+        self._row_of[id] = row
+        self._ids_by_code.setdefault(code_index, {})[id] = None
+        position = PositionView(book=self, id=id, row=row)
+        if len(callbacks) > 0:
+            self._callbacks[id] = callbacks
+            for callback in callbacks:
+                callback.set_position(position)
+                callback.set_logger(self.logger)
+        return position
+
+    def close_position(self,
+                       position,
+                       amount: float):
+        """
+        ポジション position をクローズする
+        全量クローズした場合も、次の open_position までは position の値(amount=0)を参照できる
+        :param position:
+        :param amount:
+        :return:
+        """
+        row = self._row_of[position.id]
+        self.logger.debug("close前: %s", position)
+        self._amount[row] -= amount
+        self.logger.debug("close後: %s", position)
+        if self._amount[row] == 0:
+            self._alive[row] = False
+            del self._row_of[position.id]
+            code_index = self._code[row]
+            ids = self._ids_by_code[code_index]
+            del ids[position.id]
+            if len(ids) == 0:
+                del self._ids_by_code[code_index]
+            self._callbacks.pop(position.id, None)
+        return
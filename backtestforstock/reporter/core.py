@@ -1,5 +1,8 @@
 from backtestforstock.account import Account
+from backtestforstock.history import HistoryManager
 import dataclasses
+import numpy as np
+import pandas as pd
 
 
 class Reporter:
@@ -31,3 +34,111 @@ class Summary:
     profit_summary: ProfitAndLossSummary
     loss_summary: ProfitAndLossSummary
 
+
+class SummaryReporter(Reporter):
+    """
+    取引履歴の決済(id_close が有る履歴)から損益を集計する
+    決済の履歴は、id_close のポジションの建値(price_open)を持っているので、それと決済値(price_close)で損益を計算する
+
+    - 損益: (price_close - price_open) * amount。Account は short のポジションも long と同じく、
+      建てる時に price * amount を払い、決済で price * amount を受け取るので、short も符号を反転しない
+      (全てのポジションを決済した後の損益の合計は、現金の増減と一致する)
+    - 取引金額: price_open * amount
+    - earn は全ての決済、profit は損益が正、loss は損益が負の決済
+    - 未決済のポジションは含めない
+
+    HistoryManager.iter_frames を1つずつ、銘柄・ポジションのcategory毎に np.bincount で集計するので、
+    取引履歴をファイルに書き出している場合(spill_path)もメモリ上に全件読み込まない
+    """
+    KINDS = ["earn", "profit", "loss"]
+
+    def _aggregate(self,
+                   history_manager: HistoryManager):
+        """
+        銘柄 * category 毎の、損益・取引金額・取引回数の合計
+        :param history_manager:
+        :return: (codes, 損益, 取引金額, 取引回数)
+            損益・取引金額・取引回数は shape (len(KINDS), len(codes) * len(CATEGORIES))
+            列は 銘柄の番号 * len(CATEGORIES) + categoryの番号
+        """
+        codes = history_manager.codes
+        n_categories = len(HistoryManager.CATEGORIES)
+        n_keys = len(codes) * n_categories
+        pl_amount = np.zeros((len(self.KINDS), n_keys))
+        trade_amount = np.zeros((len(self.KINDS), n_keys))
+        trade_count = np.zeros((len(self.KINDS), n_keys), dtype=np.int64)
+
+        for df in history_manager.iter_frames():
+            is_close = df["id_close"].notna().to_numpy()
+            if not is_close.any():
+                continue
+            # 決済の履歴の category は決済の売買方向なので、ポジションの category はその反対
+            category = n_categories - 1 - df["category"].cat.codes.to_numpy()[is_close]
+            key = df["code"].cat.codes.to_numpy()[is_close].astype(np.int64) * n_categories + category
+            amount = df["amount"].to_numpy()[is_close]
+            price_open = df["price_open"].to_numpy()[is_close]
+            pl = (df["price_close"].to_numpy()[is_close] - price_open) * amount
+            notional = price_open * amount
+
+            for i, mask in enumerate([None, pl > 0, pl < 0]):
+                if mask is None:
+                    k, p, n = key, pl, notional
+                else:
+                    k, p, n = key[mask], pl[mask], notional[mask]
+                pl_amount[i] += np.bincount(k, weights=p, minlength=n_keys)
+                trade_amount[i] += np.bincount(k, weights=n, minlength=n_keys)
+                trade_count[i] += np.bincount(k, minlength=n_keys)
+        return codes, pl_amount, trade_amount, trade_count
+
+    @staticmethod
+    def _summary(pl_amount: float,
+                 trade_amount: float,
+                 trade_count: int) -> ProfitAndLossSummary:
+        return ProfitAndLossSummary(pl_amount=float(pl_amount),
+                                    pl_mean=float(pl_amount / trade_count) if trade_count > 0 else 0.,
+                                    trade_amount=float(trade_amount),
+                                    trade_count=int(trade_count))
+
+    def summarize(self,
+                  history_manager: HistoryManager) -> Summary:
+        """
+        全銘柄の損益の集計
+        :param history_manager:
+        :return:
+        """
+        _, pl_amount, trade_amount, trade_count = self._aggregate(history_manager)
+        summaries = [self._summary(pl_amount[i].sum(), trade_amount[i].sum(), trade_count[i].sum())
+                     for i in range(len(self.KINDS))]
+        return Summary(*summaries)
+
+    def breakdown(self,
+                  history_manager: HistoryManager) -> pd.DataFrame:
+        """
+        銘柄・ポジションのcategory毎の損益の集計
+        :param history_manager:
+        :return: index: (code, category), columns: {earn, profit, loss}_{pl_amount, pl_mean, trade_amount, trade_count}
+            決済が無い組み合わせは含めない
+        """
+        codes, pl_amount, trade_amount, trade_count = self._aggregate(history_manager)
+        index = pd.MultiIndex.from_product([codes, HistoryManager.CATEGORIES], names=["code", "category"])
+        columns = {}
+        for i, kind in enumerate(self.KINDS):
+            columns[f"{kind}_pl_amount"] = pl_amount[i]
+            with np.errstate(divide="ignore", invalid="ignore"):
+                columns[f"{kind}_pl_mean"] = np.where(trade_count[i] > 0, pl_amount[i] / trade_count[i], 0.)
+            columns[f"{kind}_trade_amount"] = trade_amount[i]
+            columns[f"{kind}_trade_count"] = trade_count[i]
+        df = pd.DataFrame(columns, index=index)
+        return df[trade_count[0] > 0]
+
+    def output_report(self,
+                      account: Account) -> Summary:
+        """
+        account の取引履歴の損益を集計し、ログに出力する
+        :param account:
+        :return:
+        """
+        summary = self.summarize(account.history_manager)
+        for kind in self.KINDS:
+            account.logger.info(f"{kind}: {getattr(summary, f'{kind}_summary')}")
+        return summary
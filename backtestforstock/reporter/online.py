@@ -0,0 +1,129 @@
+from backtestforstock.reporter.core import ProfitAndLossSummary, Summary
+import math
+import pandas as pd
+
+
+class OnlineStatistics:
+    """
+    決済の度に損益の統計量を更新する(取引履歴を読み直さずに、いつでも O(1) で Summary を取得できる)
+    HistoryManager(statistics=OnlineStatistics()) のように渡すと、HistoryManager.add / extend で決済が追加される度に update される
+
+    損益・取引金額の定義は SummaryReporter と同じ
+    - 損益: (price_close - price_open) * amount(short も符号を反転しない)
+    - 取引金額: price_open * amount
+
+    Attributes
+    ----------
+    pl_mean, pl_std: 決済1回あたりの損益の平均・標準偏差(Welford)
+    pl_cumsum: 損益の累計
+    max_drawdown: 損益の累計の、それまでの最大値からの下落幅の最大値
+    codes: code -> {"trade_count", "pl_amount", "profit_count", "loss_count"}
+    """
+
+    def __init__(self):
+        self.trade_count = 0
+        self.trade_amount = 0.
+        self.pl_cumsum = 0.
+        self.pl_mean = 0.
+        self._pl_m2 = 0.
+        self.profit_count = 0
+        self.profit_amount = 0.
+        self.profit_trade_amount = 0.
+        self.loss_count = 0
+        self.loss_amount = 0.
+        self.loss_trade_amount = 0.
+        self.pl_peak = 0.
+        self.max_drawdown = 0.
+        self.codes = {}
+
+    def update(self,
+               code: str,
+               amount: float,
+               price_open: float,
+               price_close: float):
+        """
+        決済1件分更新する
+        :param code:
+        :param amount:
+        :param price_open: ポジションの建値
+        :param price_close: 決済値
+        :return:
+        """
+        pl = (price_close - price_open) * amount
+        trade_amount = price_open * amount
+
+        self.trade_count += 1
+        self.trade_amount += trade_amount
+        delta = pl - self.pl_mean
+        self.pl_mean += delta / self.trade_count
+        self._pl_m2 += delta * (pl - self.pl_mean)
+
+        self.pl_cumsum += pl
+        if self.pl_cumsum > self.pl_peak:
+            self.pl_peak = self.pl_cumsum
+        elif self.pl_peak - self.pl_cumsum > self.max_drawdown:
+            self.max_drawdown = self.pl_peak - self.pl_cumsum
+
+        tally = self.codes.get(code)
+        if tally is None:
+            tally = {"trade_count": 0, "pl_amount": 0., "profit_count": 0, "loss_count": 0}
+            self.codes[code] = tally
+        tally["trade_count"] += 1
+        tally["pl_amount"] += pl
+
+        if pl > 0:
+            self.profit_count += 1
+            self.profit_amount += pl
+            self.profit_trade_amount += trade_amount
+            tally["profit_count"] += 1
+        elif pl < 0:
+            self.loss_count += 1
+            self.loss_amount += pl
+            self.loss_trade_amount += trade_amount
+            tally["loss_count"] += 1
+
+    @property
+    def pl_std(self) -> float:
+        """
+        決済1回あたりの損益の標準偏差(不偏)。2回未満ならNaN
+        :return:
+        """
+        if self.trade_count < 2:
+            return math.nan
+        return math.sqrt(self._pl_m2 / (self.trade_count - 1))
+
+    @property
+    def win_rate(self) -> float:
+        """
+        決済のうち損益が正の割合。決済が無ければNaN
+        :return:
+        """
+        if self.trade_count == 0:
+            return math.nan
+        return self.profit_count / self.trade_count
+
+    @staticmethod
+    def _summary(pl_amount: float,
+                 trade_amount: float,
+                 trade_count: int) -> ProfitAndLossSummary:
+        return ProfitAndLossSummary(pl_amount=pl_amount,
+                                    pl_mean=pl_amount / trade_count if trade_count > 0 else 0.,
+                                    trade_amount=trade_amount,
+                                    trade_count=trade_count)
+
+    def summary(self) -> Summary:
+        """
+        現時点の Summary(SummaryReporter.summarize と同じ)
+        :return:
+        """
+        return Summary(earn_summary=self._summary(self.pl_cumsum, self.trade_amount, self.trade_count),
+                       profit_summary=self._summary(self.profit_amount, self.profit_trade_amount, self.profit_count),
+                       loss_summary=self._summary(self.loss_amount, self.loss_trade_amount, self.loss_count))
+
+    def code_frame(self) -> pd.DataFrame:
+        """
+        銘柄毎の集計
+        :return: index: code, columns: trade_count, pl_amount, profit_count, loss_count
+        """
+        return pd.DataFrame.from_dict(self.codes, orient="index",
+                                      columns=["trade_count", "pl_amount", "profit_count", "loss_count"])
@@ -0,0 +1,409 @@
+import dataclasses
+import itertools
+import multiprocessing
+import time
+import pandas as pd
+from datetime import timedelta
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime as dt
+from logging import WARNING
+from typing import Callable
+from backtestforstock.datafetchers.core import DataFetcher
+from backtestforstock.features.core import FeatureProcessor
+from backtestforstock.strategies.core import Strategy
+from backtestforstock.account import Account
+from backtestforstock.backtester import BackTester, convert_date_step_interval
+from backtestforstock.history import HistoryManager
+from backtestforstock.reporter.online import OnlineStatistics
+from backtestforstock.common import get_logger
+
+# ワーカープロセスで共有するデータ等(_init_worker でセットする)
+_worker_context = None
+
+
+def expand_param_grid(param_grid) -> list:
+    """
+    パラメータの組み合わせを展開する
+    :param param_grid: dict(パラメータ名 -> 値のリスト)なら全組み合わせ、dictのリストならそのまま
+    :return: list of dict
+    """
+    if isinstance(param_grid, dict):
+        keys = list(param_grid.keys())
+        return [dict(zip(keys, values)) for values in itertools.product(*[param_grid[key] for key in keys])]
+    return [dict(x) for x in param_grid]
+
+
+def summarize_account(account: Account,
+                      initial_cash: float,
+                      last_close: pd.Series) -> dict:
+    """
+    バックテスト結果の要約
+    :param account:
+    :param initial_cash:
+    :param last_close: code -> 最終終値
+    :return: dict
+        cash: 現金
+        position_value: 保有ポジションの最終終値での評価額
+        equity: cash + position_value
+        pl_amount: equity - initial_cash
+        trade_count: 取引回数(履歴の件数)
+        position_count: 保有ポジション数
+    """
+    position_value = 0
+    for position in account.position_manager.positions:
+        position_value += position.amount * last_close[position.code]
+    equity = account.cash + position_value
+    return {"cash": account.cash,
+            "position_value": position_value,
+            "equity": equity,
+            "pl_amount": equity - initial_cash,
+            "trade_count": len(account.history_manager),
+            "position_count": len(account.position_manager.positions)}
+
+
+def _init_worker(context: dict):
+    global _worker_context
+    _worker_context = context
+
+
+def _backtest(context: dict,
+              df_data: pd.DataFrame,
+              start_datetime: dt,
+              strategy: Strategy) -> BackTester:
+    """
+    context の設定で、df_data に対してバックテストを1回実行する
+    context に early_stop があれば、Accountの取引履歴に OnlineStatistics を付けて BackTester に渡す
+    :param context:
+    :param df_data: dateでソート済みのデータ
+    :param start_datetime:
+    :param strategy:
+    :return: 実行後のBackTester
+    """
+    data_fetcher = DataFetcher(df=df_data,
+                               start_datetime=start_datetime,
+                               max_lookback=context["max_lookback"])
+    logger = get_logger(level=context["log_level"])
+    early_stop = context.get("early_stop")
+    account = Account(initial_cash=context["initial_cash"],
+                      logger=logger,
+                      history_manager=None if early_stop is None else HistoryManager(logger=logger,
+                                                                                     statistics=OnlineStatistics()))
+    feature_processor_factory = context["feature_processor_factory"]
+    backtester = BackTester(data_fetcher=data_fetcher,
+                            strategy=strategy,
+                            account=account,
+                            date_step_interval=context["date_step_interval"],
+                            feature_processor=None if feature_processor_factory is None else feature_processor_factory(),
+                            precompute_features=context["precompute_features"],
+                            verify_samples=context["verify_samples"],
+                            early_stop=early_stop)
+    backtester.run()
+    return backtester
+
+
+def _run_one(params: dict) -> dict:
+    """
+    _worker_context のデータで、パラメータ params の戦略のバックテストを1回実行する
+    :param params:
+    :return: 要約(summarize_account) + elapsed (+ early_stop を指定した場合は stopped_early)
+    """
+    context = _worker_context
+    start = time.perf_counter()
+    backtester = _backtest(context=context,
+                           df_data=context["df_data"],
+                           start_datetime=context["start_datetime"],
+                           strategy=context["strategy_factory"](**params))
+
+    ret = summarize_account(account=backtester.account,
+                            initial_cash=context["initial_cash"],
+                            last_close=context["last_close"])
+    if context["early_stop"] is not None:
+        ret["stopped_early"] = backtester.stopped_early
+    ret["elapsed"] = time.perf_counter() - start
+    return ret
+
+
+def _run_window(window: dict):
+    """
+    _worker_context のデータで、window の期間のバックテストを1回実行する
+    :param window: WalkForward.windows の要素
+    :return: (要約(summarize_account) + elapsed, 取引履歴(HistoryManager))
+    """
+    context = _worker_context
+    start = time.perf_counter()
+    df_data = context["df_data"]
+    strategy = context["strategy_factory"](df_data.iloc[window["train_lo"]:window["test_lo"]])
+    df_window = df_data.iloc[window["train_lo"]:window["test_hi"]]
+    account = _backtest(context=context,
+                        df_data=df_window,
+                        start_datetime=window["test_start"],
+                        strategy=strategy).account
+
+    ret = summarize_account(account=account,
+                            initial_cash=context["initial_cash"],
+                            last_close=df_window.groupby("code", observed=True)["close"].last())
+    ret["elapsed"] = time.perf_counter() - start
+    history_manager = account.history_manager
+    history_manager.logger = None
+    return ret, history_manager
+
+
+def _map(context: dict,
+         func,
+         jobs: list,
+         n_jobs: int) -> list:
+    """
+    jobs の各要素に func を実行する。n_jobs > 1 ならプロセスプールで並列実行する
+    fork が使える環境では、context はワーカーにfork時に引き継ぐ(pickleしない)
+    :param context: ワーカーで _worker_context にセットするもの
+    :param func:
+    :param jobs:
+    :param n_jobs:
+    :return: funcの戻り値のリスト(jobsと同じ順序)
+    """
+    if n_jobs == 1:
+        _init_worker(context)
+        try:
+            return [func(job) for job in jobs]
+        finally:
+            _init_worker(None)
+
+    if "fork" in multiprocessing.get_all_start_methods():
+        mp_context = multiprocessing.get_context("fork")
+    else:
+        mp_context = None
+    with ProcessPoolExecutor(max_workers=n_jobs,
+                             mp_context=mp_context,
+                             initializer=_init_worker,
+                             initargs=(context,)) as executor:
+        return list(executor.map(func, jobs))
+
+
+def _make_context(data_files: list,
+                  df: pd.DataFrame,
+                  data_fetcher_params: dict,
+                  **kwargs) -> dict:
+    """
+    データを一度だけ読み込み(dateでソート)、ワーカーに渡すcontextを作る
+    :return:
+    """
+    df_data = DataFetcher(data_files=data_files,
+                          df=df,
+                          **data_fetcher_params).df_data
+    return {"df_data": df_data, **kwargs}
+
+
+class ParameterSweep:
+    """
+    同じデータに対して、戦略のパラメータを変えながらバックテストを繰り返すクラス
+
+    データは初期化時に一度だけ読み込み(dateでソート)、各バックテストはそのデータを読み取り専用で使う。
+    n_jobs > 1 の場合はプロセスプールで並列実行する。
+    fork が使える環境ではワーカーはデータをfork時に引き継ぐので、実行毎のデータの読み込みやコピーは発生しない
+    (fork が使えない環境では、ワーカー毎に1回データを転送する)
+    """
+    def __init__(self,
+                 strategy_factory: Callable[..., Strategy],
+                 param_grid,
+                 initial_cash: int,
+                 date_step_interval: str,
+                 data_files: list = None,
+                 df: pd.DataFrame = None,
+                 start_datetime: dt = None,
+                 max_lookback=None,
+                 feature_processor_factory: Callable[[], FeatureProcessor] = None,
+                 precompute_features: bool = False,
+                 verify_samples: int = 5,
+                 n_jobs: int = 1,
+                 log_level=WARNING,
+                 early_stop: Callable[[Account], bool] = None,
+                 **data_fetcher_params):
+        """
+        :param strategy_factory: パラメータをキーワード引数で受け取り、Strategyを返す関数(クラスでも良い)
+            n_jobs > 1 でforkが使えない環境では、pickle可能(モジュールのトップレベルで定義)である必要がある
+        :param param_grid: dict(パラメータ名 -> 値のリスト)なら全組み合わせ、dictのリストならそのまま実行する
+        :param initial_cash:
+        :param date_step_interval: BackTesterと同じ
+        :param data_files: DataFetcherと同じ
+        :param df: DataFetcherと同じ
+        :param start_datetime: defaultはデータの最初のdate
+        :param max_lookback: DataFetcherと同じ
+        :param feature_processor_factory: FeatureProcessorを返す関数。状態を持つので実行毎に作る
+        :param precompute_features: BackTesterと同じ
+        :param verify_samples: BackTesterと同じ
+        :param n_jobs: 並列数
+        :param log_level: 各実行のAccountのログレベル
+        :param early_stop: BackTesterと同じ。負けているパラメータを途中で打ち切る場合に使う
+            account.history_manager.statistics に OnlineStatistics を付けるので、それを見て判定できる
+            例: lambda account: account.history_manager.statistics.max_drawdown > 100_000
+            指定した場合は結果に stopped_early(打ち切ったか)のカラムを追加する
+        :param data_fetcher_params: データの読み込み時に DataFetcher に渡す引数(typed, cache_dir, date_range, codes 等)
+        """
+        self.params_list = expand_param_grid(param_grid)
+        self.n_jobs = n_jobs
+        self.context = _make_context(data_files=data_files,
+                                     df=df,
+                                     data_fetcher_params=data_fetcher_params,
+                                     max_lookback=max_lookback,
+                                     initial_cash=initial_cash,
+                                     date_step_interval=date_step_interval,
+                                     strategy_factory=strategy_factory,
+                                     feature_processor_factory=feature_processor_factory,
+                                     precompute_features=precompute_features,
+                                     verify_samples=verify_samples,
+                                     log_level=log_level,
+                                     early_stop=early_stop)
+        df_data = self.context["df_data"]
+        self.context["start_datetime"] = df_data["date"].min() if start_datetime is None else start_datetime
+        self.context["last_close"] = df_data.groupby("code", observed=True)["close"].last()
+
+    def run(self) -> pd.DataFrame:
+        """
+        全パラメータのバックテストを実行する
+        :return: 1行が1回の実行。パラメータのカラム + summarize_account のカラム + elapsed(秒)
+        """
+        summaries = _map(context=self.context, func=_run_one, jobs=self.params_list, n_jobs=self.n_jobs)
+        return pd.DataFrame([{**params, **summary} for params, summary in zip(self.params_list, summaries)])
+
+
+@dataclasses.dataclass
+class WalkForwardResult:
+    """
+    summary: 1行が1つの期間。期間(window, train_start, test_start, test_end) + summarize_account のカラム
+        + elapsed(秒) + history_id_start(history_manager 上の、その期間の最初の取引履歴のid)
+    history_manager: 全期間の取引履歴を期間の順につなげたもの。id(取引履歴), id_close(ポジション)は全期間の通し番号に振り直している
+    """
+    summary: pd.DataFrame
+    history_manager: HistoryManager
+
+
+class WalkForward:
+    """
+    時系列を 学習期間(train) + 評価期間(test) の期間に分け、期間毎にバックテストするクラス
+
+    期間毎に、学習期間のデータで戦略を作り(strategy_factory)、評価期間をバックテストする。
+    バックテストには学習期間のデータも過去データとして渡すが、取引は評価期間の最初のdateから行う。
+    各期間は initial_cash から独立に始める。
+    データは一度だけ読み込み、各期間はそのデータのスライスを使う。n_jobs > 1 の場合は期間毎にプロセスプールで並列実行する
+    """
+    def __init__(self,
+                 strategy_factory: Callable[[pd.DataFrame], Strategy],
+                 train_period,
+                 test_period,
+                 initial_cash: int,
+                 date_step_interval: str,
+                 step=None,
+                 anchored: bool = False,
+                 data_files: list = None,
+                 df: pd.DataFrame = None,
+                 max_lookback=None,
+                 feature_processor_factory: Callable[[], FeatureProcessor] = None,
+                 precompute_features: bool = False,
+                 verify_samples: int = 5,
+                 n_jobs: int = 1,
+                 log_level=WARNING,
+                 **data_fetcher_params):
+        """
+        :param strategy_factory: 学習期間のデータ(dateでソート済み)を受け取り、Strategyを返す関数
+        :param train_period: timedelta or str(date_step_intervalと同じ書式)。学習期間の長さ
+        :param test_period: timedelta or str。評価期間の長さ
+        :param initial_cash:
+        :param date_step_interval: BackTesterと同じ
+        :param step: timedelta or str。期間をずらす幅。defaultはtest_period
+        :param anchored: Trueなら、学習期間の開始をデータの先頭に固定する(学習期間が伸びていく)
+        :param data_files: DataFetcherと同じ
+        :param df: DataFetcherと同じ
+        :param max_lookback: DataFetcherと同じ
+        :param feature_processor_factory: ParameterSweepと同じ
+        :param precompute_features: BackTesterと同じ
+        :param verify_samples: BackTesterと同じ
+        :param n_jobs: 並列数
+        :param log_level: 各期間のAccountのログレベル
+        :param data_fetcher_params: ParameterSweepと同じ。期間はdateでソートしたデータの行番号で切り出すため、fetch_mode は cursor のみ
+        """
+        fetch_mode = data_fetcher_params.get("fetch_mode", "cursor")
+        if fetch_mode != "cursor":
+            raise ValueError(f"WalkForward は fetch_mode=cursor のみ使用可能です。 入力: {fetch_mode}")
+        self.n_jobs = n_jobs
+        self.context = _make_context(data_files=data_files,
+                                     df=df,
+                                     data_fetcher_params=data_fetcher_params,
+                                     max_lookback=max_lookback,
+                                     initial_cash=initial_cash,
+                                     date_step_interval=date_step_interval,
+                                     strategy_factory=strategy_factory,
+                                     feature_processor_factory=feature_processor_factory,
+                                     precompute_features=precompute_features,
+                                     verify_samples=verify_samples,
+                                     log_level=log_level)
+        self.windows = self._make_windows(dates=self.context["df_data"]["date"],
+                                          train_period=self._to_timedelta(train_period),
+                                          test_period=self._to_timedelta(test_period),
+                                          step=self._to_timedelta(test_period if step is None else step),
+                                          anchored=anchored)
+
+    def _to_timedelta(self, x) -> timedelta:
+        if isinstance(x, str):
+            return convert_date_step_interval(x)
+        if not isinstance(x, timedelta) or x <= timedelta(0):
+            raise ValueError(f"期間は正の timedelta か str のみ使用可能です。 入力: {x}")
+        return x
+
+    def _make_windows(self,
+                      dates: pd.Series,
+                      train_period: timedelta,
+                      test_period: timedelta,
+                      step: timedelta,
+                      anchored: bool) -> list:
+        """
+        期間のリストを作る。評価期間にデータが無い期間は含めない
+        :param dates: dateでソート済み
+        :return: list of dict
+            train_start, test_start, test_end: 学習期間 [train_start, test_start), 評価期間 [test_start, test_end)
+            train_lo, test_lo, test_hi: それぞれの開始・終了の行番号
+        """
+        first_date = dates.iloc[0]
+        last_date = dates.iloc[-1]
+        windows = []
+        test_start = first_date + train_period
+        while test_start <= last_date:
+            train_start = first_date if anchored else test_start - train_period
+            test_end = test_start + test_period
+            train_lo, test_lo, test_hi = dates.searchsorted([train_start, test_start, test_end], side="left").tolist()
+            if test_hi > test_lo:
+                windows.append({"window": len(windows),
+                                "train_start": train_start,
+                                "test_start": test_start,
+                                "test_end": test_end,
+                                "train_lo": train_lo,
+                                "test_lo": test_lo,
+                                "test_hi": test_hi})
+            test_start += step
+        if len(windows) == 0:
+            raise ValueError(f"評価期間にデータがある期間がありません。 データの期間: {first_date} - {last_date}")
+        return windows
+
+    def run(self) -> WalkForwardResult:
+        """
+        全期間のバックテストを実行し、結果をまとめる
+        :return:
+        """
+        results = _map(context=self.context, func=_run_window, jobs=self.windows, n_jobs=self.n_jobs)
+
+        history_manager = HistoryManager(logger=None)
+        position_offset = 0
+        rows = []
+        for window, (summary, window_history_manager) in zip(self.windows, results):
+            # id_close はポジションのid。ポジションは新規の取引履歴(id_close=新規)1件につき1つ作られる
+            offset = history_manager.id_max
+            df_history = window_history_manager.to_frame()
+            history_manager.extend(df_history, id_close_offset=position_offset)
+            position_offset += int(df_history["id_close"].isna().sum())
+            rows.append({"window": window["window"],
+                         "train_start": window["train_start"],
+                         "test_start": window["test_start"],
+                         "test_end": window["test_end"],
+                         **summary,
+                         "history_id_start": offset})
+        return WalkForwardResult(summary=pd.DataFrame(rows),
+                                 history_manager=history_manager)
@@ -4,7 +4,14 @@ from backtestforstock.account import Account
 class Strategy:
     """
     取引アルゴリズム
+
+    Attributes
+    ----------
+    use_partitioned_data: bool, default: False
+        Trueなら、BackTesterは df_data として code -> pd.DataFrame の dict を渡す
+        (DataFetcher.fetch_partitioned を使うので、毎ステップ groupby("code") する必要がない)
     """
+    use_partitioned_data = False
 
     def __init__(self, **kwargs):
         pass
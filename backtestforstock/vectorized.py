@@ -0,0 +1,475 @@
+import dataclasses
+import numpy as np
+import pandas as pd
+from logging import Logger
+from typing import List
+from .position import Position
+from .history import HistoryManager
+from backtestforstock.callbacks.order import OrderCallback
+
+# 同じ日・同じcodeの中での処理順(Account.trade と同じ)
+_PHASE_BEGIN = 0   # callbacks(on_step_begin)
+_PHASE_OFFSET = 1  # 反対ポジションの相殺
+_PHASE_OPEN = 2    # 新規ポジション
+_PHASE_END = 3     # callbacks(on_step_end)
+
+# 新規ポジションのidが決まるまでの仮のid(同じcodeの既存ポジションより後に並ぶ)
+_NEW_LOT = np.iinfo(np.int64).max
+
+
+@dataclasses.dataclass
+class VectorizedResult:
+    """
+    cash: 最終的な現金
+    positions: 最終的なポジション(PositionManager.positions と同じ順序)
+    history_manager: 取引履歴(Account.history_manager と同じ内容)
+    cash_history: 各dateの処理後の現金
+    """
+    cash: float
+    positions: List[Position]
+    history_manager: HistoryManager
+    cash_history: pd.Series
+
+
+class VectorizedBackTester:
+    """
+    シグナル(date x code の注文量)から、取引をNumPyでまとめて計算するバックテスタ
+    dateのループだけをPythonで回し、同じdateの全code・全ポジションはまとめて計算する
+
+    Strategy/Account を使うイベントループ(BackTester)と同じ結果になる。
+    各dateで、注文のあるcodeを列の順(codeの昇順)に Account.trade したのと同じ扱い
+    - 注文の前に、そのcodeの指値/逆指値を始値で確認する(on_step_begin)
+    - short の注文は、そのcodeの全ポジションを古い順に相殺し、残りで short のポジションを建てる
+      long の注文は相殺しない
+    - 現金が足りない場合は新規ポジションを建てず、on_step_end の確認もしない
+    - 新規ポジションを建てたら、そのcodeの指値/逆指値を高値・安値で確認する(on_step_end)
+    指値/逆指値は、注文のあるdateのそのcodeでだけ確認される(Account.trade と同じ)
+
+    パラメータ探索などの絞り込みに使い、最終的な確認はイベントループで行うことを想定している
+    """
+    def __init__(self,
+                 df_data: pd.DataFrame,
+                 initial_cash: float,
+                 logger: Logger = None):
+        """
+        :param df_data: DataFetcherと同じ形式のデータ。同じ(date, code)の行は1行のみ
+        :param initial_cash:
+        :param logger:
+        """
+        self.initial_cash = initial_cash
+        self.logger = logger
+
+        df = df_data[["date", "code", "open", "high", "low"]]
+        if df.duplicated(subset=["date", "code"]).any():
+            raise ValueError("df_dataに同じ(date, code)の行が複数あります")
+        df = df.assign(code=df["code"].astype(str))
+        self.dates = pd.DatetimeIndex(np.sort(df["date"].unique()))
+        self.codes = pd.Index(np.sort(df["code"].unique()))
+
+        rows = self.dates.get_indexer(df["date"])
+        cols = self.codes.get_indexer(df["code"])
+        shape = (len(self.dates), len(self.codes))
+        self.has_bar = np.zeros(shape, dtype=bool)
+        self.has_bar[rows, cols] = True
+        self.open, self.high, self.low = [np.full(shape, np.nan) for _ in range(3)]
+        self.open[rows, cols] = df["open"].to_numpy(dtype=float)
+        self.high[rows, cols] = df["high"].to_numpy(dtype=float)
+        self.low[rows, cols] = df["low"].to_numpy(dtype=float)
+
+    def _to_wide(self,
+                 df: pd.DataFrame,
+                 name: str) -> np.ndarray:
+        """
+        index=date, columns=code のDataFrameを、(date, code) の配列にする。無い箇所はNaN
+        :param df:
+        :param name: エラーメッセージ用
+        :return:
+        """
+        if df is None:
+            return np.full(self.has_bar.shape, np.nan)
+        df = df.rename(columns=str)
+        if df.loc[~df.index.isin(self.dates)].notna().any().any() or \
+                df.loc[:, ~df.columns.isin(self.codes)].notna().any().any():
+            raise ValueError(f"{name}にdf_dataに無いdate/codeの値があります")
+        return df.reindex(index=self.dates, columns=self.codes).to_numpy(dtype=float)
+
+    def run(self,
+            orders: pd.DataFrame = None,
+            targets: pd.DataFrame = None,
+            limit_prices: pd.DataFrame = None,
+            stop_prices: pd.DataFrame = None,
+            prices: pd.DataFrame = None) -> VectorizedResult:
+        """
+        どれも index=date, columns=code のDataFrame。NaNの箇所は注文無し
+        :param orders: 注文量。正なら long, 負なら short で絶対値だけ取引する
+            0なら取引はせず、指値/逆指値の確認だけ行う
+        :param targets: ordersの代わりに、ポジション量の目標を指定する
+            注文量は 目標 - そのcodeの(指値/逆指値の確認前の)ポジション量の合計
+            (long/shortに関わらず Position.amount の合計。Strategyで get_positions の amount を合計するのと同じ)
+        :param limit_prices: 新規ポジションの指値。NaNなら指値無し
+        :param stop_prices: 新規ポジションの逆指値。NaNなら逆指値無し
+        :param prices: 約定値。defaultは始値
+        :return:
+        """
+        if (orders is None) == (targets is None):
+            raise ValueError("orders と targets のどちらか一方を指定してください")
+        is_target = orders is None
+        order_values = self._to_wide(targets if is_target else orders, name="targets" if is_target else "orders")
+        limit_values = self._to_wide(limit_prices, name="limit_prices")
+        stop_values = self._to_wide(stop_prices, name="stop_prices")
+        price_values = self.open if prices is None else self._to_wide(prices, name="prices")
+
+        has_order = ~np.isnan(order_values)
+        if (has_order & ~self.has_bar).any():
+            raise ValueError("df_dataに行が無い(date, code)に注文があります")
+        if np.isnan(price_values[has_order]).any():
+            raise ValueError("注文のある(date, code)の約定値がNaNです")
+
+        state = _State(cash=float(self.initial_cash))
+        cash_history = np.empty(len(self.dates))
+        for t in range(len(self.dates)):
+            codes = np.flatnonzero(has_order[t])
+            if len(codes) > 0:
+                self._step(state=state,
+                           t=t,
+                           codes=codes,
+                           order_values=order_values[t, codes],
+                           is_target=is_target,
+                           limit_values=limit_values[t, codes],
+                           stop_values=stop_values[t, codes],
+                           price_values=price_values[t, codes])
+            cash_history[t] = state.cash
+
+        if self.logger is not None:
+            self.logger.debug(f"vectorized backtest end. cash: {state.cash}, histories: {state.n_histories}")
+
+        return VectorizedResult(cash=state.cash,
+                                positions=self._build_positions(state),
+                                history_manager=self._build_history_manager(state),
+                                cash_history=pd.Series(cash_history, index=self.dates, name="cash"))
+
+    def _step(self,
+              state,
+              t: int,
+              codes: np.ndarray,
+              order_values: np.ndarray,
+              is_target: bool,
+              limit_values: np.ndarray,
+              stop_values: np.ndarray,
+              price_values: np.ndarray):
+        """
+        1つのdateの、注文のある全codeの取引をまとめて計算する
+        :param state:
+        :param t: dateの行番号
+        :param codes: 注文のあるcodeの列番号(昇順)
+        :param order_values: codes毎の注文量(またはポジション量の目標)
+        :return:
+        """
+        n_codes = len(codes)
+        rank = np.full(len(self.codes), -1)
+        rank[codes] = np.arange(n_codes)
+
+        # 注文のあるcodeのポジション(id順)
+        lots = np.flatnonzero(rank[state.lot_code] >= 0)
+        lot_rank = rank[state.lot_code[lots]]
+        lot_id = state.lot_id[lots]
+        lot_price = state.lot_price[lots]
+        lot_short = state.lot_short[lots]
+        lot_limit = state.lot_limit[lots]
+        lot_stop = state.lot_stop[lots]
+        amount = state.lot_amount[lots]
+
+        if is_target:
+            order_values = order_values - np.bincount(lot_rank, weights=amount, minlength=n_codes)
+        order_short = order_values < 0
+        order_amount = np.abs(order_values)
+        records = _Records()
+
+        # callbacks(on_step_begin): 始値が指値以上、逆指値以下なら始値で約定
+        open_price = self.open[t, codes][lot_rank]
+        amount = records.add_exits(phase=_PHASE_BEGIN,
+                                   lot_rank=lot_rank,
+                                   lot_id=lot_id,
+                                   lot_price=lot_price,
+                                   lot_short=lot_short,
+                                   amount=amount,
+                                   limit_hit=lot_limit <= open_price,
+                                   stop_hit=lot_stop >= open_price,
+                                   limit_fill=open_price,
+                                   stop_fill=open_price)
+
+        # 相殺: shortの注文は、そのcodeのポジションを古い順に注文量まで解消する
+        eligible = order_short[lot_rank] & (amount > 0)
+        offset = np.zeros(len(lots))
+        if eligible.any():
+            order = np.argsort(lot_rank, kind="stable")
+            cum = np.cumsum(np.where(eligible, amount, 0.)[order])
+            group_start = np.searchsorted(lot_rank[order], lot_rank[order])
+            cum_before = cum - np.where(eligible, amount, 0.)[order] - np.where(group_start > 0, cum[group_start - 1], 0.)
+            offset[order] = np.clip(order_amount[lot_rank[order]] - cum_before, 0, amount[order])
+            offset[~eligible] = 0
+            hit = offset > 0
+            records.add(phase=_PHASE_OFFSET,
+                        rank=lot_rank[hit],
+                        lot_key=lot_id[hit],
+                        sub=0,
+                        amount=offset[hit],
+                        price_open=lot_price[hit],
+                        price_close=price_values[lot_rank[hit]],
+                        short=~lot_short[hit],
+                        id_close=lot_id[hit])
+            amount = amount - offset
+            order_amount = order_amount - np.bincount(lot_rank, weights=offset, minlength=n_codes)
+
+        # 新規ポジション
+        opens = np.flatnonzero(order_amount > 0)
+        records.add(phase=_PHASE_OPEN,
+                    rank=opens,
+                    lot_key=_NEW_LOT,
+                    sub=0,
+                    amount=order_amount[opens],
+                    price_open=price_values[opens],
+                    price_close=np.nan,
+                    short=order_short[opens],
+                    id_close=-1)
+
+        # callbacks(on_step_end): 高値が指値以上、安値が逆指値以下なら指値/逆指値で約定
+        # 新規ポジションを含めて計算し、現金が足りずに建てられなかったcodeは後で取り除く
+        end_rank = np.concatenate([lot_rank, opens])
+        end_limit = np.concatenate([lot_limit, limit_values[opens]])
+        end_stop = np.concatenate([lot_stop, stop_values[opens]])
+        end_amount = records.add_exits(phase=_PHASE_END,
+                                       lot_rank=end_rank,
+                                       lot_id=np.concatenate([lot_id, np.full(len(opens), _NEW_LOT)]),
+                                       lot_price=np.concatenate([lot_price, price_values[opens]]),
+                                       lot_short=np.concatenate([lot_short, order_short[opens]]),
+                                       amount=np.concatenate([amount, order_amount[opens]]),
+                                       limit_hit=end_limit <= self.high[t, codes][end_rank],
+                                       stop_hit=end_stop >= self.low[t, codes][end_rank],
+                                       limit_fill=end_limit,
+                                       stop_fill=end_stop)
+
+        # 現金の確認: 記録をAccount.tradeと同じ順に並べ、新規ポジションの直前の現金で判定する
+        records.sort()
+        failed = records.apply_cash(state)
+
+        # ポジションの更新
+        succeeded = np.ones(n_codes, dtype=bool)
+        succeeded[failed] = False
+        new_lots = opens[succeeded[opens]]
+        new_ids = state.lot_id_max + np.arange(len(new_lots))
+        state.lot_id_max += len(new_lots)
+        new_id_by_rank = np.full(n_codes, -1)
+        new_id_by_rank[new_lots] = new_ids
+        records.fill_new_ids(new_id_by_rank)
+        state.add_histories(records, date=t, codes=codes)
+
+        # 建てられなかったcodeのポジションは on_step_end の前の量のまま
+        old_amount = np.where(succeeded[lot_rank], end_amount[:len(lots)], amount)
+        new_amount = end_amount[len(lots):][succeeded[opens]]
+        state.add_lots(id=new_ids,
+                       code=codes[new_lots],
+                       date=t,
+                       amount=new_amount,
+                       price=price_values[new_lots],
+                       short=order_short[new_lots],
+                       limit=limit_values[new_lots],
+                       stop=stop_values[new_lots])
+        state.update_lots(lots=lots, amount=old_amount)
+
+    def _build_positions(self, state) -> List[Position]:
+        positions = []
+        for i in range(len(state.lot_id)):
+            limit_price = None if np.isnan(state.lot_limit[i]) else state.lot_limit[i].item()
+            stop_price = None if np.isnan(state.lot_stop[i]) else state.lot_stop[i].item()
+            if limit_price is None and stop_price is None:
+                callbacks = []
+            else:
+                callbacks = [OrderCallback(logger=self.logger, limit_price=limit_price, stop_price=stop_price)]
+            position = Position(id=state.lot_id[i].item(),
+                                date=self.dates[state.lot_date[i]],
+                                code=self.codes[state.lot_code[i]],
+                                category="short" if state.lot_short[i] else "long",
+                                amount=state.lot_amount[i].item(),
+                                price=state.lot_price[i].item(),
+                                callbacks=callbacks)
+            for callback in callbacks:
+                callback.set_position(position)
+            positions.append(position)
+        return positions
+
+    def _build_history_manager(self, state) -> HistoryManager:
+        columns = state.history_columns()
+        history_manager = HistoryManager(logger=self.logger)
+        history_manager.extend(pd.DataFrame({"date": self.dates[columns["date"]],
+                                             "code": np.asarray(self.codes, dtype=object)[columns["code"]],
+                                             "category": np.where(columns["short"], "short", "long"),
+                                             "amount": columns["amount"],
+                                             "price_open": columns["price_open"],
+                                             "price_close": columns["price_close"],
+                                             "id_close": pd.arrays.IntegerArray(columns["id_close"],
+                                                                                columns["id_close"] < 0)}))
+        return history_manager
+
+
+class _Records:
+    """
+    1つのdateの約定記録(Account.history_manager に追加される1件が1行)
+    """
+    FIELDS = ["phase", "rank", "lot_key", "sub", "amount", "price_open", "price_close", "short", "id_close"]
+
+    def __init__(self):
+        self.parts = {field: [] for field in self.FIELDS}
+
+    def add(self, **kwargs):
+        n = len(kwargs["rank"])
+        for field in self.FIELDS:
+            self.parts[field].append(np.broadcast_to(kwargs[field], n))
+
+    def add_exits(self,
+                  phase: int,
+                  lot_rank: np.ndarray,
+                  lot_id: np.ndarray,
+                  lot_price: np.ndarray,
+                  lot_short: np.ndarray,
+                  amount: np.ndarray,
+                  limit_hit: np.ndarray,
+                  stop_hit: np.ndarray,
+                  limit_fill: np.ndarray,
+                  stop_fill: np.ndarray) -> np.ndarray:
+        """
+        指値/逆指値による決済を記録する(OrderCallback.close と同じ)
+        両方に当たった場合は半分ずつ、指値→逆指値の順に決済する
+        :return: 決済後のポジション量
+        """
+        alive = amount > 0
+        limit_hit = limit_hit & alive
+        stop_hit = stop_hit & alive
+        close_amount = np.where(limit_hit & stop_hit, amount / 2, amount)
+        for sub, hit, fill in [(0, limit_hit, limit_fill), (1, stop_hit, stop_fill)]:
+            self.add(phase=phase,
+                     rank=lot_rank[hit],
+                     lot_key=lot_id[hit],
+                     sub=sub,
+                     amount=close_amount[hit],
+                     price_open=lot_price[hit],
+                     price_close=fill[hit],
+                     short=~lot_short[hit],
+                     id_close=lot_id[hit])
+        return np.where(limit_hit | stop_hit, 0., amount)
+
+    def sort(self):
+        """
+        Account.trade で記録される順(code, 処理順, ポジションid, 指値→逆指値)に並べる
+        :return:
+        """
+        columns = {field: np.concatenate(parts) for field, parts in self.parts.items()}
+        order = np.lexsort((columns["sub"], columns["lot_key"], columns["phase"], columns["rank"]))
+        self.columns = {field: values[order] for field, values in columns.items()}
+        self.parts = None
+
+    def apply_cash(self, state) -> list:
+        """
+        記録順に現金を増減させる。新規ポジションの直前の現金が足りないcodeは、
+        そのcodeの新規ポジションと on_step_end の記録を取り除き、以降を計算し直す
+        :param state:
+        :return: 現金が足りなかったcodeのrank
+        """
+        columns = self.columns
+        is_open = columns["phase"] == _PHASE_OPEN
+        delta = np.where(is_open, -1, 1) * columns["amount"] * np.where(is_open, columns["price_open"], columns["price_close"])
+        keep = np.ones(len(delta), dtype=bool)
+        failed = []
+        start = 0
+        cash = state.cash
+        while True:
+            d = np.where(keep[start:], delta[start:], 0.)
+            # np.cumsum は先頭から順に足すので、Account で1件ずつ増減させた値と一致する
+            cash_running = np.cumsum(np.concatenate([[cash], d]))
+            cash_before = cash_running[:-1]
+            cash_after = cash_running[1:]
+            shortage = np.flatnonzero(keep[start:] & is_open[start:] & (cash_before < -delta[start:]))
+            if len(shortage) == 0:
+                break
+            i = start + shortage[0]
+            failed.append(columns["rank"][i])
+            keep[i:] &= ~((columns["rank"][i:] == columns["rank"][i]) & (columns["phase"][i:] >= _PHASE_OPEN))
+            # 足りなかった記録の直前の現金(1件ずつ増減させた値)からやり直す
+            cash = cash_before[shortage[0]]
+            start = i
+        if len(cash_after) > 0:
+            state.cash = float(cash_after[-1])
+
+        self.columns = {field: values[keep] for field, values in columns.items()}
+        return failed
+
+    def fill_new_ids(self,
+                     new_id_by_rank: np.ndarray):
+        """
+        新規ポジションの決済記録の id_close に、確定したポジションidを入れる
+        :param new_id_by_rank:
+        :return:
+        """
+        columns = self.columns
+        is_new = (columns["phase"] == _PHASE_END) & (columns["lot_key"] == _NEW_LOT)
+        id_close = columns["id_close"].copy()
+        id_close[is_new] = new_id_by_rank[columns["rank"][is_new]]
+        columns["id_close"] = id_close
+
+
+class _State:
+    """
+    VectorizedBackTester.run の途中状態。ポジションはid順の配列で持つ
+    """
+    LOT_FIELDS = {"lot_id": np.int64, "lot_code": np.int64, "lot_date": np.int64, "lot_amount": float,
+                  "lot_price": float, "lot_short": bool, "lot_limit": float, "lot_stop": float}
+    HISTORY_FIELDS = ["date", "code", "amount", "price_open", "price_close", "short", "id_close"]
+
+    def __init__(self, cash: float):
+        self.cash = cash
+        self.lot_id_max = 0
+        for field, dtype in self.LOT_FIELDS.items():
+            setattr(self, field, np.empty(0, dtype=dtype))
+        self.histories = {field: [] for field in self.HISTORY_FIELDS}
+        self.n_histories = 0
+
+    def update_lots(self,
+                    lots: np.ndarray,
+                    amount: np.ndarray):
+        """
+        ポジション量を更新し、0になったポジション(追加したばかりのものも含む)を取り除く
+        :param lots:
+        :param amount:
+        :return:
+        """
+        self.lot_amount[lots] = amount
+        keep = self.lot_amount > 0
+        if not keep.all():
+            for field in self.LOT_FIELDS:
+                setattr(self, field, getattr(self, field)[keep])
+
+    def add_lots(self, **kwargs):
+        n = len(kwargs["id"])
+        if n == 0:
+            return
+        for field in self.LOT_FIELDS:
+            values = np.broadcast_to(kwargs[field.replace("lot_", "")], n)
+            setattr(self, field, np.concatenate([getattr(self, field), values]))
+
+    def add_histories(self,
+                      records: _Records,
+                      date: int,
+                      codes: np.ndarray):
+        columns = records.columns
+        n = len(columns["rank"])
+        self.histories["date"].append(np.full(n, date))
+        self.histories["code"].append(codes[columns["rank"]])
+        for field in ["amount", "price_open", "price_close", "short", "id_close"]:
+            self.histories[field].append(columns[field])
+        self.n_histories += n
+
+    def history_columns(self) -> dict:
+        dtypes = {"date": np.int64, "code": np.int64, "amount": float, "price_open": float,
+                  "price_close": float, "short": bool, "id_close": np.int64}
+        return {field: np.concatenate(parts).astype(dtypes[field]) if len(parts) > 0 else np.empty(0, dtype=dtypes[field])
+                for field, parts in self.histories.items()}
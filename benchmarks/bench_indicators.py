@@ -0,0 +1,59 @@
+"""
+features/indicators のベンチマーク
+行数を増やしたときの transform / update の処理時間を出力する(1行あたりの時間がほぼ一定なら線形)
+
+python benchmarks/bench_indicators.py
+"""
+import time
+import numpy as np
+import pandas as pd
+from backtestforstock.features.indicators import SMAProcessor, EMAProcessor, RSIProcessor, ATRProcessor, \
+    BollingerProcessor, ZScoreProcessor, VWAPProcessor
+
+
+def make_data(n_rows: int,
+              n_codes: int = 100,
+              seed: int = 0) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    n_dates = n_rows // n_codes
+    close = 100 + np.cumsum(rng.normal(size=(n_codes, n_dates)), axis=1).ravel()
+    return pd.DataFrame({"open": close + rng.normal(size=len(close)) * 0.1,
+                         "close": close,
+                         "high": close + np.abs(rng.normal(size=len(close))),
+                         "low": close - np.abs(rng.normal(size=len(close))),
+                         "volume": rng.integers(1, 1000, size=len(close)),
+                         "date": np.tile(pd.date_range("2000-01-01", periods=n_dates, freq="min"), n_codes),
+                         "code": np.repeat([f"{x:04}" for x in range(n_codes)], n_dates)}).sort_values("date", kind="mergesort")
+
+
+def main():
+    processors = [SMAProcessor(validation="off"),
+                  EMAProcessor(validation="off"),
+                  RSIProcessor(validation="off"),
+                  ATRProcessor(validation="off"),
+                  BollingerProcessor(validation="off"),
+                  ZScoreProcessor(validation="off"),
+                  VWAPProcessor(validation="off")]
+
+    print(f"{'processor':<20}{'rows':>10}{'transform[s]':>14}{'us/row':>10}{'update[s]':>12}{'us/row':>10}")
+    for n_rows in [10_000, 100_000, 1_000_000]:
+        df = make_data(n_rows)
+        for processor in processors:
+            start = time.perf_counter()
+            processor.transform(df)
+            transform_time = time.perf_counter() - start
+
+            # update は1本あたりの処理なので、10万行までにする
+            df_update = df.iloc[:min(n_rows, 100_000)]
+            processor.reset()
+            start = time.perf_counter()
+            processor.update(df_update)
+            update_time = time.perf_counter() - start
+
+            print(f"{type(processor).__name__:<20}{n_rows:>10}"
+                  f"{transform_time:>14.4f}{transform_time / n_rows * 1e6:>10.3f}"
+                  f"{update_time:>12.4f}{update_time / len(df_update) * 1e6:>10.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+"""
+指値・逆指値の判定を Account.trade で行う場合と、OrderBook, FirstTouchResolver で行う場合の比較
+毎日全銘柄を少しずつ買い増し、遠い指値・逆指値を付けたポジションが溜まっていく
+
+python benchmarks/bench_orderbook.py
+"""
+import sys
+import time
+import pandas as pd
+from logging import WARNING
+from backtestforstock.account import Account
+from backtestforstock.backtester import BackTester
+from backtestforstock.common import get_logger
+from backtestforstock.datafetchers.core import DataFetcher
+from backtestforstock.orderbook import OrderBook, FirstTouchResolver
+sys.path.append("tests")
+from test_vectorized import ReplayStrategy, make_data
+
+
+def run(df: pd.DataFrame,
+        orders: pd.DataFrame,
+        limit_prices: pd.DataFrame,
+        stop_prices: pd.DataFrame,
+        order_book: str) -> Account:
+    logger = get_logger(level=WARNING)
+    data_fetcher = DataFetcher(df=df, start_datetime=df["date"].min())
+    if order_book == "order book":
+        order_book = OrderBook(logger=logger)
+    elif order_book == "first touch":
+        order_book = FirstTouchResolver(df_data=data_fetcher.df_data, logger=logger)
+    account = Account(initial_cash=1e12,
+                      logger=logger,
+                      order_book=order_book)
+    BackTester(data_fetcher=data_fetcher,
+               strategy=ReplayStrategy(orders=orders, limit_prices=limit_prices, stop_prices=stop_prices),
+               account=account,
+               date_step_interval="1d").run()
+    return account
+
+
+def main():
+    print(f"{'dates':>8}{'codes':>8}{'positions':>11}{'trade[s]':>10}{'order book[s]':>15}{'first touch[s]':>16}")
+    for n_dates, n_codes in [(100, 10), (250, 10), (250, 50)]:
+        df = make_data(n_dates=n_dates, n_codes=n_codes)
+        df_open = df.pivot(index="date", columns="code", values="open")
+        orders = pd.DataFrame(100., index=df_open.index, columns=df_open.columns)
+
+        times = []
+        for order_book in [None, "order book", "first touch"]:
+            start = time.perf_counter()
+            account = run(df, orders, df_open * 3, df_open / 3, order_book=order_book)
+            times.append(time.perf_counter() - start)
+        print(f"{n_dates:>8}{n_codes:>8}{len(account.position_manager.positions):>11}{times[0]:>10.3f}{times[1]:>15.3f}{times[2]:>16.3f}")
+
+
+if __name__ == "__main__":
+    main()
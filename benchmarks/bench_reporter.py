@@ -0,0 +1,70 @@
+"""
+SummaryReporter と、HistoryManager.histories をループで集計する場合の比較
+
+python benchmarks/bench_reporter.py
+"""
+import time
+import numpy as np
+import pandas as pd
+from datetime import datetime as dt
+from backtestforstock.history import HistoryManager
+from backtestforstock.reporter.core import SummaryReporter
+
+
+def make_history_manager(n: int,
+                         n_codes: int = 1000,
+                         seed: int = 0) -> HistoryManager:
+    """
+    新規と決済が交互に並ぶ取引履歴
+    """
+    rng = np.random.default_rng(seed)
+    n_open = (n + 1) // 2
+    n_close = n // 2
+    is_close = np.arange(n) % 2 == 1
+    id_close = pd.array(np.full(n, pd.NA), dtype="Int64")
+    id_close[is_close] = np.arange(n_close)
+    price_open = rng.uniform(90, 110, size=n_open)
+    price_close = np.full(n, np.nan)
+    price_close[is_close] = rng.uniform(90, 110, size=n_close)
+    history_manager = HistoryManager(logger=None)
+    history_manager.extend(pd.DataFrame({"date": dt(2020, 1, 1),
+                                         "code": np.char.zfill(rng.integers(n_codes, size=n).astype(str), 4),
+                                         "category": np.where(is_close, "short", "long"),
+                                         "amount": 100.,
+                                         "price_open": np.repeat(price_open, 2)[:n],
+                                         "price_close": price_close,
+                                         "id_close": id_close}))
+    return history_manager
+
+
+def summarize_loop(history_manager: HistoryManager):
+    pl_amount = 0
+    for history in history_manager.histories:
+        if history.id_close is not None:
+            pl_amount += (history.price_close - history.price_open) * history.amount
+    return pl_amount
+
+
+def main():
+    print(f"{'fills':>10}{'reporter[s]':>14}{'loop[s]':>10}")
+    for n in [10_000, 100_000, 1_000_000, 5_000_000]:
+        history_manager = make_history_manager(n)
+
+        start = time.perf_counter()
+        summary = SummaryReporter().summarize(history_manager)
+        SummaryReporter().breakdown(history_manager)
+        reporter_time = time.perf_counter() - start
+
+        # ループは大きいサイズでは時間がかかりすぎるので省略する
+        loop_time = np.nan
+        if n <= 1_000_000:
+            start = time.perf_counter()
+            pl_amount = summarize_loop(history_manager)
+            loop_time = time.perf_counter() - start
+            assert np.isclose(pl_amount, summary.earn_summary.pl_amount)
+
+        print(f"{n:>10}{reporter_time:>14.3f}{loop_time:>10.3f}")
+
+
+if __name__ == "__main__":
+    main()
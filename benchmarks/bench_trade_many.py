@@ -0,0 +1,51 @@
+"""
+Account.trade を銘柄ごとに呼ぶ場合と、Account.trade_many でまとめて取引する場合の比較
+毎ステップ全銘柄をランダムに売買する
+
+python benchmarks/bench_trade_many.py
+"""
+import time
+import numpy as np
+import pandas as pd
+from logging import WARNING
+from backtestforstock.account import Account
+from backtestforstock.common import get_logger
+
+
+def make_steps(n_steps: int,
+               n_codes: int,
+               seed: int = 0) -> list:
+    rng = np.random.default_rng(seed)
+    steps = []
+    for step in range(n_steps):
+        open_ = rng.uniform(90, 110, size=n_codes)
+        data = pd.DataFrame({"code": [f"{i:04}" for i in range(n_codes)],
+                             "date": pd.Timestamp("2020-01-01") + pd.Timedelta(days=step),
+                             "open": open_,
+                             "high": open_ + 10,
+                             "low": open_ - 10})
+        steps.append((data, rng.choice([100, 200, 300], size=n_codes),
+                      np.where(rng.random(n_codes) < 0.5, "long", "short")))
+    return steps
+
+
+def main():
+    print(f"{'steps':>8}{'codes':>8}{'trade[s]':>10}{'trade_many[s]':>15}")
+    for n_steps, n_codes in [(20, 100), (20, 500), (20, 2000)]:
+        steps = make_steps(n_steps, n_codes)
+        times = []
+        for many in [False, True]:
+            account = Account(initial_cash=1e12, logger=get_logger(level=WARNING))
+            start = time.perf_counter()
+            for data, amount, category in steps:
+                if many:
+                    account.trade_many(data=data, amount=amount, price=data["open"], category=category)
+                    continue
+                for i in range(len(data)):
+                    account.trade(data=data.iloc[i], amount=amount[i], price=data["open"].iloc[i], category=category[i])
+            times.append(time.perf_counter() - start)
+        print(f"{n_steps:>8}{n_codes:>8}{times[0]:>10.3f}{times[1]:>15.3f}")
+
+
+if __name__ == "__main__":
+    main()
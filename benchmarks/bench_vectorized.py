@@ -0,0 +1,56 @@
+"""
+VectorizedBackTester と、同じ注文を Account.trade で処理するイベントループ(BackTester)の比較
+
+python benchmarks/bench_vectorized.py
+"""
+import sys
+import time
+import numpy as np
+import pandas as pd
+from logging import WARNING
+from backtestforstock.account import Account
+from backtestforstock.backtester import BackTester
+from backtestforstock.common import get_logger
+from backtestforstock.datafetchers.core import DataFetcher
+from backtestforstock.vectorized import VectorizedBackTester
+sys.path.append("tests")
+from test_vectorized import ReplayStrategy, make_data
+
+
+def make_orders(df: pd.DataFrame,
+                seed: int = 0):
+    rng = np.random.default_rng(seed)
+    df_open = df.pivot(index="date", columns="code", values="open")
+    orders = pd.DataFrame(rng.choice([-200, -100, 100, 200], size=df_open.shape).astype(float),
+                          index=df_open.index, columns=df_open.columns)
+    orders = orders.mask(rng.random(size=df_open.shape) < 0.5)
+    return orders, df_open * 1.05, df_open * 0.95
+
+
+def main():
+    print(f"{'dates':>8}{'codes':>8}{'vectorized[s]':>16}{'event loop[s]':>16}")
+    for n_dates, n_codes in [(250, 10), (250, 100), (1000, 100), (1000, 1000)]:
+        df = make_data(n_dates=n_dates, n_codes=n_codes)
+        orders, limit_prices, stop_prices = make_orders(df)
+
+        start = time.perf_counter()
+        VectorizedBackTester(df_data=df, initial_cash=10_000_000).run(orders=orders,
+                                                                      limit_prices=limit_prices,
+                                                                      stop_prices=stop_prices)
+        vectorized_time = time.perf_counter() - start
+
+        # イベントループは大きいサイズでは時間がかかりすぎるので省略する
+        event_loop_time = np.nan
+        if n_dates * n_codes <= 25_000:
+            start = time.perf_counter()
+            BackTester(data_fetcher=DataFetcher(df=df, start_datetime=df["date"].min()),
+                       strategy=ReplayStrategy(orders=orders, limit_prices=limit_prices, stop_prices=stop_prices),
+                       account=Account(initial_cash=10_000_000, logger=get_logger(level=WARNING)),
+                       date_step_interval="1d").run()
+            event_loop_time = time.perf_counter() - start
+
+        print(f"{n_dates:>8}{n_codes:>8}{vectorized_time:>16.3f}{event_loop_time:>16.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""
+複数のテストで使う戦略・データ
+"""
+import pandas as pd
+import numpy as np
+from backtestforstock.strategies.core import Strategy
+from backtestforstock.account import Account
+from backtestforstock.callbacks.order import OrderCallback
+from datetime import datetime as dt
+
+
+class ReplayStrategy(Strategy):
+    """
+    index=date, columns=code の注文量を、そのまま Account.trade するクラス(テスト用)
+    """
+    def __init__(self,
+                 orders: pd.DataFrame,
+                 limit_prices: pd.DataFrame = None,
+                 stop_prices: pd.DataFrame = None,
+                 is_target: bool = False):
+        super().__init__()
+        self.orders = orders
+        self.limit_prices = limit_prices
+        self.stop_prices = stop_prices
+        self.is_target = is_target
+
+    def _trade_core(self,
+                    df_data: pd.DataFrame,
+                    account: Account):
+        for code, df in df_data.groupby("code"):
+            data = df.iloc[-1]
+            value = self.orders.at[data["date"], code]
+            if data["date"] != df_data["date"].max() or np.isnan(value):
+                continue
+            if self.is_target:
+                value -= sum(x.amount for x in account.position_manager.get_positions(code))
+            limit_price = None if self.limit_prices is None else self.limit_prices.at[data["date"], code]
+            stop_price = None if self.stop_prices is None else self.stop_prices.at[data["date"], code]
+            callbacks = []
+            if not pd.isna(limit_price) or not pd.isna(stop_price):
+                callbacks = [OrderCallback(limit_price=None if pd.isna(limit_price) else limit_price,
+                                           stop_price=None if pd.isna(stop_price) else stop_price)]
+            account.trade(data=data,
+                          amount=abs(value),
+                          price=data["open"],
+                          category="short" if value < 0 else "long",
+                          callbacks=callbacks)
+
+
+def make_data(n_dates: int = 60,
+              n_codes: int = 4,
+              seed: int = 0) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    dfs = []
+    for i in range(n_codes):
+        close = np.maximum(100 + np.cumsum(rng.integers(-10, 11, size=n_dates)), 10).astype(float)
+        open_ = np.maximum(close + rng.integers(-5, 6, size=n_dates), 5)
+        dfs.append(pd.DataFrame({"open": open_,
+                                 "close": close,
+                                 "high": np.maximum(open_, close) + rng.integers(0, 10, size=n_dates),
+                                 "low": np.minimum(open_, close) - rng.integers(0, 10, size=n_dates),
+                                 "date": pd.date_range(dt(2020, 1, 1), periods=n_dates, freq="D"),
+                                 "code": f"{i:04}"}))
+    return pd.concat(dfs).reset_index(drop=True)
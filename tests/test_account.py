@@ -1,9 +1,12 @@
 import unittest
+from unittest import mock
 from backtestforstock.strategies.core import Strategy
 from backtestforstock.history import HistoryManager, History
-from backtestforstock.position import PositionManager, Position
+from backtestforstock.position import PositionManager, ArrayPositionManager, Position
 from backtestforstock.account import Account
 from backtestforstock.common import get_logger
+from backtestforstock.callbacks.order import OrderCallback
+from backtestforstock.orderbook import OrderBook
 
 from datetime import timedelta
 from datetime import datetime as dt
@@ -472,4 +475,130 @@ class TestAccount(unittest.TestCase):
 
         self.assertEqual(expect_positions, account.position_manager.positions)
         self.assertEqual(expect_histories, account.history_manager.histories)
-        self.assertEqual(expect_cash, account.cash)
\ No newline at end of file
+        self.assertEqual(expect_cash, account.cash)
+
+    def test_track_amounts(self):
+        """
+        track_amounts の後、open_position / close_position の度に code毎のポジション量が更新されること
+        """
+        account = Account(initial_cash=1_000_000,
+                          logger=get_logger())
+        BuyAnytimeStrategy(code="0000", amount=100).trade(df_data=self.df_step1, account=account)
+        codes = pd.Index(["1000", "0000", "2000"])
+        account.track_amounts(codes)
+        self.assertEqual([0., 100., 0.], account.amounts.tolist())
+
+        for strategy, df_data in [(BuyAnytimeStrategy(code="1000", amount=50), self.df_multi),
+                                  (SellAnytimeStrategy(code="0000", amount=130), self.df_step2),
+                                  (BuyAnytimeStrategy(code="0000", amount=20), self.df_step2)]:
+            strategy.trade(df_data=df_data, account=account)
+            expect = account.position_manager.amount_by_code().reindex(codes, fill_value=0.)
+            self.assertEqual(expect.tolist(), account.amounts.tolist())
+
+    def test_float32_price(self):
+        """
+        価格が float32(型付きで読み込んだデータ)でも、cash が float32 に丸められないこと
+        """
+        account = Account(initial_cash=12_345_678.5,
+                          logger=get_logger())
+        data = pd.Series({"code": "0000", "date": self.base_dt,
+                          "open": np.float32(100), "high": np.float32(120), "low": np.float32(80)})
+        account.trade(data=data, amount=1, price=data["open"], category="long")
+        self.assertIs(float, type(account.cash))
+        self.assertEqual(12_345_578.5, account.cash)
+        account.trade(data=data, amount=1, price=data["high"], category="short")
+        self.assertIs(float, type(account.cash))
+        self.assertEqual(12_345_698.5, account.cash)
+        account.trade_many(data=pd.DataFrame([data]), amount=1, price=np.array([np.float32(80)]), category="long")
+        self.assertEqual(12_345_618.5, account.cash)
+
+
+class TestAccountArrayPositionManager(TestAccount):
+    """
+    TestAccount を ArrayPositionManager で実行する
+    """
+    def setUp(self):
+        patcher = mock.patch("backtestforstock.account.PositionManager", ArrayPositionManager)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+
+class TestAccountTradeMany(unittest.TestCase):
+    """
+    trade_many が、trade を行の順に呼んだ場合と同じ結果になること
+    """
+    def _make_orders(self, seed, n_steps=20, n_codes=5):
+        rng = np.random.default_rng(seed)
+        steps = []
+        for step in range(n_steps):
+            open_ = rng.integers(80, 120, size=n_codes).astype(float)
+            data = pd.DataFrame({"code": [f"{i:04}" for i in rng.permutation(n_codes)],
+                                 "date": dt(year=2020, month=1, day=1) + timedelta(days=step),
+                                 "open": open_,
+                                 "high": open_ + rng.integers(1, 20, size=n_codes),
+                                 "low": open_ - rng.integers(1, 20, size=n_codes)})
+            amount = rng.choice([0, 100, 200, 300], size=n_codes)
+            category = np.where(rng.random(n_codes) < 0.5, "long", "Short")
+            callbacks = [[OrderCallback(limit_price=x * 1.1, stop_price=x * 0.9)] if rng.random() < 0.3 else []
+                         for x in open_]
+            steps.append((data, amount, category, callbacks))
+        return steps
+
+    def _run(self, steps, initial_cash, many, position_manager=None, order_book=None):
+        logger = get_logger()
+        account = Account(initial_cash=initial_cash,
+                          logger=logger,
+                          position_manager=None if position_manager is None else position_manager(logger=logger),
+                          order_book=order_book)
+        for data, amount, category, callbacks in steps:
+            callbacks = [[OrderCallback(limit_price=x.limit_price, stop_price=x.stop_price) for x in cbs]
+                         for cbs in callbacks]
+            if many:
+                account.trade_many(data=data, amount=amount, price=data["open"], category=category, callbacks=callbacks)
+                continue
+            for i in range(len(data)):
+                account.trade(data=data.iloc[i], amount=amount[i], price=data["open"].iloc[i],
+                              category=category[i], callbacks=callbacks[i])
+        return account
+
+    def _assert_same(self, expect, actual):
+        def position_key(x):
+            return (x.id, x.date, x.code, x.category, x.amount, x.price,
+                    [(c.limit_price, c.stop_price) for c in x.callbacks])
+        self.assertEqual(expect.cash, actual.cash)
+        self.assertEqual([position_key(x) for x in expect.position_manager.positions],
+                         [position_key(x) for x in actual.position_manager.positions])
+        self.assertEqual(expect.history_manager.histories, actual.history_manager.histories)
+
+    def test_same_as_trade(self):
+        for seed, initial_cash in [(0, 100_000_000), (1, 100_000)]:
+            for position_manager in [None, ArrayPositionManager]:
+                with self.subTest(seed=seed, initial_cash=initial_cash, position_manager=position_manager):
+                    steps = self._make_orders(seed)
+                    expect = self._run(steps, initial_cash, many=False, position_manager=position_manager)
+                    actual = self._run(steps, initial_cash, many=True, position_manager=position_manager)
+                    self.assertGreater(len(expect.history_manager), 0)
+                    self._assert_same(expect, actual)
+
+    def test_same_as_trade_order_book(self):
+        steps = self._make_orders(2)
+        expect = self._run(steps, 1_000_000, many=False, order_book=OrderBook())
+        actual = self._run(steps, 1_000_000, many=True, order_book=OrderBook())
+        self._assert_same(expect, actual)
+
+    def test_scalar(self):
+        data = pd.DataFrame({"code": ["0000", "1000", "0000"],
+                             "date": dt(year=2020, month=1, day=1),
+                             "open": 100., "high": 110., "low": 90.})
+        account = Account(initial_cash=1_000_000, logger=get_logger())
+        account.trade_many(data=data, amount=100, price=100, category="long")
+        self.assertEqual(1_000_000 - 300 * 100, account.cash)
+        self.assertEqual([100, 100, 100], [x.amount for x in account.position_manager.positions])
+
+    def test_error(self):
+        data = pd.DataFrame({"code": ["0000", "1000"],
+                             "date": dt(year=2020, month=1, day=1),
+                             "open": 100., "high": 110., "low": 90.})
+        account = Account(initial_cash=1_000_000, logger=get_logger())
+        with self.assertRaises(ValueError):
+            account.trade_many(data=data, amount=100, price=100, category=["long"])
@@ -7,9 +7,12 @@ from backtestforstock.strategies.core import Strategy
 from backtestforstock.account import Account
 from backtestforstock.datafetchers.core import DataFetcher
 from backtestforstock.features.empty import NothingProcessor
+from backtestforstock.features.core import FeatureProcessor
+from backtestforstock.features.indicators import CompositeProcessor, SMAProcessor, RSIProcessor
 from backtestforstock.backtester import BackTester
 from backtestforstock.common import get_logger
 from backtestforstock.callbacks.order import OrderCallback
+from backtestforstock.position import ArrayPositionManager
 from datetime import timedelta
 from datetime import datetime as dt
 
@@ -66,6 +69,77 @@ class BuyAndSellStrategy(Strategy):
                               price=df.iloc[-1]["open"],
                               category="short")
 
+class PartitionedBuyAndSellStrategy(Strategy):
+    """
+    test_normal_partitioned 用のクラス
+    BuyAndSellStrategy と同じ取引を、code毎に分割済みのデータで行う
+    """
+    use_partitioned_data = True
+
+    def _trade_core(self,
+                    df_data: dict,
+                    account: Account):
+
+        for code, df in df_data.items():
+            positions = account.position_manager.get_positions(code)
+            total_amount = 0
+            for position in positions:
+                total_amount += position.amount
+
+            if total_amount < 200:
+                account.trade(data=df.iloc[-1],
+                              amount=100,
+                              price=df.iloc[-1]["open"],
+                              category="long")
+            else:
+                account.trade(data=df.iloc[-1],
+                              amount=200,
+                              price=df.iloc[-1]["open"],
+                              category="short")
+
+class RecordStrategy(Strategy):
+    """
+    毎ステップ受け取ったデータを記録するだけのクラス
+    """
+    def __init__(self, use_partitioned_data=False):
+        super().__init__()
+        self.use_partitioned_data = use_partitioned_data
+        self.records = []
+
+    def _trade_core(self,
+                    df_data,
+                    account: Account):
+        self.records.append(df_data)
+
+
+class RollingMeanProcessor(FeatureProcessor):
+    """
+    code毎の直近2本のcloseの平均(テスト用)
+    """
+    def __init__(self, incremental=True):
+        super().__init__()
+        self.incremental = incremental
+        self.reset()
+
+    @property
+    def supports_incremental(self):
+        return self.incremental
+
+    def reset(self):
+        self.last_close = {}
+
+    def _transform_core(self, df):
+        df["close_mean2"] = df.groupby("code")["close"].transform(lambda x: x.rolling(2, min_periods=1).mean())
+        return df
+
+    def _update_core(self, df):
+        values = []
+        for code, close in zip(df["code"], df["close"]):
+            values.append((self.last_close.get(code, close) + close) / 2)
+            self.last_close[code] = close
+        df["close_mean2"] = values
+        return df
+
 class LimitTwiceStrategy(Strategy):
     """
     test_hit_limit_order 用のクラス
@@ -195,6 +269,201 @@ class TestBackTester(unittest.TestCase):
 
         self.assertEqual(expect_cash, backtester.account.cash)
 
+    def test_normal_max_lookback(self):
+        """
+        test_normalと同じ取引で、max_lookbackを指定しても結果が変わらないこと
+        """
+        for max_lookback in [1, "1d", timedelta(days=2)]:
+            data_fetcher = DataFetcher(df=pd.concat([self.df_0000, self.df_1000]),
+                                       start_datetime=dt(year=2020, month=1, day=1))
+            strategy = BuyAndSellStrategy()
+            account = Account(initial_cash=1_000_000,
+                              logger=get_logger())
+
+            backtester = BackTester(data_fetcher=data_fetcher,
+                                    strategy=strategy,
+                                    account=account,
+                                    date_step_interval="1d",
+                                    max_lookback=max_lookback)
+            backtester.run()
+
+            expect_cash = 1_000_000
+            expect_cash -= 100*100 + 200*100   # 1日目
+            expect_cash -= 200*100 + 400*100   # 2日目
+            expect_cash += 300*200 + 600*200   # 3日目
+            expect_cash -= 400*100 + 800*100   # 4日目
+            expect_cash -= 500*100 + 1000*100  # 5日目
+
+            self.assertEqual(expect_cash, backtester.account.cash)
+
+    def test_normal_partitioned(self):
+        """
+        code毎に分割済みのデータを受け取る戦略で、test_normalと同じ結果になること
+        """
+        data_fetcher = DataFetcher(df=pd.concat([self.df_0000, self.df_1000]),
+                                   start_datetime=dt(year=2020, month=1, day=1))
+        strategy = PartitionedBuyAndSellStrategy()
+        account = Account(initial_cash=1_000_000,
+                          logger=get_logger())
+
+        backtester = BackTester(data_fetcher=data_fetcher,
+                                strategy=strategy,
+                                account=account,
+                                date_step_interval="1d")
+        backtester.run()
+
+        expect_cash = 1_000_000
+        expect_cash -= 100*100 + 200*100   # 1日目
+        expect_cash -= 200*100 + 400*100   # 2日目
+        expect_cash += 300*200 + 600*200   # 3日目
+        expect_cash -= 400*100 + 800*100   # 4日目
+        expect_cash -= 500*100 + 1000*100  # 5日目
+
+        self.assertEqual(expect_cash, backtester.account.cash)
+
+    def test_incremental_features(self):
+        """
+        インクリメンタル処理した特徴量が、毎ステップ全履歴をtransformしたものと一致すること
+        """
+        df = pd.concat([self.df_0000, self.df_1000.iloc[1:]]).assign(volume=100)
+        for use_partitioned_data in [False, True]:
+            records = []
+            for incremental in [True, False]:
+                strategy = RecordStrategy(use_partitioned_data=use_partitioned_data)
+                backtester = BackTester(data_fetcher=DataFetcher(df=df,
+                                                                 start_datetime=dt(year=2020, month=1, day=1)),
+                                        strategy=strategy,
+                                        account=Account(initial_cash=1_000_000, logger=get_logger()),
+                                        date_step_interval="1d",
+                                        feature_processor=RollingMeanProcessor(incremental=incremental))
+                self.assertEqual("incremental" if incremental else "transform", backtester.feature_mode)
+                backtester.run()
+                records.append(strategy.records)
+
+            self.assertEqual(5, len(records[0]))
+            for actual, expect in zip(*records):
+                if use_partitioned_data:
+                    self.assertEqual(list(expect.keys()), list(actual.keys()))
+                    for code in expect:
+                        pd.testing.assert_frame_equal(expect[code], actual[code])
+                else:
+                    pd.testing.assert_frame_equal(expect, actual)
+
+    def test_incremental_features_reuse(self):
+        """
+        同じ feature_processor を2つのBackTesterで使っても、前の実行の状態を持ち越さないこと
+        """
+        df = pd.concat([self.df_0000, self.df_1000.iloc[1:]]).assign(volume=100)
+        feature_processor = RollingMeanProcessor(incremental=True)
+        records = []
+        for _ in range(2):
+            strategy = RecordStrategy()
+            BackTester(data_fetcher=DataFetcher(df=df, start_datetime=dt(year=2020, month=1, day=1)),
+                       strategy=strategy,
+                       account=Account(initial_cash=1_000_000, logger=get_logger()),
+                       date_step_interval="1d",
+                       feature_processor=feature_processor).run()
+            records.append(strategy.records)
+
+        self.assertEqual(5, len(records[1]))
+        for actual, expect in zip(*records):
+            pd.testing.assert_frame_equal(expect, actual)
+
+    def test_composite_features(self):
+        """
+        CompositeProcessor(SMA + RSI)をインクリメンタル処理・precomputeした特徴量が、
+        毎ステップ全履歴をtransformしたものと一致すること
+        """
+        df = pd.concat([self.df_0000, self.df_1000.iloc[1:]]).assign(volume=100)
+        records = {}
+        for feature_mode in ["transform", "incremental", "precompute"]:
+            strategy = RecordStrategy()
+            fetch_mode = "mask" if feature_mode == "transform" else "cursor"
+            backtester = BackTester(data_fetcher=DataFetcher(df=df,
+                                                             start_datetime=dt(year=2020, month=1, day=1),
+                                                             fetch_mode=fetch_mode),
+                                    strategy=strategy,
+                                    account=Account(initial_cash=1_000_000, logger=get_logger()),
+                                    date_step_interval="1d",
+                                    feature_processor=CompositeProcessor([SMAProcessor(period=2),
+                                                                          RSIProcessor(period=2)]),
+                                    precompute_features=feature_mode == "precompute")
+            self.assertEqual(feature_mode, backtester.feature_mode)
+            backtester.run()
+            records[feature_mode] = strategy.records
+
+        self.assertEqual(5, len(records["transform"]))
+        self.assertTrue(records["transform"][-1]["rsi_2"].notna().any())
+        for feature_mode in ["incremental", "precompute"]:
+            for actual, expect in zip(records[feature_mode], records["transform"]):
+                pd.testing.assert_frame_equal(expect, actual)
+
+    def test_precompute_features(self):
+        """
+        precomputeした特徴量が、毎ステップ全履歴をtransformしたものと一致すること
+        """
+        df = pd.concat([self.df_0000, self.df_1000.iloc[1:]]).assign(volume=100)
+        for use_partitioned_data in [False, True]:
+            records = []
+            for precompute_features in [True, False]:
+                strategy = RecordStrategy(use_partitioned_data=use_partitioned_data)
+                backtester = BackTester(data_fetcher=DataFetcher(df=df,
+                                                                 start_datetime=dt(year=2020, month=1, day=1)),
+                                        strategy=strategy,
+                                        account=Account(initial_cash=1_000_000, logger=get_logger()),
+                                        date_step_interval="1d",
+                                        feature_processor=RollingMeanProcessor(incremental=False),
+                                        precompute_features=precompute_features)
+                backtester.run()
+                records.append(strategy.records)
+
+            for actual, expect in zip(*records):
+                if use_partitioned_data:
+                    for code in expect:
+                        pd.testing.assert_frame_equal(expect[code], actual[code])
+                else:
+                    pd.testing.assert_frame_equal(expect, actual)
+
+    def test_precompute_features_checksum(self):
+        """
+        validation="checksum" でも、precompute が data_fetcher.df_data にカラムを追加しないこと
+        """
+        df = pd.concat([self.df_0000, self.df_1000.iloc[1:]]).assign(volume=100)
+        data_fetcher = DataFetcher(df=df, start_datetime=dt(year=2020, month=1, day=1))
+        df_expect = data_fetcher.df_data.copy()
+        feature_processor = RollingMeanProcessor(incremental=False)
+        feature_processor.validation = "checksum"
+        strategy = RecordStrategy()
+        backtester = BackTester(data_fetcher=data_fetcher,
+                                strategy=strategy,
+                                account=Account(initial_cash=1_000_000, logger=get_logger()),
+                                date_step_interval="1d",
+                                feature_processor=feature_processor,
+                                precompute_features=True)
+        self.assertEqual(["close_mean2"], list(backtester._features.keys()))
+        backtester.run()
+        pd.testing.assert_frame_equal(df_expect, data_fetcher.df_data)
+        self.assertIn("close_mean2", strategy.records[-1].columns)
+
+    def test_precompute_features_leak(self):
+        """
+        先読みしている特徴量はprecomputeできないこと
+        """
+        class LeakProcessor(FeatureProcessor):
+            def _transform_core(self, df):
+                df["close_next"] = df.groupby("code")["close"].shift(-1)
+                return df
+
+        df = pd.concat([self.df_0000, self.df_1000]).assign(volume=100)
+        with self.assertRaises(ValueError):
+            BackTester(data_fetcher=DataFetcher(df=df,
+                                                start_datetime=dt(year=2020, month=1, day=1)),
+                       strategy=RecordStrategy(),
+                       account=Account(initial_cash=1_000_000, logger=get_logger()),
+                       date_step_interval="1d",
+                       feature_processor=LeakProcessor(),
+                       precompute_features=True)
+
     def test_hit_limit_order(self):
         """
         全銘柄、指値を購入株価の倍にする
@@ -355,5 +624,71 @@ class TestBackTester(unittest.TestCase):
 
         self.assertEqual(expect_cash, backtester.account.cash)
 
+    def test_early_stop(self):
+        """
+        early_stop が True を返したステップで終了すること
+        """
+        data_fetcher = DataFetcher(df=pd.concat([self.df_0000, self.df_1000]),
+                                   start_datetime=dt(year=2020, month=1, day=1))
+        account = Account(initial_cash=1_000_000,
+                          logger=get_logger())
+        backtester = BackTester(data_fetcher=data_fetcher,
+                                strategy=BuyAndSellStrategy(),
+                                account=account,
+                                date_step_interval="1d",
+                                early_stop=lambda account: len(account.history_manager) >= 4)
+        backtester.run()
+
+        # 2日目までで4件(2銘柄 * 2日)
+        self.assertTrue(backtester.stopped_early)
+        self.assertEqual(4, len(account.history_manager))
+        self.assertEqual(1_000_000 - (100*100 + 200*100) - (200*100 + 400*100), account.cash)
+    def test_record_equity(self):
+        """
+        毎ステップの資産が、現金 + 保有ポジションのその日の終値での評価額と一致すること
+        """
+        df = pd.concat([self.df_0000, self.df_1000])
+        df_close = df.pivot(index="date", columns="code", values="close")
+        for strategy, array_position_manager in [(BuyAndSellStrategy(), False),
+                                                 (PartitionedBuyAndSellStrategy(), False),
+                                                 (BuyAndSellStrategy(), True)]:
+            with self.subTest(strategy=type(strategy).__name__, array_position_manager=array_position_manager):
+                logger = get_logger()
+                account = Account(initial_cash=1_000_000,
+                                  logger=logger,
+                                  position_manager=ArrayPositionManager(logger=logger) if array_position_manager else None)
+                backtester = BackTester(data_fetcher=DataFetcher(df=df, start_datetime=dt(year=2020, month=1, day=1)),
+                                        strategy=strategy,
+                                        account=account,
+                                        date_step_interval="1d",
+                                        record_equity=True)
+                expect = []
+                while not backtester.data_fetcher.end_of_data:
+                    backtester.step()
+                    date = backtester.data_fetcher.datetime
+                    position_value = sum(x.amount * df_close.at[date, x.code]
+                                         for x in account.position_manager.positions)
+                    expect.append((date, account.cash, position_value))
+
+                df_equity = backtester.equity_curve
+                self.assertEqual(expect, list(zip(df_equity.index, df_equity["cash"], df_equity["position_value"])))
+                self.assertEqual(account.position_manager.amount_by_code().reindex(backtester._equity_codes,
+                                                                                   fill_value=0.).tolist(),
+                                 account.amounts.tolist())
+                self.assertEqual((df_equity["cash"] + df_equity["position_value"]).tolist(), df_equity["equity"].tolist())
+                self.assertEqual((df_equity["equity"].cummax() - df_equity["equity"]).tolist(),
+                                 df_equity["drawdown"].tolist())
+
+    def test_record_equity_error(self):
+        data_fetcher = DataFetcher(df=self.df_0000,
+                                   start_datetime=dt(year=2020, month=1, day=1),
+                                   fetch_mode="mask")
+        with self.assertRaises(ValueError):
+            BackTester(data_fetcher=data_fetcher,
+                       strategy=BuyAndSellStrategy(),
+                       account=Account(initial_cash=1_000_000, logger=get_logger()),
+                       date_step_interval="1d",
+                       record_equity=True)
+
 if __name__ == "__main__":
     unittest.main()
\ No newline at end of file
@@ -1,8 +1,20 @@
 import unittest
+import os
+import tempfile
+from unittest import mock
+import numpy as np
 import pandas as pd
 from datetime import datetime as dt
 from datetime import timedelta
 from backtestforstock.datafetchers.core import DataFetcher
+from backtestforstock.datafetchers import loaders
+from backtestforstock.datafetchers.loaders import load_data_file, load_data_files, merge_frames
+from backtestforstock.datafetchers.streaming import StreamingDataFetcher
+
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
 
 class TestDataFetchers(unittest.TestCase):
     def test_fetch(self):
@@ -22,5 +34,423 @@ class TestDataFetchers(unittest.TestCase):
 
         pd.testing.assert_frame_equal(df_expect, df_actual)
 
+    def test_fetch_cursor_unsorted(self):
+        """
+        dateでソートされていないデータでも、maskと同じ行を同じ順序で返すこと
+        """
+        base_dt = dt(year=2020, month=1, day=1)
+        df = pd.DataFrame({"open": [0, 1, 2, 3, 4, 5],
+                           "close": [1, 2, 3, 4, 5, 6],
+                           "high": [2, 3, 4, 5, 6, 7],
+                           "low": [0, 1, 2, 3, 4, 5],
+                           "date": [base_dt+timedelta(days=x) for x in range(3)]*2,
+                           "code": ["0000"]*3 + ["1000"]*3})
+
+        for max_lookback in [None, 2, timedelta(days=2)]:
+            with self.subTest(max_lookback=max_lookback):
+                datafetcher_cursor = DataFetcher(df=df,
+                                                 start_datetime=base_dt,
+                                                 max_lookback=max_lookback)
+                datafetcher_mask = DataFetcher(df=df,
+                                               start_datetime=base_dt,
+                                               fetch_mode="mask",
+                                               max_lookback=max_lookback)
+
+                while not datafetcher_cursor.end_of_data:
+                    df_cursor = datafetcher_cursor.fetch(step=timedelta(days=1))
+                    df_mask = datafetcher_mask.fetch(step=timedelta(days=1))
+
+                    pd.testing.assert_frame_equal(df_mask, df_cursor)
+                    pd.testing.assert_frame_equal(datafetcher_cursor.df_data.iloc[datafetcher_cursor.last_positions],
+                                                  df_cursor)
+                    self.assertEqual(datafetcher_mask.end_of_data, datafetcher_cursor.end_of_data)
+
+    def test_fetch_max_lookback(self):
+        """
+        max_lookback(本数/期間)を指定した場合、cursor/maskとも直近の範囲だけ返すこと
+        """
+        base_dt = dt(year=2020, month=1, day=1)
+        df = pd.DataFrame({"open": [0, 1, 2, 3, 4, 5, 6],
+                           "close": [1, 2, 3, 4, 5, 6, 7],
+                           "high": [2, 3, 4, 5, 6, 7, 8],
+                           "low": [0, 1, 2, 3, 4, 5, 6],
+                           "date": [base_dt+timedelta(days=x) for x in range(4)] + [base_dt+timedelta(days=x) for x in [0, 2, 3]],
+                           "code": ["0000"]*4 + ["1000"]*3})
+
+        for fetch_mode in ["cursor", "mask"]:
+            datafetcher = DataFetcher(df=df,
+                                      start_datetime=base_dt,
+                                      fetch_mode=fetch_mode,
+                                      max_lookback=2)
+            datafetcher.fetch(step=timedelta(days=1))
+            df_actual = datafetcher.fetch(step=timedelta(days=1))
+            self.assertEqual([1, 2, 4, 5], sorted(df_actual["open"].tolist()))
+
+            datafetcher = DataFetcher(df=df,
+                                      start_datetime=base_dt,
+                                      fetch_mode=fetch_mode,
+                                      max_lookback=timedelta(days=2))
+            datafetcher.fetch(step=timedelta(days=1))
+            df_actual = datafetcher.fetch(step=timedelta(days=1))
+            self.assertEqual([1, 2, 5], sorted(df_actual["open"].tolist()))
+
+    def test_fetch_partitioned(self):
+        """
+        fetch_partitionedが、fetchの結果をcodeでgroupbyしたものと一致すること
+        """
+        base_dt = dt(year=2020, month=1, day=1)
+        df = pd.DataFrame({"open": [0, 1, 2, 3, 4, 5, 6],
+                           "close": [1, 2, 3, 4, 5, 6, 7],
+                           "high": [2, 3, 4, 5, 6, 7, 8],
+                           "low": [0, 1, 2, 3, 4, 5, 6],
+                           "date": [base_dt+timedelta(days=x) for x in [1, 2, 3]] + [base_dt+timedelta(days=x) for x in range(4)],
+                           "code": ["1000"]*3 + ["0000"]*4})
+
+        for fetch_mode in ["cursor", "mask"]:
+            for max_lookback in [None, 2, timedelta(days=2)]:
+                datafetcher = DataFetcher(df=df,
+                                          start_datetime=base_dt - timedelta(days=1),
+                                          fetch_mode=fetch_mode,
+                                          max_lookback=max_lookback)
+                datafetcher_partitioned = DataFetcher(df=df,
+                                                      start_datetime=base_dt - timedelta(days=1),
+                                                      fetch_mode=fetch_mode,
+                                                      max_lookback=max_lookback)
+                while not datafetcher.end_of_data:
+                    df_fetch = datafetcher.fetch(step=timedelta(days=1))
+                    partitions = datafetcher_partitioned.fetch_partitioned(step=timedelta(days=1))
+
+                    expect = {code: df_code for code, df_code in df_fetch.groupby("code")}
+                    self.assertEqual(list(expect.keys()), list(partitions.keys()))
+                    for code in expect:
+                        pd.testing.assert_frame_equal(expect[code], partitions[code])
+                    self.assertEqual(datafetcher.end_of_data, datafetcher_partitioned.end_of_data)
+
+    def test_max_lookback_error(self):
+        df = pd.DataFrame({"open": [0], "close": [1], "high": [2], "low": [0],
+                           "date": [dt(year=2020, month=1, day=1)], "code": ["test"]})
+        with self.assertRaises(ValueError):
+            DataFetcher(df=df, max_lookback=0)
+        with self.assertRaises(ValueError):
+            DataFetcher(df=df, max_lookback="2d")
+
+    def test_fetch_mode_error(self):
+        df = pd.DataFrame({"open": [0], "close": [1], "high": [2], "low": [0],
+                           "date": [dt(year=2020, month=1, day=1)], "code": ["test"]})
+        with self.assertRaises(ValueError):
+            DataFetcher(df=df, fetch_mode="scan")
+
+
+class TestStreamingDataFetcher(unittest.TestCase):
+    base_dt = dt(year=2020, month=1, day=1)
+    df_0000 = pd.DataFrame({"open": [0., 1., 2., 3., 4.],
+                            "close": [1., 2., 3., 4., 5.],
+                            "high": [2., 3., 4., 5., 6.],
+                            "low": [0., 1., 2., 3., 4.],
+                            "date": pd.date_range(base_dt, periods=5, freq="D"),
+                            "code": ["0000"]*5})
+    df_1000 = pd.DataFrame({"open": [10., 11., 12.],
+                            "close": [11., 12., 13.],
+                            "high": [12., 13., 14.],
+                            "low": [10., 11., 12.],
+                            "date": pd.date_range(base_dt + timedelta(days=1), periods=3, freq="2D"),
+                            "code": ["1000"]*3})
+
+    def assert_same_as_data_fetcher(self, data_files, max_lookback):
+        datafetcher = DataFetcher(df=pd.concat([self.df_0000, self.df_1000]),
+                                  start_datetime=self.base_dt - timedelta(days=2),
+                                  max_lookback=max_lookback)
+        streaming_datafetcher = StreamingDataFetcher(data_files=data_files,
+                                                     start_datetime=self.base_dt - timedelta(days=2),
+                                                     max_lookback=max_lookback,
+                                                     chunksize=2)
+        while not datafetcher.end_of_data:
+            df_expect = datafetcher.fetch(step=timedelta(days=1))
+            df_actual = streaming_datafetcher.fetch(step=timedelta(days=1))
+
+            pd.testing.assert_frame_equal(df_expect.sort_values(["date", "code"]).reset_index(drop=True),
+                                          df_actual.sort_values(["date", "code"]).reset_index(drop=True),
+                                          check_dtype=False)
+            self.assertEqual(datafetcher.end_of_data, streaming_datafetcher.end_of_data)
+
+    def test_fetch(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            data_files = [os.path.join(tmp_dir, "0000.npy"), os.path.join(tmp_dir, "1000.npy")]
+            for df, path in zip([self.df_0000, self.df_1000], data_files):
+                np.save(path, df.to_records(index=False, column_dtypes={"code": "U4"}))
+
+            for max_lookback in [2, timedelta(days=2)]:
+                self.assert_same_as_data_fetcher(data_files=data_files,
+                                                 max_lookback=max_lookback)
+
+            with self.assertRaises(ValueError):
+                StreamingDataFetcher(data_files=data_files, start_datetime=self.base_dt)
+
+    def test_fetch_csv(self):
+        """
+        1ファイルに全codeがdate順で入っている場合
+        """
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "data.csv")
+            df = pd.concat([self.df_0000, self.df_1000]).sort_values("date", kind="mergesort")
+            df.assign(code=df["code"].map(lambda x: f"c{x}")).to_csv(path, index=False)
+
+            streaming_datafetcher = StreamingDataFetcher(data_files=[path],
+                                                         start_datetime=self.base_dt,
+                                                         max_lookback=2,
+                                                         chunksize=3)
+            df_actual = streaming_datafetcher.fetch(step=timedelta(days=3))
+            self.assertEqual([2., 3., 10., 11.], sorted(df_actual["open"].tolist()))
+            self.assertEqual(2, len(streaming_datafetcher._pending[0]))  # 未到達の d4, d5 のみ保持
+            self.assertFalse(streaming_datafetcher.end_of_data)
+
+            df_actual = streaming_datafetcher.fetch(step=timedelta(days=3))
+            self.assertEqual([3., 4., 11., 12.], sorted(df_actual["open"].tolist()))
+            self.assertTrue(streaming_datafetcher.end_of_data)
+
+
+class TestLoaders(unittest.TestCase):
+    base_dt = dt(year=2020, month=1, day=1)
+    df = pd.DataFrame({"open": [0., 1., 2., 3., 4.],
+                       "close": [1., 2., 3., 4., 5.],
+                       "high": [2., 3., 4., 5., 6.],
+                       "low": [0., 1., 2., 3., 4.],
+                       "date": pd.date_range(base_dt, periods=5, freq="D"),
+                       "code": ["0000"]*5})
+
+    def assert_loaded(self, path):
+        df_actual = load_data_file(path)
+        pd.testing.assert_frame_equal(self.df, df_actual[self.df.columns.tolist()],
+                                      check_dtype=False, check_index_type=False)
+
+        datafetcher = DataFetcher(data_files=[path],
+                                  start_datetime=self.base_dt)
+        self.assertEqual(2, len(datafetcher.fetch(step=timedelta(days=1))))
+
+    @unittest.skipIf(pyarrow is None, "pyarrow is not installed")
+    def test_parquet(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "data.parquet")
+            self.df.to_parquet(path)
+            self.assert_loaded(path)
+
+    @unittest.skipIf(pyarrow is None, "pyarrow is not installed")
+    def test_feather(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "data.feather")
+            self.df.to_feather(path, compression="uncompressed")
+            self.assert_loaded(path)
+
+            # 数値カラムはメモリマップを参照していること(コピーされていない)
+            self.assertFalse(load_data_file(path)["open"].values.flags.writeable)
+
+    @unittest.skipIf(pyarrow is None, "pyarrow is not installed")
+    def test_arrow_stream(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "data.arrows")
+            table = pyarrow.Table.from_pandas(self.df)
+            with pyarrow.ipc.new_stream(path, table.schema) as writer:
+                writer.write_table(table)
+            self.assert_loaded(path)
+
+    def test_npy_columns(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            for col in self.df.columns:
+                values = self.df[col].to_numpy()
+                if values.dtype == object:
+                    values = values.astype(str)
+                np.save(os.path.join(tmp_dir, f"{col}.npy"), values)
+            self.assert_loaded(tmp_dir)
+
+            self.assertIsInstance(load_data_file(tmp_dir)["open"].values.base, np.memmap)
+
+    def test_csv_typed(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "data.csv")
+            self.df.to_csv(path, index=False)
+
+            df_actual = load_data_file(path, typed=True)
+            self.assertTrue(pd.api.types.is_datetime64_any_dtype(df_actual["date"]))
+            self.assertIsInstance(df_actual["code"].dtype, pd.CategoricalDtype)
+            self.assertEqual(["0000"], df_actual["code"].cat.categories.tolist())
+            self.assertEqual(np.float32, df_actual["open"].dtype)
+
+            datafetcher = DataFetcher(data_files=[path, path],
+                                      start_datetime=self.base_dt,
+                                      typed=True)
+            self.assertIsInstance(datafetcher.df_data["code"].dtype, pd.CategoricalDtype)
+            self.assertEqual(4, len(datafetcher.fetch(step=timedelta(days=1))))
+
+    def test_csv_cache(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "data.csv")
+            cache_dir = os.path.join(tmp_dir, "cache")
+            self.df.to_csv(path, index=False)
+
+            df_expect = load_data_file(path, cache_dir=cache_dir)
+            self.assertEqual(1, len(os.listdir(cache_dir)))
+
+            # 2回目はパースしない
+            with mock.patch.object(loaders, "read_csv_typed", side_effect=AssertionError("parsed")):
+                df_actual = load_data_file(path, cache_dir=cache_dir)
+            pd.testing.assert_frame_equal(df_expect, df_actual)
+
+            # ファイルが更新されたらパースし直す
+            self.df.iloc[:3].to_csv(path, index=False)
+            df_actual = load_data_file(path, cache_dir=cache_dir)
+            self.assertEqual(3, len(df_actual))
+            self.assertEqual(2, len(os.listdir(cache_dir)))
+
+    def test_merge_frames(self):
+        df_1 = self.df.assign(code=pd.Categorical(["0000"]*5))
+        df_2 = self.df.assign(code=pd.Categorical(["1000", "0000", "2000", "1000", None]),
+                              open=np.arange(5, dtype=np.int64))
+        df_expect = pd.concat([df_1, df_2], ignore_index=True)
+
+        frames = [df_1, df_2]
+        df_actual = merge_frames(frames)
+
+        self.assertEqual([], frames)
+        self.assertEqual(["0000", "1000", "2000"], df_actual["code"].cat.categories.tolist())
+        pd.testing.assert_frame_equal(df_expect.astype({"code": str}),
+                                      df_actual.astype({"code": str}))
+
+    def test_parallel_load(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            data_files = []
+            for i in range(4):
+                path = os.path.join(tmp_dir, f"{i}.csv")
+                self.df.assign(code=f"{i:04}").to_csv(path, index=False)
+                data_files.append(path)
+
+            datafetcher_expect = DataFetcher(data_files=data_files, typed=True)
+            for parallel_backend in ["thread", "process"]:
+                datafetcher = DataFetcher(data_files=data_files,
+                                          typed=True,
+                                          n_jobs=2,
+                                          parallel_backend=parallel_backend)
+                pd.testing.assert_frame_equal(datafetcher_expect.df_data.reset_index(drop=True),
+                                              datafetcher.df_data.reset_index(drop=True))
+
+    def test_load_data_files_index(self):
+        """
+        n_jobs に関わらず同じ結果(indexは0からの連番)になること。data_files が空なら ValueError
+        """
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            data_files = []
+            for i in range(5):
+                path = os.path.join(tmp_dir, f"{i}.csv")
+                self.df.assign(code=f"{i:04}", open=self.df["open"] + i).to_csv(path, index=False)
+                data_files.append(path)
+
+            for typed in [False, True]:
+                with self.subTest(typed=typed):
+                    df_expect = pd.concat([pd.read_csv(x, dtype={"code": str} if typed else None) for x in data_files],
+                                          ignore_index=True)
+                    df_serial = load_data_files(data_files, typed=typed)
+                    df_parallel = load_data_files(data_files, typed=typed, n_jobs=2)
+                    pd.testing.assert_frame_equal(df_serial, df_parallel)
+                    self.assertEqual(list(range(len(df_expect))), df_serial.index.tolist())
+                    self.assertEqual(df_expect["code"].astype(str).tolist(), df_serial["code"].astype(str).tolist())
+                    self.assertEqual(df_expect["open"].tolist(), df_serial["open"].tolist())
+
+            with self.assertRaises(ValueError):
+                load_data_files([])
+
+    def test_merge_frames_mixed(self):
+        """
+        型が混ざっていても pd.concat と同じ値になること
+        """
+        df_1 = self.df.assign(code=pd.Categorical(["0000"]*5), open=np.arange(5, dtype=np.int64))
+        df_2 = self.df.assign(code=["1000"]*5)
+        df_3 = self.df.assign(code=pd.Categorical(["2000"]*5), volume=1)
+        df_expect = pd.concat([df_1, df_2, df_3], ignore_index=True)
+        df_actual = merge_frames([df_1, df_2, df_3])
+        self.assertEqual(df_expect["code"].astype(str).tolist(), df_actual["code"].astype(str).tolist())
+        self.assertEqual(df_expect["open"].tolist(), df_actual["open"].tolist())
+        self.assertEqual(df_expect["volume"].isna().tolist(), df_actual["volume"].isna().tolist())
+
+    def assert_filtered(self, df_actual):
+        df_actual = df_actual.assign(code=df_actual["code"].astype(str),
+                                     date=pd.to_datetime(df_actual["date"]))
+        df_actual = df_actual.sort_values(["code", "date"]).reset_index(drop=True)
+        self.assertEqual(["1000", "1000"], df_actual["code"].tolist())
+        self.assertEqual([12., 13.], df_actual["open"].tolist())
+
+    def test_filter(self):
+        """
+        date_range, codes で絞り込んで読み込むこと
+        """
+        df = pd.concat([self.df, self.df.assign(code="1000", open=self.df["open"] + 10)])
+        date_range = (self.base_dt + timedelta(days=2), self.base_dt + timedelta(days=3))
+        codes = ["1000", "2000"]
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            df.to_csv(os.path.join(tmp_dir, "data.csv"), index=False)
+            self.assert_filtered(load_data_file(os.path.join(tmp_dir, "data.csv"),
+                                                typed=True, date_range=date_range, codes=codes))
+            self.assert_filtered(load_data_file(os.path.join(tmp_dir, "data.csv"),
+                                                cache_dir=os.path.join(tmp_dir, "cache"),
+                                                date_range=date_range, codes=codes))
+
+            datafetcher = DataFetcher(df=df, date_range=date_range, codes=codes)
+            self.assert_filtered(datafetcher.df_data)
+
+            if pyarrow is None:
+                return
+            import pyarrow.parquet as pq
+
+            df.to_parquet(os.path.join(tmp_dir, "data.parquet"), row_group_size=2)
+            self.assert_filtered(load_data_file(os.path.join(tmp_dir, "data.parquet"),
+                                                date_range=date_range, codes=codes))
+            df.to_feather(os.path.join(tmp_dir, "data.feather"))
+            self.assert_filtered(load_data_file(os.path.join(tmp_dir, "data.feather"),
+                                                date_range=date_range, codes=codes))
+
+            # date, code でパーティションしたディレクトリ
+            dataset_dir = os.path.join(tmp_dir, "dataset")
+            pq.write_to_dataset(pyarrow.Table.from_pandas(df.assign(date=df["date"].dt.strftime("%Y-%m-%d")),
+                                                          preserve_index=False),
+                                dataset_dir,
+                                partition_cols=["date", "code"])
+            self.assert_filtered(load_data_file(dataset_dir, date_range=date_range, codes=codes))
+
+    def test_filter_zero_padded_code(self):
+        """
+        型なしで読み込むCSVでも、先頭が0のcodeで絞り込めること
+        """
+        df = pd.concat([self.df.assign(code="0001"), self.df.assign(code="1000", open=self.df["open"] + 10)])
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "data.csv")
+            df.to_csv(path, index=False)
+            df_actual = load_data_file(path, date_range=(self.base_dt, None), codes=["0001"])
+            self.assertEqual(["0001"] * len(self.df), df_actual["code"].tolist())
+            self.assertEqual(self.df["open"].tolist(), df_actual["open"].tolist())
+
+    def test_parquet_dataset_fetch(self):
+        """
+        date, code でパーティションしたディレクトリを DataFetcher で読み込み、fetch できること
+        """
+        if pyarrow is None:
+            return
+        import pyarrow.parquet as pq
+
+        df = pd.concat([self.df, self.df.assign(code="1000", open=self.df["open"] + 10)])
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            dataset_dir = os.path.join(tmp_dir, "dataset")
+            pq.write_to_dataset(pyarrow.Table.from_pandas(df.assign(date=df["date"].dt.strftime("%Y-%m-%d")),
+                                                          preserve_index=False),
+                                dataset_dir,
+                                partition_cols=["date", "code"])
+            datafetcher = DataFetcher(data_files=[dataset_dir], start_datetime=self.base_dt - timedelta(days=1))
+            self.assertTrue(pd.api.types.is_datetime64_any_dtype(datafetcher.df_data["date"]))
+            df_data = datafetcher.fetch(step=timedelta(days=1))
+            self.assertEqual([self.base_dt, self.base_dt], df_data["date"].tolist())
+            self.assertEqual(["0000", "1000"], sorted(df_data["code"].astype(str).tolist()))
+
+    def test_unknown_format(self):
+        with self.assertRaises(ValueError):
+            load_data_file("data.xlsx")
+
 if __name__ == "__main__":
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,218 @@
+import unittest
+import pandas as pd
+import numpy as np
+from datetime import datetime as dt
+from datetime import timedelta
+from backtestforstock.features.core import FeatureProcessor
+from backtestforstock.features.empty import NothingProcessor
+from backtestforstock.features.indicators import SMAProcessor, EMAProcessor, RSIProcessor, ATRProcessor, \
+    BollingerProcessor, ZScoreProcessor, VWAPProcessor, CompositeProcessor
+
+
+class CumsumProcessor(FeatureProcessor):
+    """
+    code毎のcloseの累積和を特徴量にする(テスト用)
+    """
+    def __init__(self):
+        super().__init__()
+        self.reset()
+
+    def reset(self):
+        self.total = {}
+
+    def _transform_core(self, df):
+        df["close_cumsum"] = df.groupby("code")["close"].cumsum()
+        return df
+
+    def _update_core(self, df):
+        values = []
+        for code, close in zip(df["code"], df["close"]):
+            self.total[code] = self.total.get(code, 0) + close
+            values.append(self.total[code])
+        df["close_cumsum"] = values
+        return df
+
+
+class TransformOnlyCumsumProcessor(FeatureProcessor):
+    def _transform_core(self, df):
+        df["close_cumsum"] = df.groupby("code")["close"].cumsum()
+        return df
+
+
+def make_data():
+    base_dt = dt(year=2020, month=1, day=1)
+    return pd.DataFrame({"open": np.arange(10, dtype=float),
+                         "close": np.arange(10, dtype=float) + 1,
+                         "high": np.arange(10, dtype=float) + 2,
+                         "low": np.arange(10, dtype=float),
+                         "volume": np.arange(10) * 100,
+                         "date": [base_dt+timedelta(days=x) for x in range(5)]*2,
+                         "code": ["0000"]*5 + ["1000"]*5}).sort_values("date", kind="mergesort")
+
+
+class TestFeatureProcessor(unittest.TestCase):
+    def test_supports_incremental(self):
+        self.assertTrue(CumsumProcessor().supports_incremental)
+        self.assertFalse(TransformOnlyCumsumProcessor().supports_incremental)
+        self.assertFalse(NothingProcessor().supports_incremental)
+
+    def test_update(self):
+        """
+        分割して update した結果が、全体に transform した結果と一致すること
+        """
+        df = make_data()
+        processor = CumsumProcessor()
+
+        df_expect = processor.transform(df)
+        df_actual = pd.concat([processor.update(df.iloc[:3]),
+                               processor.update(df.iloc[3:4]),
+                               processor.update(df.iloc[4:])])
+        pd.testing.assert_frame_equal(df_expect, df_actual)
+
+        processor.reset()
+        pd.testing.assert_frame_equal(df_expect, processor.update(df))
+
+    def test_update_validate(self):
+        """
+        生データを書き換えたらエラーになること
+        """
+        class BrokenProcessor(FeatureProcessor):
+            def _update_core(self, df):
+                df["close"] = 0
+                return df
+
+        with self.assertRaises(AssertionError):
+            BrokenProcessor().update(make_data())
+    def test_validation_modes(self):
+        df = make_data()
+        df_expect = CumsumProcessor().transform(df)
+        for validation in FeatureProcessor.VALIDATION_MODES:
+            processor = TransformOnlyCumsumProcessor(validation=validation, validation_sample_size=3)
+            pd.testing.assert_frame_equal(df_expect, processor.transform(df))
+
+        with self.assertRaises(ValueError):
+            TransformOnlyCumsumProcessor(validation="none")
+
+    def test_validation_modes_detect(self):
+        """
+        生データを書き換える処理を検知すること
+        """
+        class InplaceProcessor(FeatureProcessor):
+            def _transform_core(self, df):
+                df["close"] = df["close"] * 2
+                return df
+
+        class ReorderProcessor(FeatureProcessor):
+            def _transform_core(self, df):
+                return df.iloc[::-1]
+
+        for validation in ["full", "checksum", "sampled"]:
+            df = make_data()
+            with self.assertRaises(AssertionError):
+                InplaceProcessor(validation=validation).transform(df)
+            with self.assertRaises(AssertionError):
+                ReorderProcessor(validation=validation, validation_sample_size=10).transform(df)
+
+        # 浅いコピーを書き換えた場合も、入力データは変わらず、出力の書き換えとして検知すること
+        class InplaceOnlyProcessor(FeatureProcessor):
+            def _transform_core(self, df):
+                df.loc[df.index[0], "open"] = -1
+                return df.copy()
+
+        df = make_data()
+        with self.assertRaises(AssertionError):
+            InplaceOnlyProcessor(validation="checksum").transform(df)
+        pd.testing.assert_frame_equal(make_data(), df)
+
+        df = make_data()
+        df_actual = InplaceProcessor(validation="off").transform(df)
+        self.assertEqual((make_data()["close"] * 2).tolist(), df_actual["close"].tolist())
+
+class TestIndicators(unittest.TestCase):
+    rng = np.random.default_rng(0)
+    close = 100 + np.cumsum(rng.normal(size=60))
+    df = pd.DataFrame({"open": close + rng.normal(size=60) * 0.1,
+                       "close": close,
+                       "high": close + np.abs(rng.normal(size=60)),
+                       "low": close - np.abs(rng.normal(size=60)),
+                       "volume": rng.integers(1, 1000, size=60),
+                       "date": [dt(year=2020, month=1, day=1) + timedelta(days=x) for x in range(30)] * 2,
+                       "code": ["0000"] * 30 + ["1000"] * 30}).sort_values("date", kind="mergesort")
+
+    def processors(self):
+        return [SMAProcessor(period=5),
+                EMAProcessor(period=5),
+                RSIProcessor(period=5),
+                ATRProcessor(period=5),
+                BollingerProcessor(period=5),
+                ZScoreProcessor(period=5),
+                VWAPProcessor(),
+                VWAPProcessor(period=5)]
+
+    def test_incremental(self):
+        """
+        update で1本ずつ/まとめて計算した結果が transform と一致すること
+        """
+        for processor in self.processors():
+            df_expect = processor.transform(self.df)
+            for chunksize in [1, 7]:
+                processor.reset()
+                df_actual = pd.concat([processor.update(self.df.iloc[i:i + chunksize])
+                                       for i in range(0, len(self.df), chunksize)])
+                pd.testing.assert_frame_equal(df_expect, df_actual)
+
+    def test_reference(self):
+        """
+        pandasで計算した値と一致すること
+        """
+        df_actual = self.df
+        for processor in self.processors():
+            df_actual = processor.transform(df_actual)
+
+        for code, df in df_actual.groupby("code"):
+            close = df["close"]
+            np.testing.assert_allclose(close.rolling(5).mean(), df["sma_5"])
+            np.testing.assert_allclose(close.ewm(span=5, adjust=False).mean(), df["ema_5"])
+            np.testing.assert_allclose(close.rolling(5).mean() + 2 * close.rolling(5).std(ddof=0), df["bb_upper_5"])
+            np.testing.assert_allclose((close - close.rolling(5).mean()) / close.rolling(5).std(ddof=0), df["zscore_5"])
+
+            delta = close.diff()
+            avg_gain = delta.clip(lower=0).iloc[1:].ewm(alpha=1 / 5, adjust=False).mean()
+            avg_loss = (-delta).clip(lower=0).iloc[1:].ewm(alpha=1 / 5, adjust=False).mean()
+            rsi = 100 - 100 / (1 + avg_gain / avg_loss)
+            np.testing.assert_allclose(rsi.iloc[4:], df["rsi_5"].iloc[5:])
+            self.assertTrue(df["rsi_5"].iloc[:5].isna().all())
+
+            prev_close = close.shift(1)
+            true_range = pd.concat([df["high"] - df["low"],
+                                    (df["high"] - prev_close).abs(),
+                                    (df["low"] - prev_close).abs()], axis=1).max(axis=1)
+            np.testing.assert_allclose(true_range.ewm(alpha=1 / 5, adjust=False).mean().iloc[4:], df["atr_5"].iloc[4:])
+
+            pv = (df["high"] + df["low"] + df["close"]) / 3 * df["volume"]
+            np.testing.assert_allclose(pv.cumsum() / df["volume"].cumsum(), df["vwap"])
+            np.testing.assert_allclose(pv.rolling(5).sum() / df["volume"].rolling(5).sum(), df["vwap_5"])
+
+    def test_composite(self):
+        """
+        CompositeProcessor が、各processorを順に transform/update したものと一致すること
+        """
+        processor = CompositeProcessor(self.processors())
+        self.assertTrue(processor.supports_incremental)
+        self.assertFalse(CompositeProcessor([SMAProcessor(period=5), TransformOnlyCumsumProcessor()]).supports_incremental)
+        with self.assertRaises(ValueError):
+            CompositeProcessor([])
+
+        df_expect = self.df
+        for child in self.processors():
+            df_expect = child.transform(df_expect)
+        pd.testing.assert_frame_equal(df_expect, processor.transform(self.df))
+
+        for chunksize in [1, 7]:
+            processor.reset()
+            df_actual = pd.concat([processor.update(self.df.iloc[i:i + chunksize])
+                                   for i in range(0, len(self.df), chunksize)])
+            pd.testing.assert_frame_equal(df_expect, df_actual)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,161 @@
+import os
+import tempfile
+import unittest
+import numpy as np
+import pandas as pd
+from backtestforstock.history import HistoryManager, History
+from backtestforstock.position import Position
+from backtestforstock.common import get_logger
+from logging import WARNING
+from datetime import timedelta
+from datetime import datetime as dt
+
+
+class TestHistoryManager(unittest.TestCase):
+    base_dt = dt(year=2020, month=1, day=1)
+
+    def _make(self, n=3, codes=("0000", "1000"), **kwargs):
+        """
+        code0000, 1000 を交互に新規 -> 1件毎に直前のポジションをクローズ
+        """
+        history_manager = HistoryManager(logger=get_logger(level=WARNING), **kwargs)
+        for i in range(n):
+            code = codes[i % 2]
+            if i % 2 == 0:
+                history_manager.add(code=code, date=self.base_dt + timedelta(days=i), amount=100 + i,
+                                    price=200 + i, category="long")
+            else:
+                position = Position(id=i - 1, date=self.base_dt, code=code, category="long", amount=100, price=150)
+                history_manager.add(code=code, date=self.base_dt + timedelta(days=i), amount=50,
+                                    price=300 + i, category="short", position=position)
+        return history_manager
+
+    def test_histories(self):
+        history_manager = self._make()
+        expect = [History(id=0, date=self.base_dt, code="0000", category="long", amount=100,
+                          price_open=200, price_close=np.nan),
+                  History(id=1, date=self.base_dt + timedelta(days=1), code="1000", category="short", amount=50,
+                          price_open=150, price_close=301, id_close=0),
+                  History(id=2, date=self.base_dt + timedelta(days=2), code="0000", category="long", amount=102,
+                          price_open=202, price_close=np.nan)]
+        self.assertEqual(expect, history_manager.histories)
+        self.assertEqual(3, history_manager.id_max)
+        self.assertEqual(3, len(history_manager))
+
+    def test_grow(self):
+        n = HistoryManager.MIN_CAPACITY * 2 + 5
+        history_manager = self._make(n)
+        histories = history_manager.histories
+        self.assertEqual(n, len(histories))
+        self.assertEqual(list(range(n)), [x.id for x in histories])
+        self.assertEqual(["0000", "1000"], history_manager.codes)
+        # n は奇数なので、最後は新規
+        self.assertEqual(200 + n - 1, histories[-1].price_open)
+        self.assertEqual(300 + n - 2, histories[-2].price_close)
+
+    def test_to_frame(self):
+        history_manager = self._make()
+        df = history_manager.to_frame()
+        self.assertEqual([0, 1, 2], df["id"].tolist())
+        self.assertEqual(["0000", "1000", "0000"], df["code"].tolist())
+        self.assertEqual(["long", "short", "long"], df["category"].tolist())
+        self.assertEqual([100, 50, 102], df["amount"].tolist())
+        self.assertEqual([pd.NA, 0, pd.NA], df["id_close"].tolist())
+        self.assertTrue(np.isnan(df["price_close"].iloc[0]))
+        self.assertTrue(np.shares_memory(df["amount"].to_numpy(), history_manager._columns["amount"]))
+
+        # 追加しても、取得済みのDataFrameは変わらないこと
+        history_manager.add(code="2000", date=self.base_dt, amount=1, price=1, category="long")
+        self.assertEqual(3, len(df))
+        self.assertEqual(4, len(history_manager.to_frame()))
+
+    def test_to_arrow(self):
+        history_manager = self._make()
+        table = history_manager.to_arrow()
+        self.assertEqual(["0000", "1000", "0000"], table["code"].to_pylist())
+        self.assertEqual(["long", "short", "long"], table["category"].to_pylist())
+        self.assertEqual([None, 0, None], table["id_close"].to_pylist())
+        self.assertEqual([100, 50, 102], table["amount"].to_pylist())
+
+    def test_to_arrow_int_code(self):
+        """
+        code が int(型なしで読み込んだCSV)でも to_arrow できること
+        """
+        table = self._make(codes=(7203, 9984)).to_arrow()
+        self.assertEqual([7203, 9984, 7203], table["code"].to_pylist())
+        self.assertEqual([], HistoryManager(logger=get_logger(level=WARNING)).to_arrow()["code"].to_pylist())
+
+    def test_extend(self):
+        history_manager = self._make()
+        other = self._make()
+        other.extend(history_manager.to_frame(), id_close_offset=10)
+
+        histories = other.histories
+        self.assertEqual(list(range(6)), [x.id for x in histories])
+        self.assertEqual([None, 0, None, None, 10, None], [x.id_close for x in histories])
+        self.assertEqual(history_manager.histories[1].price_close, histories[4].price_close)
+        self.assertTrue(histories[3].price_close is np.nan)
+
+    def test_spill(self):
+        """
+        spill_batch_size 件毎にファイルに書き出し、メモリ上は spill_batch_size 件以下になること
+        読み込んだ結果は書き出さない場合と一致すること
+        """
+        n = 25
+        expect = self._make(n)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            spill_path = os.path.join(tmp_dir, "history.arrows")
+            history_manager = self._make(n, spill_path=spill_path, spill_batch_size=10)
+            self.assertEqual(20, history_manager._n_spilled)
+            self.assertEqual(5, history_manager._n_buffered)
+            self.assertEqual(n, len(history_manager))
+            self.assertTrue(os.path.exists(spill_path))
+
+            self.assertEqual(expect.histories, history_manager.histories)
+            self.assertEqual([10, 10, 5], [len(df) for df in history_manager.iter_frames()])
+            pd.testing.assert_frame_equal(expect.to_frame(), history_manager.to_frame())
+            table = history_manager.to_arrow()
+            self.assertEqual(expect.to_arrow()["code"].to_pylist(), table["code"].to_pylist())
+            self.assertEqual(expect.to_arrow()["id_close"].to_pylist(), table["id_close"].to_pylist())
+
+            # close で残りも書き出し、以降は追加できないこと
+            history_manager.close()
+            self.assertEqual(n, history_manager._n_spilled)
+            self.assertEqual(expect.histories, history_manager.histories)
+            with self.assertRaises(ValueError):
+                history_manager.add(code="0000", date=self.base_dt, amount=1, price=1, category="long")
+
+    def test_spill_int_code(self):
+        """
+        code が int(型なしで読み込んだCSV)でも書き出し・読み込みできること
+        """
+        expect = self._make(25, codes=(7203, 9984))
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            history_manager = self._make(25, codes=(7203, 9984),
+                                         spill_path=os.path.join(tmp_dir, "history.arrows"),
+                                         spill_batch_size=10)
+            self.assertEqual(20, history_manager._n_spilled)
+            self.assertEqual(expect.histories, history_manager.histories)
+            pd.testing.assert_frame_equal(expect.to_frame(), history_manager.to_frame())
+            self.assertEqual(expect.to_arrow()["code"].to_pylist(), history_manager.to_arrow()["code"].to_pylist())
+
+    def test_spill_extend(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            history_manager = HistoryManager(logger=get_logger(level=WARNING),
+                                             spill_path=os.path.join(tmp_dir, "history.arrows"),
+                                             spill_batch_size=4)
+            history_manager.extend(self._make(5).to_frame())
+            history_manager.extend(self._make(3).to_frame(), id_close_offset=3)
+            self.assertEqual(5, history_manager._n_spilled)
+            self.assertEqual([None, 0, None, 2, None, None, 3, None],
+                             [x.id_close for x in history_manager.histories])
+            self.assertEqual(list(range(8)), history_manager.to_frame()["id"].tolist())
+
+    def test_error(self):
+        history_manager = HistoryManager(logger=get_logger(level=WARNING))
+        with self.assertRaises(ValueError):
+            history_manager.add(code="0000", date=self.base_dt, amount=1, price=1, category="buy")
+
+
+if __name__ == "__main__":
+    unittest.main()
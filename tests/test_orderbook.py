@@ -0,0 +1,265 @@
+import unittest
+import numpy as np
+import pandas as pd
+from backtestforstock.strategies.core import Strategy
+from backtestforstock.account import Account
+from backtestforstock.datafetchers.core import DataFetcher
+from backtestforstock.backtester import BackTester
+from backtestforstock.orderbook import OrderBook, FirstTouchResolver
+from backtestforstock.position import ArrayPositionManager
+from backtestforstock.callbacks.order import OrderCallback
+from backtestforstock.common import get_logger
+from logging import WARNING
+from datetime import timedelta
+from datetime import datetime as dt
+from helpers import ReplayStrategy, make_data
+
+
+class BuyOnceStrategy(Strategy):
+    """
+    初日だけ全銘柄を amount 株ずつ、指値・逆指値付きで買う(テスト用)
+    """
+    def __init__(self,
+                 amount: float = 100,
+                 limit_prices: dict = None,
+                 stop_prices: dict = None):
+        super().__init__()
+        self.amount = amount
+        self.limit_prices = {} if limit_prices is None else limit_prices
+        self.stop_prices = {} if stop_prices is None else stop_prices
+        self.done = False
+
+    def _trade_core(self,
+                    df_data: pd.DataFrame,
+                    account: Account):
+        if self.done:
+            return
+        self.done = True
+        for code, df in df_data.groupby("code"):
+            account.trade(data=df.iloc[-1],
+                          amount=self.amount,
+                          price=df.iloc[-1]["open"],
+                          category="long",
+                          callbacks=[OrderCallback(limit_price=self.limit_prices.get(code),
+                                                   stop_price=self.stop_prices.get(code))])
+
+
+class TestOrderBook(unittest.TestCase):
+    base_dt = dt(year=2020, month=1, day=1)
+    df = pd.DataFrame({"open": [100, 100, 100, 130, 200, 200],
+                       "close": [100, 100, 100, 130, 200, 200],
+                       "high": [110, 110, 125, 140, 210, 210],
+                       "low": [90, 90, 95, 120, 190, 190],
+                       "date": [dt(year=2020, month=1, day=1) + timedelta(days=x) for x in range(3)] * 2,
+                       "code": ["0000"] * 3 + ["1000"] * 3})
+
+    def _run(self, df, strategy, order_book=True, date_step_interval="1d", **kwargs):
+        logger = get_logger(level=WARNING)
+        account = Account(initial_cash=1_000_000,
+                          logger=logger,
+                          order_book=OrderBook(logger=logger) if order_book else None,
+                          **kwargs)
+        BackTester(data_fetcher=DataFetcher(df=df, start_datetime=df["date"].min()),
+                   strategy=strategy,
+                   account=account,
+                   date_step_interval=date_step_interval).run()
+        return account
+
+    def test_trigger_without_trade(self):
+        """
+        戦略がその銘柄を取引しないステップでも、指値・逆指値で約定すること
+        """
+        strategy = BuyOnceStrategy(limit_prices={"0000": 120}, stop_prices={"1000": 125})
+        account = self._run(self.df, strategy)
+        # 1000: 1日目に安値120 <= 逆指値125 で逆指値約定, 0000: 3日目に高値125 >= 指値120 で指値約定
+        expect_cash = 1_000_000 - 100 * 100 - 130 * 100 + 125 * 100 + 120 * 100
+        self.assertEqual(expect_cash, account.cash)
+        self.assertEqual([], account.position_manager.positions)
+        self.assertEqual([(self.base_dt, "1000", 125),
+                          (self.base_dt + timedelta(days=2), "0000", 120)],
+                         [(x.date, x.code, x.price_close) for x in account.history_manager.histories[2:]])
+        self.assertEqual(0, len(account.order_book))
+
+        # OrderBook が無ければ、取引しない銘柄は判定されない
+        account = self._run(self.df, BuyOnceStrategy(limit_prices={"0000": 120}, stop_prices={"1000": 125}),
+                            order_book=False)
+        self.assertEqual(1_000_000 - 100 * 100 - 130 * 100 + 125 * 100, account.cash)
+        self.assertEqual(1, len(account.position_manager.positions))
+
+    def test_multi_bar_step(self):
+        """
+        1ステップに複数の足が入る場合、最後の足以外の高値/安値でも約定すること
+        """
+        df = pd.DataFrame({"open": [100, 100, 100, 100, 100, 100],
+                           "close": [100, 100, 100, 100, 100, 100],
+                           "high": [110, 110, 110, 150, 110, 110],
+                           "low": [90, 90, 90, 90, 90, 90],
+                           "date": [self.base_dt + timedelta(days=x) for x in range(6)],
+                           "code": ["0000"] * 6})
+        account = self._run(df, BuyOnceStrategy(limit_prices={"0000": 120}), date_step_interval="2d")
+        self.assertEqual(1_000_000 - 100 * 100 + 120 * 100, account.cash)
+        self.assertEqual([], account.position_manager.positions)
+        self.assertEqual(120, account.history_manager.histories[-1].price_close)
+
+    def test_trigger_on_step_begin(self):
+        """
+        始値で引っかかった場合は始値で約定し、同じ足で両方引っかかった場合は半分ずつクローズすること
+        """
+        df = self.df.copy()
+        df.loc[(df["code"] == "0000") & (df["date"] == self.base_dt + timedelta(days=1)), ["open", "high"]] = [130, 135]
+        strategy = BuyOnceStrategy(limit_prices={"0000": 120, "1000": 135}, stop_prices={"1000": 125})
+        account = self._run(df, strategy)
+        # 1000: 1日目に高値140 >= 指値135 と 安値120 <= 逆指値125 の両方, 0000: 2日目の始値130 >= 指値120
+        self.assertEqual([(self.base_dt, "1000", 135, 50),
+                          (self.base_dt, "1000", 125, 50),
+                          (self.base_dt + timedelta(days=1), "0000", 130, 100)],
+                         [(x.date, x.code, x.price_close, x.amount) for x in account.history_manager.histories[2:]])
+        self.assertEqual(1_000_000 - 100 * 100 - 130 * 100 + 135 * 50 + 125 * 50 + 130 * 100, account.cash)
+
+    def test_same_as_account_trade(self):
+        """
+        全銘柄を毎ステップ取引する戦略では、Account.trade で判定する場合と結果が一致すること
+        (現金が足りる場合。取引履歴は銘柄をまたいだ順序が変わるので、並べ替えて比較する)
+        """
+        df = make_data(n_dates=40, n_codes=4, seed=5)
+        rng = np.random.default_rng(5)
+        df_open = df.pivot(index="date", columns="code", values="open")
+        orders = pd.DataFrame(rng.choice([-200, -100, 0, 100, 200], size=df_open.shape).astype(float),
+                              index=df_open.index, columns=df_open.columns)
+        limit_prices = (df_open * rng.uniform(1.0, 1.1, size=df_open.shape)).mask(rng.random(size=df_open.shape) < 0.3)
+        stop_prices = (df_open * rng.uniform(0.9, 1.0, size=df_open.shape)).mask(rng.random(size=df_open.shape) < 0.3)
+
+        def history_key(x):
+            return (x.date, x.code, x.category, x.amount, x.price_open,
+                    None if np.isnan(x.price_close) else x.price_close, x.id_close)
+
+        def position_key(x):
+            return (x.id, x.code, x.amount, x.price)
+
+        expect = self._run(df, ReplayStrategy(orders=orders, limit_prices=limit_prices, stop_prices=stop_prices),
+                           order_book=False)
+        for array_position_manager in [False, True]:
+            with self.subTest(array_position_manager=array_position_manager):
+                logger = get_logger(level=WARNING)
+                actual = self._run(df, ReplayStrategy(orders=orders, limit_prices=limit_prices, stop_prices=stop_prices),
+                                   position_manager=ArrayPositionManager(logger=logger) if array_position_manager else None)
+                self.assertEqual(expect.cash, actual.cash)
+                self.assertEqual([position_key(x) for x in expect.position_manager.positions],
+                                 [position_key(x) for x in actual.position_manager.positions])
+                self.assertEqual(sorted(map(history_key, expect.history_manager.histories)),
+                                 sorted(map(history_key, actual.history_manager.histories)))
+
+    def test_compact(self):
+        """
+        戦略がクローズしたポジションの注文は、半分を超えたらヒープから取り除くこと
+        """
+        logger = get_logger(level=WARNING)
+        order_book = OrderBook(logger=logger)
+        order_book.MIN_COMPACT = 0
+        account = Account(initial_cash=1_000_000, logger=logger, order_book=order_book)
+        data = pd.Series({"code": "0000", "date": self.base_dt, "open": 100, "high": 110, "low": 90})
+        for _ in range(4):
+            account.trade(data=data, amount=100, price=100, category="long",
+                          callbacks=[OrderCallback(limit_price=150, stop_price=50)])
+        self.assertEqual(8, len(order_book))
+
+        account.trade(data=data, amount=400, price=100, category="short")
+        self.assertEqual(0, len(account.position_manager.get_positions("0000")))
+        self.assertEqual(0, len(order_book))
+        self.assertEqual([], order_book._limit_heaps[0])
+        self.assertEqual([], order_book._stop_heaps[0])
+        self.assertEqual(np.inf, order_book._min_limit[0])
+
+    def test_error(self):
+        logger = get_logger(level=WARNING)
+        with self.assertRaises(ValueError):
+            BackTester(data_fetcher=DataFetcher(df=self.df, start_datetime=self.base_dt, fetch_mode="mask"),
+                       strategy=BuyOnceStrategy(),
+                       account=Account(initial_cash=1_000_000, logger=logger, order_book=OrderBook(logger=logger)),
+                       date_step_interval="1d")
+
+
+class TestFirstTouchResolver(unittest.TestCase):
+    df = TestOrderBook.df
+
+    def _run(self, df, strategy, resolver=True, **kwargs):
+        logger = get_logger(level=WARNING)
+        data_fetcher = DataFetcher(df=df, start_datetime=df["date"].min())
+        account = Account(initial_cash=1_000_000,
+                          logger=logger,
+                          order_book=FirstTouchResolver(df_data=data_fetcher.df_data, logger=logger) if resolver
+                          else OrderBook(logger=logger),
+                          **kwargs)
+        BackTester(data_fetcher=data_fetcher,
+                   strategy=strategy,
+                   account=account,
+                   date_step_interval="1d").run()
+        return account
+
+    def _assert_same(self, expect, actual):
+        def history_key(x):
+            return (x.id, x.date, x.code, x.category, x.amount, x.price_open,
+                    None if np.isnan(x.price_close) else x.price_close, x.id_close)
+
+        def position_key(x):
+            return (x.id, x.code, x.amount, x.price)
+
+        self.assertEqual(expect.cash, actual.cash)
+        self.assertEqual([position_key(x) for x in expect.position_manager.positions],
+                         [position_key(x) for x in actual.position_manager.positions])
+        self.assertEqual(list(map(history_key, expect.history_manager.histories)),
+                         list(map(history_key, actual.history_manager.histories)))
+
+    def test_same_as_order_book(self):
+        """
+        OrderBook と結果(取引履歴の順序も含む)が一致すること
+        """
+        df = self.df.copy()
+        df.loc[(df["code"] == "0000") & (df["date"] == dt(year=2020, month=1, day=2)), ["open", "high"]] = [130, 135]
+        for limit_prices, stop_prices in [({"0000": 120}, {"1000": 125}),
+                                          ({"0000": 120, "1000": 135}, {"1000": 125}),
+                                          ({"0000": 500}, {"0000": 1, "1000": 1})]:
+            with self.subTest(limit_prices=limit_prices, stop_prices=stop_prices):
+                expect = self._run(df, BuyOnceStrategy(limit_prices=limit_prices, stop_prices=stop_prices),
+                                   resolver=False)
+                actual = self._run(df, BuyOnceStrategy(limit_prices=limit_prices, stop_prices=stop_prices))
+                self._assert_same(expect, actual)
+
+    def test_same_as_order_book_random(self):
+        """
+        ランダムな注文・指値・逆指値(戦略によるクローズを含む)で、OrderBook と結果が一致すること
+        探索範囲を広げる場合も含める
+        """
+        df = make_data(n_dates=200, n_codes=4, seed=7)
+        rng = np.random.default_rng(7)
+        df_open = df.pivot(index="date", columns="code", values="open")
+        orders = pd.DataFrame(rng.choice([-200, -100, 100, 200], size=df_open.shape).astype(float),
+                              index=df_open.index, columns=df_open.columns).mask(rng.random(size=df_open.shape) < 0.7)
+        limit_prices = (df_open * rng.uniform(1.0, 1.5, size=df_open.shape)).mask(rng.random(size=df_open.shape) < 0.3)
+        stop_prices = (df_open * rng.uniform(0.5, 1.0, size=df_open.shape)).mask(rng.random(size=df_open.shape) < 0.3)
+
+        expect = self._run(df, ReplayStrategy(orders=orders, limit_prices=limit_prices, stop_prices=stop_prices),
+                           resolver=False)
+        self.assertGreater(len(expect.history_manager), 100)
+        for array_position_manager in [False, True]:
+            with self.subTest(array_position_manager=array_position_manager):
+                logger = get_logger(level=WARNING)
+                actual = self._run(df, ReplayStrategy(orders=orders, limit_prices=limit_prices, stop_prices=stop_prices),
+                                   position_manager=ArrayPositionManager(logger=logger) if array_position_manager else None)
+                self._assert_same(expect, actual)
+
+    def test_first_touch(self):
+        resolver = FirstTouchResolver(df_data=self.df.sort_values("date", kind="mergesort"))
+        date_value = pd.Timestamp(dt(year=2020, month=1, day=1)).value
+        # 0000: 高値 110, 110, 125 / 安値 90, 90, 95 / 始値 100, 100, 100
+        self.assertEqual((2, 1, True, False), resolver._first_touch(0, date_value, 120, -np.inf))
+        self.assertEqual((0, 1, False, True), resolver._first_touch(0, date_value, np.inf, 95))
+        self.assertEqual((0, 1, True, False), resolver._first_touch(0, date_value, 100, -np.inf))
+        # 建てた足がその銘柄の足に無い場合は、次の足の始値から判定する
+        self.assertEqual((0, 0, True, False), resolver._first_touch(0, date_value - 1, 100, -np.inf))
+        self.assertEqual((0, 1, True, True), resolver._first_touch(0, date_value, 105, 95))
+        self.assertIsNone(resolver._first_touch(0, date_value, 200, 50))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,118 @@
+import unittest
+import pandas as pd
+from backtestforstock.position import PositionManager, ArrayPositionManager, Position
+from backtestforstock.common import get_logger
+from logging import WARNING
+from datetime import datetime as dt
+
+
+class TestPositionManager(unittest.TestCase):
+    position_manager_class = PositionManager
+
+    def _open(self, position_manager, code, amount=100):
+        return position_manager.open_position(code=code,
+                                              date=dt(year=2020, month=1, day=1),
+                                              amount=amount,
+                                              price=100,
+                                              category="long",
+                                              callbacks=[])
+
+    def test_get_positions(self):
+        position_manager = self.position_manager_class(logger=get_logger(level=WARNING))
+        for code in ["0000", "1000", "0000", "2000", "1000"]:
+            self._open(position_manager, code)
+
+        self.assertEqual([0, 2], [x.id for x in position_manager.get_positions("0000")])
+        self.assertEqual([1, 4], [x.id for x in position_manager.get_positions("1000")])
+        self.assertEqual([], position_manager.get_positions("9999"))
+        self.assertEqual([0, 1, 2, 3, 4], [x.id for x in position_manager.positions])
+        self.assertEqual("2000", position_manager.get_position(3).code)
+        self.assertIsNone(position_manager.get_position(99))
+
+    def test_close_position(self):
+        """
+        全量クローズしたポジションは取り除かれ、残りの順序は変わらないこと
+        """
+        position_manager = self.position_manager_class(logger=get_logger(level=WARNING))
+        positions = [self._open(position_manager, code) for code in ["0000", "1000", "0000", "0000"]]
+
+        position_manager.close_position(position=positions[2], amount=50)
+        self.assertEqual([0, 2, 3], [x.id for x in position_manager.get_positions("0000")])
+        self.assertEqual(50, position_manager.get_position(2).amount)
+
+        position_manager.close_position(position=positions[2], amount=50)
+        position_manager.close_position(position=positions[1], amount=100)
+        self.assertEqual([0, 3], [x.id for x in position_manager.get_positions("0000")])
+        self.assertEqual([], position_manager.get_positions("1000"))
+        self.assertEqual([0, 3], [x.id for x in position_manager.positions])
+        self.assertIsNone(position_manager.get_position(2))
+
+        # 取り除いた後に同じcodeで建てても、id順のまま
+        self._open(position_manager, "1000")
+        self._open(position_manager, "0000")
+        self.assertEqual([0, 3, 5], [x.id for x in position_manager.get_positions("0000")])
+        self.assertEqual([0, 3, 4, 5], [x.id for x in position_manager.positions])
+
+    def test_amount_by_code(self):
+        position_manager = self.position_manager_class(logger=get_logger(level=WARNING))
+        for code, amount, category in [("1000", 100, "long"), ("0000", 200, "short"),
+                                       ("1000", 300, "short"), ("2000", 50, "long")]:
+            position_manager.open_position(code=code,
+                                           date=dt(year=2020, month=1, day=1),
+                                           amount=amount,
+                                           price=100,
+                                           category=category,
+                                           callbacks=[])
+        position_manager.close_position(position=position_manager.get_position(3), amount=50)
+
+        pd.testing.assert_series_equal(pd.Series({"0000": 200., "1000": 400.}),
+                                       position_manager.amount_by_code())
+        pd.testing.assert_series_equal(pd.Series({"0000": -200., "1000": -200.}),
+                                       position_manager.amount_by_code(signed=True))
+
+
+class TestArrayPositionManager(TestPositionManager):
+    position_manager_class = ArrayPositionManager
+
+    def test_view(self):
+        """
+        PositionView は Position と同じ値で比較でき、クローズ後も次の open_position までは参照できること
+        """
+        position_manager = ArrayPositionManager(logger=get_logger(level=WARNING))
+        view = self._open(position_manager, "0000")
+        self.assertEqual(Position(id=0, date=dt(year=2020, month=1, day=1), code="0000", category="long",
+                                  amount=100, price=100), view)
+        self.assertEqual([view], position_manager.get_positions("0000"))
+
+        position_manager.close_position(position=view, amount=100)
+        self.assertEqual(0, view.amount)
+        self.assertEqual("0000", view.code)
+        self.assertEqual([], position_manager.positions)
+
+    def test_compact(self):
+        """
+        配列を詰め直しても、ビューと順序が保たれること
+        """
+        position_manager = ArrayPositionManager(logger=get_logger(level=WARNING))
+        n = ArrayPositionManager.MIN_CAPACITY * 4
+        views = [self._open(position_manager, f"{i % 7:04}", amount=i + 1) for i in range(n)]
+        for view in views[::3] + views[1::3]:
+            position_manager.close_position(position=view, amount=view.amount)
+        generation = position_manager._generation
+        views += [self._open(position_manager, f"{i % 7:04}", amount=i + 1) for i in range(n, n + 10)]
+        self.assertGreater(position_manager._generation, generation)
+
+        expect_ids = [i for i in range(n + 10) if i >= n or i % 3 == 2]
+        self.assertEqual(expect_ids, [x.id for x in position_manager.positions])
+        self.assertEqual([i + 1 for i in expect_ids], [views[i].amount for i in expect_ids])
+        self.assertEqual([i for i in expect_ids if i % 7 == 3],
+                         [x.id for x in position_manager.get_positions("0003")])
+        df = position_manager.to_frame()
+        self.assertEqual(expect_ids, df["id"].tolist())
+        self.assertEqual([f"{i % 7:04}" for i in expect_ids], df["code"].tolist())
+        with self.assertRaises(KeyError):
+            views[0].amount
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,214 @@
+import os
+import tempfile
+import unittest
+import numpy as np
+import pandas as pd
+from backtestforstock.reporter.core import SummaryReporter, Summary, ProfitAndLossSummary
+from backtestforstock.reporter.online import OnlineStatistics
+from backtestforstock.history import HistoryManager
+from backtestforstock.position import Position
+from backtestforstock.account import Account
+from backtestforstock.common import get_logger
+from logging import WARNING
+from datetime import datetime as dt
+
+
+def make_history_manager(n: int = 500,
+                         seed: int = 0,
+                         **kwargs) -> HistoryManager:
+    """
+    ランダムに新規・決済を繰り返した取引履歴(テスト用)
+    """
+    rng = np.random.default_rng(seed)
+    history_manager = HistoryManager(logger=get_logger(level=WARNING), **kwargs)
+    positions = []
+    for i in range(n):
+        code = f"{rng.integers(3):04}"
+        date = dt(2020, 1, 1)
+        if len(positions) == 0 or rng.random() < 0.5:
+            category = ["long", "short"][rng.integers(2)]
+            positions.append(Position(id=len(positions), date=date, code=code, category=category,
+                                      amount=100, price=float(rng.integers(90, 110))))
+            history_manager.add(code=code, date=date, amount=100, price=positions[-1].price, category=category)
+        else:
+            position = positions[rng.integers(len(positions))]
+            history_manager.add(code=position.code, date=date, amount=float(rng.integers(1, 100)),
+                                price=float(rng.integers(90, 110)),
+                                category="short" if position.category == "long" else "long",
+                                position=position)
+    return history_manager
+
+
+def expect_pl(history_manager: HistoryManager) -> list:
+    """
+    決済毎の (code, ポジションのcategory, 損益, 取引金額) をループで計算する
+    """
+    ret = []
+    for history in history_manager.histories:
+        if history.id_close is None:
+            continue
+        category = "short" if history.category == "long" else "long"
+        pl = (history.price_close - history.price_open) * history.amount
+        ret.append((history.code, category, pl, history.price_open * history.amount))
+    return ret
+
+
+class TestSummaryReporter(unittest.TestCase):
+
+    def _expect_summary(self, pls):
+        summaries = []
+        for mask in [lambda pl: True, lambda pl: pl > 0, lambda pl: pl < 0]:
+            values = [(pl, trade_amount) for _, _, pl, trade_amount in pls if mask(pl)]
+            pl_amount = sum(x[0] for x in values)
+            summaries.append(ProfitAndLossSummary(pl_amount=pl_amount,
+                                                  pl_mean=pl_amount / len(values) if len(values) > 0 else 0.,
+                                                  trade_amount=sum(x[1] for x in values),
+                                                  trade_count=len(values)))
+        return Summary(*summaries)
+
+    def test_summarize(self):
+        history_manager = make_history_manager()
+        pls = expect_pl(history_manager)
+        self.assertGreater(len(pls), 0)
+        self.assertTrue(any(category == "short" for _, category, _, _ in pls))
+
+        expect = self._expect_summary(pls)
+        actual = SummaryReporter().summarize(history_manager)
+        for kind in SummaryReporter.KINDS:
+            with self.subTest(kind=kind):
+                expect_kind, actual_kind = getattr(expect, f"{kind}_summary"), getattr(actual, f"{kind}_summary")
+                self.assertEqual(expect_kind.trade_count, actual_kind.trade_count)
+                self.assertAlmostEqual(expect_kind.pl_amount, actual_kind.pl_amount)
+                self.assertAlmostEqual(expect_kind.pl_mean, actual_kind.pl_mean)
+                self.assertAlmostEqual(expect_kind.trade_amount, actual_kind.trade_amount)
+
+    def test_breakdown(self):
+        history_manager = make_history_manager()
+        pls = expect_pl(history_manager)
+        df = SummaryReporter().breakdown(history_manager)
+        keys = sorted(set((code, category) for code, category, _, _ in pls))
+        self.assertEqual(keys, sorted(df.index.tolist()))
+        for code, category in keys:
+            expect = self._expect_summary([x for x in pls if x[0] == code and x[1] == category])
+            self.assertEqual(expect.earn_summary.trade_count, df.at[(code, category), "earn_trade_count"])
+            self.assertAlmostEqual(expect.loss_summary.pl_amount, df.at[(code, category), "loss_pl_amount"])
+            self.assertAlmostEqual(expect.profit_summary.pl_mean, df.at[(code, category), "profit_pl_mean"])
+
+    def test_spill(self):
+        """
+        ファイルに書き出した取引履歴でも同じ結果になること
+        """
+        expect = SummaryReporter().breakdown(make_history_manager())
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            history_manager = make_history_manager(spill_path=os.path.join(tmp_dir, "history.arrows"),
+                                                   spill_batch_size=64)
+            self.assertGreater(history_manager._n_spilled, 0)
+            pd.testing.assert_frame_equal(expect, SummaryReporter().breakdown(history_manager))
+
+    def test_empty(self):
+        history_manager = HistoryManager(logger=get_logger(level=WARNING))
+        summary = SummaryReporter().summarize(history_manager)
+        self.assertEqual(ProfitAndLossSummary(pl_amount=0., pl_mean=0., trade_amount=0., trade_count=0),
+                         summary.earn_summary)
+        self.assertEqual(0, len(SummaryReporter().breakdown(history_manager)))
+
+    def test_account_report(self):
+        account = Account(initial_cash=1_000_000,
+                          logger=get_logger(level=WARNING))
+        data = pd.Series({"code": "0000", "date": dt(2020, 1, 1), "open": 100, "high": 120, "low": 80})
+        account.trade(data=data, amount=100, price=100, category="long")
+        account.trade(data=data, amount=100, price=110, category="short")
+        summary = account.report()
+        self.assertEqual(ProfitAndLossSummary(pl_amount=1000., pl_mean=1000., trade_amount=10000., trade_count=1),
+                         summary.earn_summary)
+        self.assertEqual(0, summary.loss_summary.trade_count)
+
+    def test_pl_equals_cash(self):
+        """
+        全てのポジションを決済した後の損益の合計が、現金の増減と一致すること(short を含む)
+        """
+        account = Account(initial_cash=1_000_000,
+                          logger=get_logger(level=WARNING))
+        data = pd.Series({"code": "0000", "date": dt(2020, 1, 1), "open": 100, "high": 120, "low": 80})
+        account.trade(data=data, amount=100, price=100, category="short")
+        account.trade(data=data, amount=100, price=80, category="short")
+        account.trade(data=data, amount=50, price=90, category="long")
+        account.trade(data=data, amount=30, price=110, category="short")
+        account.trade(data=data, amount=20, price=70, category="short")
+        self.assertEqual([], account.position_manager.positions)
+        self.assertEqual(-2000 + 30 * 20 - 20 * 20, account.cash - 1_000_000)
+        self.assertAlmostEqual(account.cash - 1_000_000, account.report().earn_summary.pl_amount)
+
+
+class TestOnlineStatistics(unittest.TestCase):
+
+    def test_same_as_reporter(self):
+        """
+        HistoryManager.add の度に更新した結果が、取引履歴を集計した結果と一致すること
+        """
+        statistics = OnlineStatistics()
+        history_manager = make_history_manager(statistics=statistics)
+        expect = SummaryReporter().summarize(history_manager)
+        actual = statistics.summary()
+        for kind in SummaryReporter.KINDS:
+            with self.subTest(kind=kind):
+                expect_kind, actual_kind = getattr(expect, f"{kind}_summary"), getattr(actual, f"{kind}_summary")
+                self.assertEqual(expect_kind.trade_count, actual_kind.trade_count)
+                self.assertAlmostEqual(expect_kind.pl_amount, actual_kind.pl_amount)
+                self.assertAlmostEqual(expect_kind.pl_mean, actual_kind.pl_mean)
+                self.assertAlmostEqual(expect_kind.trade_amount, actual_kind.trade_amount)
+
+        pl = np.array([x[2] for x in expect_pl(history_manager)])
+        self.assertAlmostEqual(pl.mean(), statistics.pl_mean)
+        self.assertAlmostEqual(pl.std(ddof=1), statistics.pl_std)
+        self.assertAlmostEqual((pl > 0).mean(), statistics.win_rate)
+        pl_cumsum = np.cumsum(pl)
+        self.assertAlmostEqual((np.maximum.accumulate(np.maximum(pl_cumsum, 0)) - pl_cumsum).max(),
+                               statistics.max_drawdown)
+
+        df = SummaryReporter().breakdown(history_manager).groupby(level="code").sum()
+        df_code = statistics.code_frame().sort_index()
+        self.assertEqual(df["earn_trade_count"].tolist(), df_code["trade_count"].tolist())
+        self.assertEqual(df["profit_trade_count"].tolist(), df_code["profit_count"].tolist())
+        np.testing.assert_allclose(df["earn_pl_amount"].to_numpy(), df_code["pl_amount"].to_numpy())
+
+    def test_extend(self):
+        """
+        HistoryManager.extend でも決済が追加されること
+        """
+        expect = OnlineStatistics()
+        history_manager = make_history_manager(statistics=expect)
+        actual = OnlineStatistics()
+        HistoryManager(logger=get_logger(level=WARNING), statistics=actual).extend(history_manager.to_frame())
+        self.assertEqual(expect.trade_count, actual.trade_count)
+        self.assertAlmostEqual(expect.pl_cumsum, actual.pl_cumsum)
+        self.assertAlmostEqual(expect.max_drawdown, actual.max_drawdown)
+        self.assertEqual(expect.codes, actual.codes)
+
+    def test_pl_equals_cash(self):
+        """
+        全てのポジションを決済した後の損益の累計が、現金の増減と一致すること(short を含む)
+        """
+        logger = get_logger(level=WARNING)
+        statistics = OnlineStatistics()
+        account = Account(initial_cash=1_000_000,
+                          logger=logger,
+                          history_manager=HistoryManager(logger=logger, statistics=statistics))
+        data = pd.Series({"code": "0000", "date": dt(2020, 1, 1), "open": 100, "high": 120, "low": 80})
+        account.trade(data=data, amount=100, price=100, category="short")
+        account.trade(data=data, amount=100, price=80, category="short")
+        account.trade(data=data, amount=50, price=90, category="long")
+        account.trade(data=data, amount=50, price=110, category="short")
+        self.assertEqual([], account.position_manager.positions)
+        self.assertAlmostEqual(account.cash - 1_000_000, statistics.pl_cumsum)
+
+    def test_empty(self):
+        statistics = OnlineStatistics()
+        self.assertEqual(SummaryReporter().summarize(HistoryManager(logger=get_logger(level=WARNING))),
+                         statistics.summary())
+        self.assertTrue(np.isnan(statistics.pl_std))
+        self.assertTrue(np.isnan(statistics.win_rate))
+
+
+if __name__ == "__main__":
+    unittest.main()
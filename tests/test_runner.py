@@ -0,0 +1,202 @@
+import unittest
+import pandas as pd
+from backtestforstock.strategies.core import Strategy
+from backtestforstock.account import Account
+from backtestforstock.datafetchers.core import DataFetcher
+from backtestforstock.backtester import BackTester
+from backtestforstock.runner import ParameterSweep, WalkForward, expand_param_grid, summarize_account
+from backtestforstock.common import get_logger
+from logging import WARNING
+from datetime import timedelta
+from datetime import datetime as dt
+
+
+class BuyAndSellParamStrategy(Strategy):
+    """
+    毎日 amount 株ずつ買い、max_amount 株以上になったら全て売る(テスト用)
+    """
+    def __init__(self, amount, max_amount):
+        super().__init__()
+        self.amount = amount
+        self.max_amount = max_amount
+
+    def _trade_core(self,
+                    df_data: pd.DataFrame,
+                    account: Account):
+        for code, df in df_data.groupby("code"):
+            total_amount = sum(x.amount for x in account.position_manager.get_positions(code))
+            if total_amount < self.max_amount:
+                account.trade(data=df.iloc[-1],
+                              amount=self.amount,
+                              price=df.iloc[-1]["open"],
+                              category="long")
+            else:
+                account.trade(data=df.iloc[-1],
+                              amount=total_amount,
+                              price=df.iloc[-1]["open"],
+                              category="short")
+
+
+class TestParameterSweep(unittest.TestCase):
+    df = pd.concat([pd.DataFrame({"open": [100 + 10 * x for x in range(10)],
+                                  "close": [105 + 10 * x for x in range(10)],
+                                  "high": [120 + 10 * x for x in range(10)],
+                                  "low": [90 + 10 * x for x in range(10)],
+                                  "date": [dt(year=2020, month=1, day=1) + timedelta(days=x) for x in range(10)],
+                                  "code": [code] * 10}) for code in ["0000", "1000"]])
+    param_grid = {"amount": [100, 200], "max_amount": [200, 400, 600]}
+
+    def test_expand_param_grid(self):
+        self.assertEqual([{"a": 1, "b": 3}, {"a": 1, "b": 4}, {"a": 2, "b": 3}, {"a": 2, "b": 4}],
+                         expand_param_grid({"a": [1, 2], "b": [3, 4]}))
+        self.assertEqual([{"a": 1}, {"a": 2, "b": 3}],
+                         expand_param_grid([{"a": 1}, {"a": 2, "b": 3}]))
+
+    def _run_serial(self, params):
+        account = Account(initial_cash=1_000_000,
+                          logger=get_logger(level=WARNING))
+        BackTester(data_fetcher=DataFetcher(df=self.df, start_datetime=dt(year=2020, month=1, day=1)),
+                   strategy=BuyAndSellParamStrategy(**params),
+                   account=account,
+                   date_step_interval="1d").run()
+        return summarize_account(account=account,
+                                 initial_cash=1_000_000,
+                                 last_close=self.df.groupby("code")["close"].last())
+
+    def test_run(self):
+        """
+        逐次実行・並列実行とも、パラメータ毎にBackTesterを実行した結果と一致すること
+        """
+        expect = pd.DataFrame([{**params, **self._run_serial(params)}
+                               for params in expand_param_grid(self.param_grid)])
+
+        for n_jobs in [1, 2]:
+            with self.subTest(n_jobs=n_jobs):
+                sweep = ParameterSweep(strategy_factory=BuyAndSellParamStrategy,
+                                       param_grid=self.param_grid,
+                                       initial_cash=1_000_000,
+                                       date_step_interval="1d",
+                                       df=self.df,
+                                       n_jobs=n_jobs)
+                actual = sweep.run()
+                self.assertEqual(len(expect), len(actual))
+                self.assertTrue((actual["elapsed"] > 0).all())
+                pd.testing.assert_frame_equal(expect, actual.drop(columns="elapsed"))
+
+    def test_early_stop(self):
+        """
+        early_stop が True になったパラメータは途中で打ち切ること
+        """
+        sweep = ParameterSweep(strategy_factory=BuyAndSellParamStrategy,
+                               param_grid=self.param_grid,
+                               initial_cash=1_000_000,
+                               date_step_interval="1d",
+                               df=self.df,
+                               early_stop=lambda account: account.history_manager.statistics.trade_count > 0)
+        actual = sweep.run()
+        # 売るまでに保有株数が max_amount に達するのが最終日以降なら、打ち切られない
+        expect_stopped = [max_amount // amount < 10 for amount, max_amount in zip(actual["amount"], actual["max_amount"])]
+        self.assertEqual(expect_stopped, actual["stopped_early"].tolist())
+        expect = pd.DataFrame([{**params, **self._run_serial(params)} for params in expand_param_grid(self.param_grid)])
+        self.assertTrue((actual["trade_count"] <= expect["trade_count"]).all())
+        self.assertTrue((actual["trade_count"] < expect["trade_count"])[actual["stopped_early"]].all())
+
+
+def train_strategy(df_train: pd.DataFrame) -> Strategy:
+    """
+    学習期間の行数で max_amount を決める(テスト用)
+    """
+    return BuyAndSellParamStrategy(amount=100, max_amount=100 * len(df_train) // 2)
+
+
+class TestWalkForward(unittest.TestCase):
+    df = TestParameterSweep.df
+
+    def test_windows(self):
+        walk_forward = WalkForward(strategy_factory=train_strategy,
+                                   train_period="3d",
+                                   test_period="2d",
+                                   initial_cash=1_000_000,
+                                   date_step_interval="1d",
+                                   df=self.df)
+        base_dt = dt(year=2020, month=1, day=1)
+        self.assertEqual([(base_dt + timedelta(days=x), base_dt + timedelta(days=x + 3), base_dt + timedelta(days=x + 5))
+                          for x in [0, 2, 4, 6]],
+                         [(x["train_start"], x["test_start"], x["test_end"]) for x in walk_forward.windows])
+
+        walk_forward = WalkForward(strategy_factory=train_strategy,
+                                   train_period="3d",
+                                   test_period="2d",
+                                   anchored=True,
+                                   initial_cash=1_000_000,
+                                   date_step_interval="1d",
+                                   df=self.df)
+        self.assertEqual([base_dt] * 4, [x["train_start"] for x in walk_forward.windows])
+        # train_lo, test_lo, test_hi は行番号(2銘柄)
+        self.assertEqual((0, 14, 18), tuple(walk_forward.windows[2][key] for key in ["train_lo", "test_lo", "test_hi"]))
+
+    def test_run(self):
+        """
+        逐次実行・並列実行とも、期間毎にBackTesterを実行した結果と一致すること
+        """
+        base_dt = dt(year=2020, month=1, day=1)
+        expect_summary = []
+        expect_histories = []
+        position_offset = 0
+        for x in [0, 2, 4, 6]:
+            df_sorted = self.df.sort_values("date", kind="mergesort")
+            df_train = df_sorted[(df_sorted["date"] >= base_dt + timedelta(days=x)) &
+                                 (df_sorted["date"] < base_dt + timedelta(days=x + 3))]
+            df_window = df_sorted[(df_sorted["date"] >= base_dt + timedelta(days=x)) &
+                                  (df_sorted["date"] < base_dt + timedelta(days=x + 5))]
+            account = Account(initial_cash=1_000_000,
+                              logger=get_logger(level=WARNING))
+            BackTester(data_fetcher=DataFetcher(df=df_window, start_datetime=base_dt + timedelta(days=x + 3)),
+                       strategy=train_strategy(df_train),
+                       account=account,
+                       date_step_interval="1d").run()
+            expect_summary.append(summarize_account(account=account,
+                                                    initial_cash=1_000_000,
+                                                    last_close=df_window.groupby("code")["close"].last()))
+            for history in account.history_manager.histories:
+                expect_histories.append((len(expect_histories), history.date, history.code, history.amount,
+                                         None if history.id_close is None else history.id_close + position_offset))
+            position_offset += sum(history.id_close is None for history in account.history_manager.histories)
+
+        for n_jobs in [1, 2]:
+            with self.subTest(n_jobs=n_jobs):
+                result = WalkForward(strategy_factory=train_strategy,
+                                     train_period="3d",
+                                     test_period="2d",
+                                     initial_cash=1_000_000,
+                                     date_step_interval="1d",
+                                     df=self.df,
+                                     n_jobs=n_jobs).run()
+                pd.testing.assert_frame_equal(pd.DataFrame(expect_summary),
+                                              result.summary[list(expect_summary[0].keys())])
+                self.assertEqual([0, 1, 2, 3], result.summary["window"].tolist())
+                self.assertEqual(expect_histories,
+                                 [(x.id, x.date, x.code, x.amount, x.id_close) for x in result.history_manager.histories])
+                self.assertEqual(len(expect_histories), result.history_manager.id_max)
+
+    def test_error(self):
+        with self.assertRaises(ValueError):
+            WalkForward(strategy_factory=train_strategy,
+                        train_period="30d",
+                        test_period="2d",
+                        initial_cash=1_000_000,
+                        date_step_interval="1d",
+                        df=self.df)
+        # 行番号で期間を切り出すため、dateでソートされない fetch_mode は使えない
+        with self.assertRaises(ValueError):
+            WalkForward(strategy_factory=train_strategy,
+                        train_period="3d",
+                        test_period="2d",
+                        initial_cash=1_000_000,
+                        date_step_interval="1d",
+                        df=self.df,
+                        fetch_mode="mask")
+
+
+if __name__ == "__main__":
+    unittest.main()
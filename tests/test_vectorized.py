@@ -0,0 +1,128 @@
+import unittest
+import pandas as pd
+import numpy as np
+from backtestforstock.account import Account
+from backtestforstock.datafetchers.core import DataFetcher
+from backtestforstock.backtester import BackTester
+from backtestforstock.vectorized import VectorizedBackTester
+from backtestforstock.common import get_logger
+from backtestforstock.position import ArrayPositionManager
+from logging import WARNING
+from datetime import datetime as dt
+from helpers import ReplayStrategy, make_data
+
+
+class TestVectorizedBackTester(unittest.TestCase):
+
+    def _run_event_loop(self, df, initial_cash, array_position_manager=False, **kwargs):
+        logger = get_logger(level=WARNING)
+        account = Account(initial_cash=initial_cash,
+                          logger=logger,
+                          position_manager=ArrayPositionManager(logger=logger) if array_position_manager else None)
+        backtester = BackTester(data_fetcher=DataFetcher(df=df, start_datetime=df["date"].min()),
+                                strategy=ReplayStrategy(**kwargs),
+                                account=account,
+                                date_step_interval="1d")
+        backtester.run()
+        return account
+
+    def _make_orders(self, df, seed):
+        rng = np.random.default_rng(seed)
+        df_open = df.pivot(index="date", columns="code", values="open")
+        orders = pd.DataFrame(rng.choice([-300, -200, -100, 0, 100, 200, 300], size=df_open.shape).astype(float),
+                              index=df_open.index, columns=df_open.columns)
+        orders = orders.mask(rng.random(size=df_open.shape) < 0.3)
+        limit_prices = (df_open * rng.uniform(1.01, 1.1, size=df_open.shape)).mask(rng.random(size=df_open.shape) < 0.3)
+        stop_prices = (df_open * rng.uniform(0.9, 0.99, size=df_open.shape)).mask(rng.random(size=df_open.shape) < 0.3)
+        return orders, limit_prices, stop_prices
+
+    def _assert_same(self, account, result):
+        self.assertEqual(account.cash, result.cash)
+        self.assertEqual(account.history_manager.histories, result.history_manager.histories)
+        self.assertEqual(account.history_manager.id_max, result.history_manager.id_max)
+
+        def position_key(x):
+            callbacks = [(c.limit_price, c.stop_price) for c in x.callbacks]
+            return (x.id, x.date, x.code, x.category, x.amount, x.price, callbacks)
+        self.assertEqual([position_key(x) for x in account.position_manager.positions],
+                         [position_key(x) for x in result.positions])
+
+    def test_same_as_event_loop(self):
+        """
+        ランダムな注文・指値・逆指値で、イベントループと結果(現金、ポジション、履歴)が一致すること
+        現金不足が起きる初期資金も含める
+        """
+        df = make_data()
+        for seed, initial_cash in [(0, 10_000_000), (1, 200_000), (2, 50_000)]:
+            with self.subTest(seed=seed, initial_cash=initial_cash):
+                orders, limit_prices, stop_prices = self._make_orders(df, seed=seed)
+                account = self._run_event_loop(df, initial_cash=initial_cash, orders=orders,
+                                               limit_prices=limit_prices, stop_prices=stop_prices)
+                result = VectorizedBackTester(df_data=df, initial_cash=initial_cash).run(orders=orders,
+                                                                                         limit_prices=limit_prices,
+                                                                                         stop_prices=stop_prices)
+                self.assertGreater(len(result.history_manager.histories), 0)
+                self._assert_same(account, result)
+
+                account = self._run_event_loop(df, initial_cash=initial_cash, orders=orders, array_position_manager=True,
+                                               limit_prices=limit_prices, stop_prices=stop_prices)
+                self._assert_same(account, result)
+
+    def test_same_as_event_loop_fractional(self):
+        """
+        価格・初期資金が小数で現金不足が起きる場合も、現金が Account と(丸め誤差も含めて)一致すること
+        """
+        for seed, initial_cash in [(0, 30_000.7), (12, 30_000.7), (21, 30_000.7), (22, 80_000.3)]:
+            with self.subTest(seed=seed, initial_cash=initial_cash):
+                df = make_data(n_dates=30, seed=seed)
+                for col in ["open", "close", "high", "low"]:
+                    df[col] = df[col] * (1.0137 + 0.0001 * seed)
+                orders, limit_prices, stop_prices = self._make_orders(df, seed=seed)
+                account = self._run_event_loop(df, initial_cash=initial_cash, orders=orders,
+                                               limit_prices=limit_prices, stop_prices=stop_prices)
+                result = VectorizedBackTester(df_data=df, initial_cash=initial_cash).run(orders=orders,
+                                                                                         limit_prices=limit_prices,
+                                                                                         stop_prices=stop_prices)
+                self.assertIs(float, type(result.cash))
+                self._assert_same(account, result)
+
+    def test_same_as_event_loop_targets(self):
+        """
+        targetsで指定した場合も、イベントループと一致すること
+        """
+        df = make_data(seed=3)
+        rng = np.random.default_rng(3)
+        df_open = df.pivot(index="date", columns="code", values="open")
+        targets = pd.DataFrame(rng.choice([0, 100, 200, 300], size=df_open.shape).astype(float),
+                               index=df_open.index, columns=df_open.columns)
+        stop_prices = df_open * 0.95
+
+        account = self._run_event_loop(df, initial_cash=300_000, orders=targets, stop_prices=stop_prices,
+                                       is_target=True)
+        result = VectorizedBackTester(df_data=df, initial_cash=300_000).run(targets=targets, stop_prices=stop_prices)
+        self._assert_same(account, result)
+
+    def test_cash_history(self):
+        df = make_data(n_dates=3, n_codes=1)
+        orders = pd.DataFrame({"0000": [100., np.nan, -100.]}, index=pd.date_range(dt(2020, 1, 1), periods=3))
+        result = VectorizedBackTester(df_data=df, initial_cash=1_000_000).run(orders=orders)
+
+        df_open = df.set_index("date")["open"]
+        expect = [1_000_000 - df_open.iloc[0] * 100] * 2 + [1_000_000 + (df_open.iloc[2] - df_open.iloc[0]) * 100]
+        self.assertEqual(expect, result.cash_history.tolist())
+        self.assertEqual([], result.positions)
+
+    def test_error(self):
+        df = make_data(n_dates=3, n_codes=1)
+        backtester = VectorizedBackTester(df_data=df, initial_cash=1_000_000)
+        orders = pd.DataFrame({"0000": [100., np.nan, -100.]}, index=pd.date_range(dt(2020, 1, 1), periods=3))
+        with self.assertRaises(ValueError):
+            backtester.run()
+        with self.assertRaises(ValueError):
+            backtester.run(orders=orders, targets=orders)
+        with self.assertRaises(ValueError):
+            backtester.run(orders=orders.rename(columns={"0000": "9999"}))
+
+
+if __name__ == "__main__":
+    unittest.main()